@@ -1,13 +1,35 @@
 from flask import (Flask, url_for, redirect, request, render_template,
-                   jsonify, session, flash)
+                   jsonify, session, flash, g, Response)
 import sys
 import json
 import secrets
+import atexit
+import gzip
+import hashlib
+import threading
+import time
 import bcrypt
 import pymysql
-import cs304dbi as dbi
+from db_adapter import dbi
+from db_pool import ConnectionPool, PoolTimeout
+from write_behind import WriteBehindBuffer
+import course_cache
+import match
+import band
+import slot_codec
+import slot_grid
+import slot_index
+import office_hours
+import bounds
+import numpy as np
+import jobs
 
 DATABASE = 'scottdb'               # global for database to connect to
+POOL_SIZE = 10                     # most connections open at once
+POOL_TIMEOUT = 5.0                 # seconds to wait for a free connection
+WRITE_BEHIND = False               # buffer saves and write them in batches
+MATCH_WORKERS = None               # processes for matching jobs; None means one per CPU
+STREAM_TIME_LIMIT = 10.0           # most seconds a streamed matching may run
 
 # based this on https://flask.palletsprojects.com/en/2.3.x/appcontext/#manually-push-a-context
 def create_app():
@@ -20,20 +42,48 @@ def create_app():
 app = create_app()
 app.secret_key = secrets.token_hex(20)
 
+pool = ConnectionPool(dbi.connect, size=POOL_SIZE, timeout=POOL_TIMEOUT)
+
+def get_conn():
+    '''Returns this request's database connection, checking one out of
+    the pool the first time it's asked for. It goes back to the pool
+    when the request is over; see return_conn, below.'''
+    if 'conn' not in g:
+        g.conn = pool.checkout()
+    return g.conn
+
+@app.teardown_appcontext
+def return_conn(exception):
+    conn = g.pop('conn', None)
+    if conn is not None:
+        pool.checkin(conn)
+
+def bump_saved_courses(keys):
+    '''Called after a write-behind flush, with the (course, email) keys
+    that were written.'''
+    for course in set(course for course, email in keys):
+        course_cache.bump(course)
+
+# With write-behind on, /save/ only updates an in-memory buffer, which is
+# flushed to the database in batches. See write_behind.py
+if WRITE_BEHIND:
+    writer = WriteBehindBuffer(pool, on_flush=bump_saved_courses)
+    atexit.register(writer.close)
+else:
+    writer = None
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout(error):
+    return jsonify({'error': 'server busy; please try again'}), 503
+
 @app.route('/')
 def home():
     return render_template('home.html')
     
 @app.route('/list-courses/')
 def list_courses():
-    conn = dbi.connect()
-    curs = dbi.cursor(conn)
-    # find courses with at least one student
-    curs.execute('''select course from when_to_pair
-                    group by course
-                    having count(*) > 0''')
-    rows = curs.fetchall()
-    courses = [ row[0] for row in rows ]
+    conn = get_conn()
+    courses = match.list_courses(conn)
     if len(courses) == 0:
         flash('No courses found')
         return redirect(url_for('home'))
@@ -44,15 +94,18 @@ def get_course():
     course = request.args['course']
     return redirect(url_for('display_course', course_id=course))
 
+def course_students(course):
+    '''The emails and names of the course's students, as dictionaries,
+    ordered by name, whichever grid the course is on.'''
+    studs = match.read_students(get_conn(), course).values()
+    return sorted(({'student_email': stud['student_email'],
+                    'student_name': stud['student_name']}
+                   for stud in studs),
+                  key=lambda stud: stud['student_name'])
+
 @app.route('/course/<course_id>')
 def display_course(course_id):
-    conn = dbi.connect()
-    curs = dbi.dict_cursor(conn)
-    curs.execute('''select student_email, student_name from when_to_pair
-                    where course = %s
-                    order by student_name ASC''',
-                 [course_id])
-    studs = curs.fetchall()
+    studs = course_students(course_id)
     if len(studs) == 0:
         flash('No students in that course')
         return redirect(url_for('home'))
@@ -62,12 +115,7 @@ def display_course(course_id):
 
 @app.route('/compare/<course_id>')
 def compare_two_students(course_id):
-    conn = dbi.connect()
-    curs = dbi.dict_cursor(conn)
-    curs.execute('''select student_email, student_name from when_to_pair
-                    where course = %s''',
-                 [course_id])
-    studs = curs.fetchall()
+    studs = course_students(course_id)
     if len(studs) == 0:
         flash('No students in that course')
         return redirect(url_for('home'))
@@ -80,12 +128,6 @@ days_of_the_week = 'Sun,Mon,Tue,Wed,Thu,Fri,Sat'.split(',')
 
 @app.route('/save/', methods=["POST"])
 def save_schedule():
-    print('form is json?', request.is_json)
-    if request.is_json:
-        print('form json', request.json)
-    else:
-        print('form data keys', request.form.keys())
-        
     course = request.form.get('courseId')
     if not course:
         return jsonify({'error': 'missing key: courseId'})
@@ -102,12 +144,18 @@ def save_schedule():
             slots.append(slot)
     if len(day_errors) > 0:
         return jsonify({'error': 'missing day keys: '+','.join(day_errors)})
-    print('slots', slots)
+    # usually remembered, so no connection is taken for the write-behind
+    grid = slot_grid.course_grid(get_conn, course)
+    if grid is not None:
+        return save_grid_schedule(course, email, grid, slots)
+    if writer is not None:
+        # write-behind: the background thread will write it soon
+        writer.put(course, email, slots)
+        return jsonify({'error': False})
     slots.append(course)
     slots.append(email)
-    conn = dbi.connect()
+    conn = get_conn()
     curs = dbi.cursor(conn)
-    print('slots', slots)
     nrows = curs.execute('''update when_to_pair
                             set Sun = %s, Mon = %s, Tue = %s, Wed = %s, Thu = %s, Fri = %s, Sat = %s
                             where course = %s and student_email = %s''',
@@ -116,8 +164,29 @@ def save_schedule():
     if nrows == 0:
         return jsonify({'error': 'zero rows updated; wrong course or email?'})
     else:
+        course_cache.bump(course)
+        # patch the cached index rather than rebuilding it
+        week = [ parse_set(day) for day in slots[:7] ]
+        course_cache.carry(course, 'slot-index',
+                           lambda index: index.updated(email, week))
         return jsonify({'error': False})
 
+def save_grid_schedule(course, email, grid, slots):
+    '''/save/ for a course with its own grid, where each day is a list of
+    the grid's slot labels, like the SET values of the standard one.'''
+    week = [ grid.codec.encode(label for label in value.split(',') if label in grid.codec.bit)
+             for value in slots ]
+    nrows = slot_grid.update_grid_schedule(get_conn(), course, grid, email, week)
+    if nrows == 0:
+        return jsonify({'error': 'zero rows updated; wrong course or email?'})
+    course_cache.bump(course)
+    return jsonify({'error': False})
+
+def parse_set(value):
+    '''The day int for a SET value, like '900,930,1400' '''
+    return slot_codec.encode(label for label in value.split(',')
+                             if label in slot_codec.codec.bit)
+
 @app.route('/get-schedule/')
 def get_schedule():
     email = request.args.get('student')
@@ -126,8 +195,10 @@ def get_schedule():
         return jsonify({'error': 'no email'})
     if course is None or course == '':
         return jsonify({'error': 'no courseId'})
-    print('args', [course, email])
-    conn = dbi.connect()
+    conn = get_conn()
+    grid = slot_grid.course_grid(conn, course)
+    if grid is not None:
+        return get_grid_schedule(conn, course, email, grid)
     curs = dbi.cursor(conn)
     # have to add zero to get the numeric value. tedious, but okay
     nrows = curs.execute('''select course, student_email, student_name,
@@ -139,9 +210,403 @@ def get_schedule():
         return jsonify({'error': 'no schedule found; wrong course or email?'})
     else:
         row = curs.fetchone()
-        print('row', row)
-        return jsonify({'error': False, 'row': row})
-    
+        ranges = [ slot_codec.ranges(int(day)) for day in row[3:] ]
+        return jsonify({'error': False, 'row': row, 'ranges': ranges})
+
+def get_grid_schedule(conn, course, email, grid):
+    '''/get-schedule/ for a course with its own grid; the row is the
+    same, but the day ints are on the grid (see /course/<id>/grid).'''
+    for stud in slot_grid.read_grid_students(conn, course, grid):
+        if stud['student_email'] == email:
+            week = match.student_week(stud)
+            return jsonify({'error': False,
+                            'row': [course, email, stud['student_name']] + week,
+                            'ranges': [ grid.codec.ranges(day) for day in week ]})
+    return jsonify({'error': 'no schedule found; wrong course or email?'})
+
+
+def read_course_schedules(course):
+    '''Returns a dictionary with parallel lists of the emails, names and
+    schedules (7 ints each) of everyone in the course, ordered by
+    name. For a course with its own grid, the ints are on that grid,
+    and the dictionary has the grid under 'grid' (a SlotGrid, which
+    encode_course_schedules replaces with its spec).'''
+    conn = get_conn()
+    grid = slot_grid.course_grid(conn, course)
+    if grid is not None:
+        studs = sorted(slot_grid.read_grid_students(conn, course, grid),
+                       key=lambda stud: stud['student_name'])
+        return {'course': course,
+                'grid': grid,
+                'emails': [ stud['student_email'] for stud in studs ],
+                'names': [ stud['student_name'] for stud in studs ],
+                'schedules': [ match.student_week(stud) for stud in studs ]}
+    curs = dbi.cursor(conn)
+    curs.execute('''select student_email, student_name,
+                           sun+0, mon+0, tue+0, wed+0, thu+0, fri+0, sat+0
+                    from when_to_pair
+                    where course = %s
+                    order by student_name ASC''',
+                 [course])
+    rows = curs.fetchall()
+    return {'course': course,
+            'emails': [ row[0] for row in rows ],
+            'names': [ row[1] for row in rows ],
+            'schedules': [ [ int(val) for val in row[2:] ] for row in rows ]}
+
+def encode_course_schedules(course, with_ranges=False):
+    '''Returns the compact JSON for the whole course, its gzipped form,
+    and an ETag that's a hash of the content, or None if there are no
+    students. If with_ranges, the JSON also has each day as a list of
+    ranges like 10:00–13:30.'''
+    data = read_course_schedules(course)
+    if len(data['emails']) == 0:
+        return None
+    codec = slot_codec.codec
+    if 'grid' in data:
+        codec = data['grid'].codec
+        data['grid'] = data['grid'].spec()
+    if with_ranges:
+        data['ranges'] = [ [ codec.ranges(day) for day in week ]
+                           for week in data['schedules'] ]
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest()[:20]
+    return {'body': body, 'gzipped': gzip.compress(body), 'etag': etag}
+
+@app.route('/course/<course_id>/grid')
+def course_grid(course_id):
+    '''The course's slot grid, so a page can draw it: the slot length,
+    the start and end of the day, and the slot labels, which are what
+    /save/ takes. Courses without their own grid get the standard one.'''
+    grid = slot_grid.read_grid(get_conn(), course_id)
+    return jsonify({'slot_minutes': grid.slot_minutes,
+                    'start': slot_grid.format_minutes(grid.start_minute),
+                    'end': slot_grid.format_minutes(grid.end_minute),
+                    'labels': grid.labels})
+
+@app.route('/course/<course_id>/schedules')
+def course_schedules(course_id):
+    '''Everyone's schedules in one response. Supports conditional GET
+    (If-None-Match) and gzip, and is cached until someone saves. Add
+    ranges=1 to the query string for readable time ranges as well.'''
+    with_ranges = request.args.get('ranges') == '1'
+    encoded = course_cache.get(course_id, 'schedules-ranges' if with_ranges else 'schedules',
+                               lambda: encode_course_schedules(course_id, with_ranges))
+    if encoded is None:
+        return jsonify({'error': 'no students in that course'}), 404
+    etag = encoded['etag']
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    elif 'gzip' in request.accept_encodings:
+        resp = Response(encoded['gzipped'], mimetype='application/json')
+        resp.headers['Content-Encoding'] = 'gzip'
+    else:
+        resp = Response(encoded['body'], mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+def compute_course_overlaps(course):
+    '''Returns the students of the course sorted by total free time,
+    least first (as in match.pair_overlap_table), along with the matrix
+    of their pairwise overlap scores. None if there are no students.'''
+    data = read_course_schedules(course)
+    if len(data['emails']) == 0:
+        return None
+    if 'grid' in data:
+        # days can be wider than band's 32 bits
+        roster = slot_grid.GridBitset.from_day_ints(data['grid'], data['schedules'])
+    else:
+        roster = band.Roster(data['emails'], data['names'], data['schedules'], course)
+    free = roster.free_time()
+    # stable, so ties stay in name order
+    order = np.argsort(free, kind='stable')
+    return {'course': course,
+            'emails': np.array(data['emails'])[order].tolist(),
+            'names': np.array(data['names'])[order].tolist(),
+            'free_time': free[order].tolist(),
+            'scores': roster.score_matrix()[np.ix_(order, order)].tolist()}
+
+@app.route('/course/<course_id>/overlaps')
+def course_overlaps(course_id):
+    '''The matrix of overlap scores for the course. Query parameters:
+
+    start, stop: return only those rows (like a Python slice)
+    top: instead of whole rows, return each student's top N partners,
+         as [index, score] pairs, best first
+    '''
+    overlaps = course_cache.get(course_id, 'overlaps',
+                                lambda: compute_course_overlaps(course_id))
+    if overlaps is None:
+        return jsonify({'error': 'no students in that course'}), 404
+    n = len(overlaps['emails'])
+    try:
+        start = int(request.args.get('start', 0))
+        stop = int(request.args.get('stop', n))
+        top = request.args.get('top')
+        top = None if top is None else int(top)
+    except ValueError:
+        return jsonify({'error': 'start, stop and top must be integers'})
+    start, stop, step = slice(start, stop).indices(n)
+    rows = overlaps['scores'][start:stop]
+    result = {'error': False,
+              'course': course_id,
+              'emails': overlaps['emails'],
+              'names': overlaps['names'],
+              'free_time': overlaps['free_time'],
+              'start': start,
+              'stop': stop}
+    if top is None:
+        result['scores'] = rows
+    else:
+        result['partners'] = [
+            sorted(([ j, score ] for j, score in enumerate(row) if j != start + i),
+                   key=lambda pair: pair[1], reverse=True)[:top]
+            for i, row in enumerate(rows) ]
+    return jsonify(result)
+
+def compute_slot_index(course):
+    data = read_course_schedules(course)
+    if len(data['emails']) == 0:
+        return None
+    if 'grid' in data:
+        return slot_index.SlotIndex(data['emails'], data['names'], data['schedules'],
+                                    codec=data['grid'].codec)
+    return slot_index.SlotIndex(data['emails'], data['names'], data['schedules'])
+
+def wide_grid_error(course):
+    '''SlotIndex, and so /free and /office-hours, keeps a day in 32 bits.
+    Returns an error response for a course whose grid has more slots
+    than that, or None.'''
+    grid = slot_grid.course_grid(get_conn, course)
+    if grid is not None and grid.n_slots > 32:
+        return jsonify({'error': f"this course's grid has {grid.n_slots} slots a day; "
+                                 f"only grids of up to 32 slots can be searched"}), 400
+    return None
+
+@app.route('/course/<course_id>/free')
+def course_free(course_id):
+    '''Who is free when. Query parameters, any of which may be combined
+    (a student has to satisfy all of them):
+
+    day, from, to: free on day (like tue) from one time to another,
+        like 14:00 and 16:00. With mode=any, at any time in that range.
+    slots: a list like tue:1400,thu:1430; free at all of them, or any
+        of them with mode=any
+    with, min_hours: shares at least min_hours free hours with the
+        student with this email
+    '''
+    error = wide_grid_error(course_id)
+    if error is not None:
+        return error
+    index = course_cache.get(course_id, 'slot-index',
+                             lambda: compute_slot_index(course_id))
+    if index is None:
+        return jsonify({'error': 'no students in that course'}), 404
+    mode = request.args.get('mode', 'all')
+    day_numbers = { day.lower(): i for i,day in enumerate(days_of_the_week) }
+    result = (1 << len(index)) - 1
+    try:
+        day = request.args.get('day')
+        if day is not None:
+            result &= index.free_range(day_numbers[day.lower()],
+                                       request.args['from'], request.args['to'], mode)
+        slots = request.args.get('slots')
+        if slots:
+            chosen = 0 if mode == 'any' else result
+            for item in slots.split(','):
+                day, label = item.split(':')
+                bitmap = index.bitmaps[day_numbers[day.lower()]][index.codec.bit[label]]
+                chosen = (chosen | bitmap) if mode == 'any' else (chosen & bitmap)
+            result &= chosen
+        other = request.args.get('with')
+        if other is not None:
+            min_slots = float(request.args.get('min_hours', 0)) * 60 / index.codec.slot_minutes
+            result &= index.overlapping(other, min_slots)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'bad query; see the docs for /course/<id>/free'})
+    members = index.members(result)
+    return jsonify({'error': False,
+                    'course': course_id,
+                    'count': len(members),
+                    'students': [ {'email': index.emails[i], 'name': index.names[i]}
+                                  for i in members ]})
+
+@app.route('/course/<course_id>/office-hours', methods=['GET', 'POST'])
+def course_office_hours(course_id):
+    '''The k office-hour sessions of the given length that the most
+    students can come to. Query parameters (or JSON, if POSTed):
+
+    k: the number of sessions (default 3)
+    hours: the length of each session (default 1)
+    weights: (JSON only) a dictionary of email => weight; students not
+        in it have weight 1
+    '''
+    error = wide_grid_error(course_id)
+    if error is not None:
+        return error
+    index = course_cache.get(course_id, 'slot-index',
+                             lambda: compute_slot_index(course_id))
+    if index is None:
+        return jsonify({'error': 'no students in that course'}), 404
+    # request.args is a MultiDict, which is a dict too, so weights only
+    # come from a JSON body
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        body = None
+    params = body if body is not None else request.args
+    try:
+        k = int(params.get('k', 3))
+        length = round(float(params.get('hours', 1)) * 60 / index.codec.slot_minutes)
+        weights = body.get('weights') if body is not None else None
+        if weights is not None and not isinstance(weights, dict):
+            raise TypeError('weights')
+        weights = None if not weights else [ float(weights.get(email, 1)) for email in index.emails ]
+    except (ValueError, TypeError):
+        return jsonify({'error': 'k must be an integer, hours a number and weights a dictionary'})
+    if not 0 < length <= len(index.codec.labels) or k < 1:
+        return jsonify({'error': 'bad k or hours'})
+    blocks = office_hours.best_blocks(index.avail, k, length, weights,
+                                      n_slots=len(index.codec.labels))
+    sessions = []
+    anyone = np.zeros(len(index), dtype=bool)
+    for day, first, students in blocks:
+        span = index.codec.ranges(((1 << length) - 1) << first)[0]
+        sessions.append({'day': days_of_the_week[day],
+                         'time': span,
+                         'count': int(students.sum()),
+                         'new': int((students & ~anyone).sum())})
+        anyone |= students
+    return jsonify({'error': False,
+                    'course': course_id,
+                    'sessions': sessions,
+                    'covered': int(anyone.sum()),
+                    'students': len(index),
+                    'uncovered': [ index.emails[i] for i in np.flatnonzero(~anyone).tolist() ]})
+
+# ================================================================
+# Matching jobs. See jobs.py
+
+job_manager = None
+
+def get_job_manager():
+    '''The worker pool is started on first use, not at import.'''
+    global job_manager
+    if job_manager is None:
+        job_manager = jobs.JobManager(max_workers=MATCH_WORKERS, on_done=store_result)
+        atexit.register(job_manager.shutdown)
+    return job_manager
+
+def lookup_result(conn, key):
+    '''Returns the stored matching for the result key, or None.'''
+    curs = dbi.cursor(conn)
+    curs.execute('''select result from when_to_pair_results
+                    where course = %s and algorithm = %s and params_hash = %s and schedule_hash = %s''',
+                 list(key))
+    row = curs.fetchone()
+    return None if row is None else json.loads(row[0])
+
+def store_result(key, params, result):
+    '''Called by the job manager when a job finishes.'''
+    conn = pool.checkout()
+    try:
+        curs = dbi.cursor(conn)
+        curs.execute('''insert into when_to_pair_results(course, algorithm, params_hash, schedule_hash, params, score, result)
+                        values(%s, %s, %s, %s, %s, %s, %s)
+                        on duplicate key update score = values(score), result = values(result)''',
+                     list(key) + [jobs.params_json(params), result['score'], json.dumps(result)])
+        conn.commit()
+    finally:
+        pool.checkin(conn)
+
+@app.route('/course/<course_id>/match', methods=['POST'])
+def match_course(course_id):
+    '''Starts a matching job, or returns the stored result if this
+    course has been matched this way before with the same schedules.
+    Query parameters are algo (see jobs.ALGORITHMS) and budget (random
+    restarts, for hill_climbing). A JSON body may give constraints, as
+    for match.Constraints.from_dict, like
+    {"must_not_pair": [["ab1", "cd2"]], "penalties": [["ef3", "gh4", 10]]}'''
+    algo = request.args.get('algo', 'greedy')
+    if algo not in jobs.ALGORITHMS:
+        return jsonify({'error': 'unknown algorithm; try one of '+','.join(jobs.ALGORITHMS)})
+    try:
+        budget = int(request.args.get('budget', 1))
+    except ValueError:
+        return jsonify({'error': 'budget must be an integer'})
+    params = {'budget': budget} if algo == 'hill_climbing' else {}
+    body = request.get_json(silent=True) or {}
+    constraints = body.get('constraints') if isinstance(body, dict) else None
+    if constraints:
+        try:
+            match.Constraints.from_dict(constraints)
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({'error': 'constraints must be lists of pairs; see match.Constraints'})
+        params['constraints'] = constraints
+    conn = get_conn()
+    students = list(match.read_students(conn, course_id).values())
+    if len(students) == 0:
+        return jsonify({'error': 'no students in that course'}), 404
+    key = jobs.result_key(course_id, algo, params, students)
+    result = lookup_result(conn, key)
+    if result is not None:
+        return jsonify({'error': False, 'status': 'done', 'result': result})
+    job_id = get_job_manager().submit(key, students, algo, budget, constraints, params)
+    return jsonify({'error': False,
+                    'status': 'queued',
+                    'job': job_id,
+                    'url': url_for('job_status', job_id=job_id)}), 202
+
+@app.route('/job/<job_id>')
+def job_status(job_id):
+    status = None if job_manager is None else job_manager.status(job_id)
+    if status is None:
+        return jsonify({'error': 'no such job'}), 404
+    status['error'] = status.get('error', False)
+    return jsonify(status)
+
+@app.route('/course/<course_id>/match/stream')
+def stream_matching(course_id):
+    '''Server-Sent Events: an 'improvement' event with the matching as
+    JSON each time a better one is found, then a 'done' event. Query
+    parameters are algo (see match.anytime_algorithms) and time_limit
+    in seconds. Each matching comes with the upper bound on the score
+    and its gap from it (see bounds.py). The search stops if the client
+    goes away.'''
+    algo = request.args.get('algo', 'hill_climbing')
+    if algo not in match.anytime_algorithms:
+        return jsonify({'error': 'unknown algorithm; try one of '+','.join(match.anytime_algorithms)})
+    try:
+        time_limit = min(float(request.args.get('time_limit', STREAM_TIME_LIMIT)),
+                         STREAM_TIME_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'time_limit must be a number'})
+    students = list(match.read_students(get_conn(), course_id).values())
+    if len(students) == 0:
+        return jsonify({'error': 'no students in that course'}), 404
+    ctx = match.MatchingContext(students)
+    bound = bounds.upper_bound(ctx)
+    cancel = threading.Event()
+    deadline = time.monotonic() + time_limit
+
+    def events():
+        improvements = match.matching_anytime(students, algo, deadline, cancel, ctx)
+        try:
+            for imp in improvements:
+                result = imp.to_dict()
+                result['upper_bound'] = bound
+                result['gap'] = bounds.gap(imp.score, bound)
+                yield 'event: improvement\ndata: ' + json.dumps(result) + '\n\n'
+            yield 'event: done\ndata: {}\n\n'
+        finally:
+            # runs when the client disconnects, too
+            cancel.set()
+            improvements.close()
+
+    resp = Response(events(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
 
 # See https://stackoverflow.com/questions/25860304/how-do-i-set-response-headers-in-flask
 @app.after_request
@@ -149,6 +614,13 @@ def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     return response
     
+@app.route('/pool-stats/')
+def pool_stats():
+    stats = pool.stats()
+    if writer is not None:
+        stats['write_behind'] = dict(writer.stats, pending=writer.pending_count())
+    return jsonify(stats)
+
 @app.route('/info/')
 def info():
     return f'<h2>Python Path</h2><p>{sys.path}</p>'
@@ -0,0 +1,179 @@
+'''Two-sided matching: mentors with mentees, or TAs with lab groups.
+
+match.py pairs people within one roster. Here there are two rosters,
+and everyone on one side (the mentees) is assigned to someone on the
+other (the mentors), each of whom can take up to some number of them.
+That's the assignment problem, which the Hungarian algorithm solves
+exactly in O(n^3) time.
+
+The cross scores (every mentor's overlap score with every mentee) come
+from band's vectorized kernels, a block of mentors at a time.
+
+hungarian is the shortest augmenting path version (as in Jonker and
+Volgenant, or scipy's linear_sum_assignment), with the inner loop over
+columns done by NumPy. It adds one row at a time, finding the cheapest
+way to fit it in by adjusting the potentials u and v, so that
+cost[i, j] - u[i] - v[j] is never negative and is zero for assigned
+pairs. A mentor with capacity c could be c identical columns, but that
+makes the searches c times longer, so instead a column takes up to its
+capacity of rows, and a search that reaches a full column carries on
+from all of its rows at once.
+
+'''
+
+import numpy as np
+import band
+
+def cross_scores(mentors, mentees, block=256):
+    '''The (len(mentors), len(mentees)) int32 array of overlap scores,
+    where both are band.Rosters.'''
+    scores = np.zeros((len(mentors), len(mentees)), dtype=np.int32)
+    for start in range(0, len(mentors), block):
+        scores[start:start+block] = band.block_scores(mentors.avail[start:start+block],
+                                                      mentees.avail)
+    return scores
+
+def hungarian(cost, capacity=None):
+    '''Minimum cost assignment for a 2D cost array, where each row gets
+    one column and column j can take up to capacity[j] rows (default 1).
+    Returns arrays rows and cols, where row rows[k] is assigned column
+    cols[k], sorted by row. If there are more rows than places, the
+    rows left out are whichever is cheapest.'''
+    cost = np.asarray(cost, dtype=float)
+    n, m = cost.shape
+    real = m
+    if capacity is None:
+        capacity = np.ones(m, dtype=np.int64)
+    capacity = np.broadcast_to(np.asarray(capacity, dtype=np.int64), (m,)).copy()
+    if capacity.sum() < n:
+        # a dummy column for the rows left out
+        cost = np.hstack([cost, np.zeros((n, 1))])
+        capacity = np.append(capacity, n - capacity.sum())
+        m += 1
+    u = np.zeros(n)
+    v = np.zeros(m)
+    col_of = np.full(n, -1, dtype=np.int64)
+    count = np.zeros(m, dtype=np.int64)
+    way_col = np.zeros(m, dtype=np.int64)      # previous column on the path; -1 for the new row
+    way_row = np.zeros(m, dtype=np.int64)      # row the path takes into this column
+    # Warm start: with u as the row minimums, reduced costs are never
+    # negative, and zero at each row's cheapest column, so a row can
+    # take that column if there's room. Only the rest need augmenting
+    # paths.
+    closed = capacity == 0
+    u[:] = np.where(closed, np.inf, cost).min(axis=1)
+    all_cols = np.arange(m)
+    unassigned = []
+    for i, j in enumerate(np.argmin(np.where(closed, np.inf, cost), axis=1).tolist()):
+        if count[j] < capacity[j]:
+            col_of[i] = j
+            count[j] += 1
+        else:
+            unassigned.append(i)
+    for i in unassigned:
+        # Dijkstra over the columns, in reduced costs. A full column
+        # leads on to its rows, at no extra cost since their edges are
+        # tight; the first column with room ends the path.
+        dist = np.full(m, np.inf)
+        used = closed.copy()
+        visited = [i]
+        row_dist = [0.0]
+        new_rows = np.array([i])
+        j0 = -1
+        d0 = 0.0
+        while True:
+            reduced = cost[new_rows] - u[new_rows, None] - v
+            best = reduced.argmin(axis=0)
+            reduced = reduced[best, all_cols] + d0
+            better = ~used & (reduced < dist)
+            dist[better] = reduced[better]
+            way_col[better] = j0
+            way_row[better] = new_rows[best[better]]
+            j1 = int(np.where(used, np.inf, dist).argmin())
+            if count[j1] < capacity[j1]:
+                break
+            # j1 is full: carry on from its rows
+            used[j1] = True
+            j0 = j1
+            d0 = dist[j1]
+            new_rows = np.flatnonzero(col_of == j1)
+            visited.extend(new_rows.tolist())
+            row_dist.extend([d0] * len(new_rows))
+        # update the potentials, so the path's edges become tight
+        total = dist[j1]
+        u[visited] += total - np.array(row_dist)
+        settled = used & ~closed
+        v[settled] -= total - dist[settled]
+        # flip the augmenting path
+        count[j1] += 1
+        j = j1
+        while j >= 0:
+            col_of[way_row[j]] = j
+            j = way_col[j]
+    rows = np.flatnonzero((col_of >= 0) & (col_of < real))
+    return rows, col_of[rows]
+
+def assign(mentors, mentees, capacity=1, scores=None):
+    '''Assigns mentees to mentors (both band.Rosters) to maximize the
+    total overlap score. capacity is the most mentees per mentor, either
+    one number or one per mentor. If there isn't enough capacity for
+    everyone, some mentees are left unassigned. Returns an Assignment.'''
+    if scores is None:
+        scores = cross_scores(mentors, mentees)
+    # mentees are rows; costs are negated scores, so minimizing maximizes
+    rows, cols = hungarian(-scores.T, capacity)
+    mentor_of = np.full(len(mentees), -1, dtype=np.int64)
+    mentor_of[rows] = cols
+    return Assignment(mentors, mentees, mentor_of, scores)
+
+class Assignment:
+    def __init__(self, mentors, mentees, mentor_of, scores):
+        self.mentors = mentors
+        self.mentees = mentees
+        self.mentor_of = mentor_of       # per mentee; -1 if unassigned
+        self.scores = scores
+
+    def assigned(self):
+        return np.flatnonzero(self.mentor_of >= 0)
+
+    def pair_scores(self):
+        '''scores of each assigned mentee with their mentor'''
+        mentees = self.assigned()
+        return self.scores[self.mentor_of[mentees], mentees]
+
+    def total(self):
+        return int(self.pair_scores().sum())
+
+    def lowest(self):
+        pair_scores = self.pair_scores()
+        return int(pair_scores.min()) if len(pair_scores) > 0 else 0
+
+    def groups(self):
+        '''list, per mentor, of the indexes of their mentees'''
+        result = [ [] for i in range(len(self.mentors)) ]
+        for mentee in self.assigned().tolist():
+            result[self.mentor_of[mentee]].append(mentee)
+        return result
+
+    def __str__(self):
+        result = ''
+        for mentor, mentees in enumerate(self.groups()):
+            result += self.mentors.names[mentor] + ':\n'
+            for mentee in mentees:
+                result += f'    {self.mentees.names[mentee]} ({self.scores[mentor, mentee]})\n'
+        for mentee in np.flatnonzero(self.mentor_of < 0).tolist():
+            result += 'unassigned:  ' + self.mentees.names[mentee] + '\n'
+        result += f'score: {self.total()}\n'
+        result += f'lowest: {self.lowest()}\n'
+        return result
+
+    def to_dict(self):
+        '''For JSON'''
+        return {'groups': [ {'mentor': self.mentors.emails[mentor],
+                             'mentees': [ [self.mentees.emails[mentee], int(self.scores[mentor, mentee])]
+                                          for mentee in mentees ]}
+                            for mentor, mentees in enumerate(self.groups()) ],
+                'unassigned': [ self.mentees.emails[mentee]
+                                for mentee in np.flatnonzero(self.mentor_of < 0).tolist() ],
+                'score': self.total(),
+                'lowest_score': self.lowest()}
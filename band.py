@@ -9,8 +9,18 @@ college course, where we want them to be able to work together.
 
 Actually, "roster" is a pretty good word, too.
 
+The Roster stores its people by column rather than by row: one NumPy
+array of shape (n, 7) holds everyone's availability, one 32-bit int per
+day, and there are parallel arrays of emails and names. That's far
+smaller than a dictionary per student, and it means that scores can be
+computed for many pairs at once with NumPy, rather than one pair at a
+time in a Python loop. A Person is just a view of one row, made when
+asked for.
+
 '''
 
+import numpy as np
+
 # Days of the week are numbered starting at zero for Sunday, abbreviate to 3 letters
 
 number_to_day = 'sun,mon,tue,wed,thu,fri,sat'.split(',')
@@ -18,13 +28,267 @@ number_to_day = 'sun,mon,tue,wed,thu,fri,sat'.split(',')
 # Dictionary mapping day names to their index
 
 day_to_number = { number_to_day[idx]: idx
-                  for idx in range(len(number_to_day) }
+                  for idx in range(len(number_to_day)) }
+
+# ================================================================
+# Vectorized kernels. All of these take arrays of unsigned ints, with
+# one bit per time slot, and work elementwise.
+
+# bits set in each byte value, for NumPy versions without bitwise_count
+_byte_popcount = np.array([ bin(i).count('1') for i in range(256) ], dtype=np.uint8)
+
+def popcount(arr):
+    '''Number of 1 bits in each element of a uint32 array.'''
+    arr = np.asarray(arr, dtype=np.uint32)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(arr)
+    return (_byte_popcount[arr & 0xFF] +
+            _byte_popcount[(arr >> 8) & 0xFF] +
+            _byte_popcount[(arr >> 16) & 0xFF] +
+            _byte_popcount[arr >> 24])
+
+def run_starts(arr):
+    '''Keeps only the first bit of each run of 1 bits, so the popcount
+    of the result is the number of runs.'''
+    arr = np.asarray(arr, dtype=np.uint32)
+    return arr & ~(arr << np.uint32(1))
+
+def day_scores(sched_a, sched_b):
+    '''Vectorized match.day_score: overlapping slots minus the number of
+    overlapping sessions.'''
+    overlap = np.bitwise_and(sched_a, sched_b, dtype=np.uint32)
+    return (popcount(overlap).astype(np.int32) -
+            popcount(run_starts(overlap)).astype(np.int32))
+
+def longest_runs(arr):
+    '''For each element of a uint32 array, the length and first bit of
+    its longest run of 1 bits (the earliest, if there's a tie), as two
+    int arrays; (0, 0) where there are no 1 bits.
+
+    After k steps of y &= y >> 1, the bits left in y are where runs of
+    at least k+1 bits start, so the number of steps before y is zero is
+    the longest run, and the lowest bit of the last nonzero y is where
+    it starts.'''
+    y = np.asarray(arr, dtype=np.uint32)
+    length = np.zeros(y.shape, dtype=np.int32)
+    last = y
+    while y.any():
+        nonzero = y != 0
+        length += nonzero
+        last = np.where(nonzero, y, last)
+        y = y & (y >> np.uint32(1))
+    lowest = last & (~last + np.uint32(1))
+    first = popcount(lowest - np.uint32(1)).astype(np.int32)
+    first[length == 0] = 0
+    return length, first
+
+def meeting_blocks(avail_a, avail_b, top=3):
+    '''For P pairs of weeks, given as two (P, 7) arrays, the top longest
+    common free periods of each pair, longest first, then earliest.
+    Returns three (P, top) int arrays: day, first slot and length (0 if
+    there aren't that many periods).'''
+    both = (np.asarray(avail_a, dtype=np.uint32) &
+            np.asarray(avail_b, dtype=np.uint32)).reshape(-1, 7)
+    pairs = np.arange(len(both))
+    days = np.zeros((len(both), top), dtype=np.int32)
+    firsts = np.zeros((len(both), top), dtype=np.int32)
+    lengths = np.zeros((len(both), top), dtype=np.int32)
+    for k in range(top):
+        length, first = longest_runs(both)
+        day = np.argmax(length, axis=1)      # the first day, among ties
+        days[:, k] = day
+        firsts[:, k] = first[pairs, day]
+        lengths[:, k] = length[pairs, day]
+        # remove that period, so the next round finds the next one
+        mask = (((np.uint64(1) << lengths[:, k].astype(np.uint64)) - np.uint64(1))
+                << firsts[:, k].astype(np.uint64)).astype(np.uint32)
+        both[pairs, day] &= ~mask
+    return days, firsts, lengths
+
+def unique_profiles(avail):
+    '''Many students have identical schedules: all zeros, because they
+    never filled it in, or the same free-outside-class pattern from a
+    shared section. Returns the distinct rows of the (n, 7) avail array,
+    the index of each person's row among them, and how many people have
+    each one.'''
+    unique, profile_of, counts = np.unique(avail, axis=0,
+                                           return_inverse=True, return_counts=True)
+    return unique, profile_of.reshape(-1), counts
+
+def block_scores(rows, avail):
+    '''The (len(rows), n) int32 array of the overlap scores of each of
+    rows with each row of avail; both are (_, 7) arrays.'''
+    scores = np.zeros((len(rows), len(avail)), dtype=np.int32)
+    for day in range(7):
+        scores += day_scores(rows[:, None, day], avail[None, :, day])
+    return scores
+
+def block_counts(rows, avail):
+    '''Like block_scores, but just the number of slots each pair has in
+    common.'''
+    return popcount(rows[:, None, :] & avail[None, :, :]).sum(axis=2, dtype=np.int32)
+
+def score_matrix(avail, block=256, zero_diagonal=True):
+    '''The n x n int32 array of overlap scores of the rows of an (n, 7)
+    avail array, computed block rows at a time, to limit the size of the
+    temporary arrays. The diagonal (each schedule with itself) is zero
+    unless zero_diagonal is false.'''
+    n = len(avail)
+    scores = np.zeros((n, n), dtype=np.int32)
+    for start in range(0, n, block):
+        scores[start:start+block] = block_scores(avail[start:start+block], avail)
+    if zero_diagonal:
+        np.fill_diagonal(scores, 0)
+    return scores
+
+# ================================================================
 
 class Person:
-    def __init__(self, name, email, 
+    '''A view of one row of a Roster. It can be indexed like the student
+    dictionaries that match.read_students returns (stud['student_name'],
+    stud['mon_i'] and so on), so it works with the code in match.py.'''
+    __slots__ = ('roster', 'index')
+
+    def __init__(self, roster, index):
+        self.roster = roster
+        self.index = index
+
+    @property
+    def email(self):
+        return self.roster.emails[self.index]
+
+    @property
+    def name(self):
+        return self.roster.names[self.index]
 
+    @property
+    def week(self):
+        '''The 7 day schedules, as Python ints.'''
+        return [ int(sched) for sched in self.roster.avail[self.index] ]
 
+    def __getitem__(self, key):
+        if key == 'student_email':
+            return self.email
+        if key == 'student_name':
+            return self.name
+        if key == 'course':
+            return self.roster.course
+        if key.endswith('_i') and key[:-2].lower() in day_to_number:
+            return int(self.roster.avail[self.index, day_to_number[key[:-2].lower()]])
+        raise KeyError(key)
 
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __eq__(self, other):
+        return (isinstance(other, Person) and
+                self.roster is other.roster and
+                self.index == other.index)
+
+    def __hash__(self):
+        return hash((id(self.roster), self.index))
+
+    def __repr__(self):
+        return f'Person({self.email!r}, {self.name!r})'
 
 class Roster:
-    def __init__(self, person_list):
+    def __init__(self, emails, names, avail, course=None):
+        '''emails and names are sequences of strings; avail is anything
+        that NumPy can turn into an (n, 7) array of uint32.'''
+        self.course = course
+        self.emails = np.array(emails, dtype=object)
+        self.names = np.array(names, dtype=object)
+        self.avail = np.array(avail, dtype=np.uint32).reshape(len(self.emails), 7)
+        if len(self.names) != len(self.emails):
+            raise ValueError('emails and names must be the same length')
+        self.index = { email: i for i,email in enumerate(self.emails) }
+
+    @classmethod
+    def from_students(cls, student_list, course=None):
+        '''From student dictionaries, as from match.read_students.'''
+        student_list = list(student_list)
+        if course is None and len(student_list) > 0:
+            course = student_list[0].get('course')
+        return cls([ stud['student_email'] for stud in student_list ],
+                   [ stud['student_name'] for stud in student_list ],
+                   [ [ stud[f'{day}_i'] for day in number_to_day ]
+                     for stud in student_list ],
+                   course)
+
+    @classmethod
+    def from_rows(cls, rows, course=None):
+        '''From tuples of (email, name, sun, mon, ... sat).'''
+        rows = list(rows)
+        return cls([ row[0] for row in rows ],
+                   [ row[1] for row in rows ],
+                   [ row[2:9] for row in rows ],
+                   course)
+
+    def __len__(self):
+        return len(self.emails)
+
+    def __getitem__(self, i):
+        '''A Person, or for a slice, a list of them, so that code that
+        copies a list of students with [:] gets a list.'''
+        if isinstance(i, slice):
+            return [ Person(self, k) for k in range(*i.indices(len(self))) ]
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return Person(self, i % len(self))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Person(self, i)
+
+    def person(self, email):
+        return Person(self, self.index[email])
+
+    def free_time(self):
+        '''Array of the number of available slots for each person.'''
+        return popcount(self.avail).sum(axis=1, dtype=np.int32)
+
+    def profiles(self):
+        '''See unique_profiles.'''
+        return unique_profiles(self.avail)
+
+    def score_matrix(self, block=256):
+        '''The n x n int32 array of overlap scores, the same as
+        match.score_matrix, with a zero diagonal. Only the distinct
+        schedules are scored, and the result is expanded from that.'''
+        unique, profile_of, counts = self.profiles()
+        if len(unique) == len(self):
+            return score_matrix(self.avail, block)
+        scores = score_matrix(unique, block, zero_diagonal=False)[np.ix_(profile_of, profile_of)]
+        np.fill_diagonal(scores, 0)
+        return scores
+
+    def block_scores(self, start, stop):
+        '''Rows start to stop of the score matrix, including the
+        (nonzero) scores of those people with themselves.'''
+        return block_scores(self.avail[start:stop], self.avail)
+
+    def pair_score(self, i, j):
+        return int(day_scores(self.avail[i], self.avail[j]).sum())
+
+    def pair_scores(self, i, others):
+        '''array of the scores of i with each of others (an index array)'''
+        return block_scores(self.avail[i:i+1], self.avail[others])[0]
+
+    def trio_score(self, i, j, k):
+        '''score of the slots all three have in common'''
+        return int(day_scores(self.avail[i] & self.avail[j], self.avail[k]).sum())
+
+def read_roster(conn, course):
+    '''Reads a course from the database into a Roster.'''
+    from db_adapter import dbi
+    curs = dbi.cursor(conn)
+    curs.execute('''select student_email, student_name,
+                           sun+0, mon+0, tue+0, wed+0, thu+0, fri+0, sat+0
+                    from when_to_pair
+                    where course = %s''',
+                 [course])
+    return Roster.from_rows(curs.fetchall(), course)
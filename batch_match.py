@@ -0,0 +1,155 @@
+'''Rematching every course at once, say over a weekend, from the command
+line.
+
+The web app matches one course per request. This matches all of the
+courses in when_to_pair (or the ones named), like so:
+
+1. List the courses (match.list_courses, as the app does), and read
+   all of their rosters in one query (match.read_all_students).
+
+2. Match each course in a pool of worker processes, one per CPU by
+   default, with jobs.run_matching, so each result has the same form
+   as a job's, including the upper bound and gap from bounds.py. The
+   biggest courses are started first, so the pool isn't left waiting
+   on one big course at the end.
+
+3. Store the results in when_to_pair_results as they come in, under the
+   same keys the app uses (jobs.result_key), a batch of courses per
+   transaction. So the app finds them without matching again. Only the
+   writes are batched; each course's line is printed when it's done.
+
+4. Print a line per course as it finishes, and a summary at the end.
+
+Usage:
+
+    python batch_match.py [--algo greedy] [--budget N] [--workers N] [--dry-run] [course ...]
+
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from db_adapter import dbi
+import match
+import jobs
+
+RESULT_BATCH_SIZE = 20          # courses stored per transaction
+
+def algorithm_params(algorithm, budget):
+    '''the params part of the result key, as the app makes it'''
+    return {'budget': budget} if algorithm == 'hill_climbing' else {}
+
+def match_all(rosters, algorithm, budget, workers=None):
+    '''Generator of (course, result, error) as each course finishes,
+    where rosters maps courses to lists of students. Exactly one of
+    result (a dictionary from jobs.run_matching) and error (a string)
+    is None.'''
+    biggest_first = sorted(rosters, key=lambda course: -len(rosters[course]))
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = { executor.submit(jobs.run_matching, rosters[course], algorithm, budget): course
+                    for course in biggest_first }
+        for future in as_completed(futures):
+            course = futures[future]
+            if future.exception() is not None:
+                yield course, None, str(future.exception())
+            else:
+                yield course, future.result(), None
+
+def store_results(conn, rows):
+    '''rows are lists of course, algorithm, params_hash, schedule_hash,
+    params (as JSON), score and result (as JSON), stored in one
+    transaction.'''
+    curs = dbi.cursor(conn)
+    try:
+        curs.executemany('''insert into when_to_pair_results(course, algorithm, params_hash, schedule_hash, params, score, result)
+                            values(%s, %s, %s, %s, %s, %s, %s)
+                            on duplicate key update score = values(score), result = values(result)''',
+                         rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def course_line(course, n, result, error):
+    if error is not None:
+        return f'{course:20} {n:5}  failed: {error}'
+    return (f"{course:20} {n:5} {result['score']:7} {result['upper_bound']:7} "
+            f"{result['gap']:6.1%} {result['seconds']:8.2f}")
+
+def summary(rosters, results, errors, elapsed):
+    '''results maps courses to their results, errors to their error
+    messages.'''
+    lines = []
+    students = sum(len(rosters[course]) for course in results)
+    busy = sum(result['seconds'] for result in results.values())
+    lines.append(f'{len(results)} courses ({students} students) matched in {elapsed:.1f}s; '
+                 f'{busy:.1f}s of matching, {busy / elapsed if elapsed > 0 else 0:.1f}x parallel')
+    if results:
+        gaps = sorted((result['gap'], course) for course, result in results.items())
+        mean = sum(gap for gap, course in gaps) / len(gaps)
+        lines.append(f'gap from the upper bound: mean {mean:.1%}, median {gaps[len(gaps) // 2][0]:.1%}, '
+                     f'worst {gaps[-1][0]:.1%} ({gaps[-1][1]})')
+        slowest = max(results, key=lambda course: results[course]['seconds'])
+        lines.append(f"slowest: {slowest}, {results[slowest]['seconds']:.2f}s "
+                     f'for {len(rosters[slowest])} students')
+    if errors:
+        lines.append(f'{len(errors)} failed: ' + ', '.join(sorted(errors)))
+    return '\n'.join(lines)
+
+def batch_match(conn, courses=None, algorithm='greedy', budget=1, workers=None,
+                store=True, batch_size=RESULT_BATCH_SIZE, out=sys.stdout):
+    '''Matches the courses (all of them, if None), storing the results
+    unless store is false. Returns the results and errors, as for
+    summary.'''
+    start = time.perf_counter()
+    if courses is None:
+        courses = match.list_courses(conn)
+    rosters = match.read_all_students(conn, courses)
+    # nobody to pair with
+    too_small = [ course for course, students in rosters.items() if len(students) < 2 ]
+    for course in too_small:
+        del rosters[course]
+    params = algorithm_params(algorithm, budget)
+    print(f'{len(rosters)} courses, {sum(map(len, rosters.values()))} students; '
+          f'read in {time.perf_counter() - start:.2f}s', file=out)
+    if too_small:
+        print(f'skipping {len(too_small)} courses with fewer than 2 students', file=out)
+    print(f"{'course':20} {'n':>5} {'score':>7} {'bound':>7} {'gap':>6} {'seconds':>8}", file=out)
+    results = {}
+    errors = {}
+    rows = []
+    for course, result, error in match_all(rosters, algorithm, budget, workers):
+        print(course_line(course, len(rosters[course]), result, error), file=out, flush=True)
+        if error is not None:
+            errors[course] = error
+            continue
+        results[course] = result
+        key = jobs.result_key(course, algorithm, params, rosters[course])
+        rows.append(list(key) + [jobs.params_json(params), result['score'], json.dumps(result)])
+        if store and len(rows) >= batch_size:
+            store_results(conn, rows)
+            rows = []
+    if store and rows:
+        store_results(conn, rows)
+    print(summary(rosters, results, errors, time.perf_counter() - start), file=out)
+    return results, errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Match every course, or the ones named.')
+    parser.add_argument('courses', nargs='*', help='courses to match; all of them by default')
+    parser.add_argument('--algo', default='greedy', choices=sorted(jobs.ALGORITHMS))
+    parser.add_argument('--budget', type=int, default=1, help='random restarts, for hill_climbing')
+    parser.add_argument('--workers', type=int, default=None, help='processes; one per CPU by default')
+    parser.add_argument('--dry-run', action='store_true', help="don't store the results")
+    args = parser.parse_args(argv)
+    conn = dbi.connect()
+    results, errors = batch_match(conn, args.courses or None, args.algo, args.budget,
+                                  args.workers, store=not args.dry_run)
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,26 @@
+'''Helpers for talking to the database in batches, rather than one
+row at a time. Each round trip to MySQL costs far more than the work
+it does, so sending a few hundred rows per statement makes a big
+difference when loading a whole roster.
+
+'''
+
+from itertools import islice
+
+DEFAULT_BATCH_SIZE = 500
+
+def chunked(iterable, size=DEFAULT_BATCH_SIZE):
+    '''Yields lists of up to size items from iterable, without reading
+    more than one chunk into memory at a time.'''
+    if size < 1:
+        raise ValueError(f'batch size must be positive, not {size}')
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def placeholders(count):
+    '''Returns a string like (%s,%s,%s) with count placeholders.'''
+    return '(' + ','.join(['%s'] * count) + ')'
@@ -0,0 +1,211 @@
+'''Upper bounds on the best possible matching score, to say how good a
+heuristic matching is.
+
+matching_exhaustive is the only algorithm that's known to find the best
+matching, and it's hopeless beyond about 16 students. For bigger
+courses, we can at least bound the best score from above, and report
+how far below that bound a matching is. If the gap is small, the
+matching is nearly as good as it could be, whatever the best one is.
+
+A matching's score is the sum of its pair scores plus the lowest pair
+score again (see match.Matching.calculate_score), so the bound is a
+bound on the sum plus a bound on the lowest.
+
+The sum. Everyone is paired except, with an odd number of students, one
+of them, who joins a pair to make a trio. A trio's score is never more
+than that of the pair in it (their common slots are a subset of the
+pair's), so the sum is at most that of the pairs alone, which is a
+perfect matching if we add a dummy student whose score with everyone
+is zero. Each perfect matching gives an assignment
+of students to students (everyone to their partner) with twice the
+total, and no one assigned to themselves. So half the best such
+assignment is an upper bound. That's the LP relaxation of matching
+without the odd-set constraints (a fractional matching, where odd
+cycles can take half of each edge), and assignment.hungarian solves it
+exactly in O(n^3) time.
+
+The lowest. Each student's pair (or trio) score is at most their best
+score with anyone, and everyone is in a pair or trio, so the lowest
+score is at most the smallest of those. It's also at most the average
+score, so at most the sum bound over the number of pairs. And with an
+odd number of students, someone is in the trio, so it's at most the
+best trio score (see best_trio_score), which is usually well below the
+best pair scores, since three people have fewer slots in common than
+two.
+
+The scores used are the context's, including any penalties, so the
+bound applies to the scores that Matching reports. Must pairs aren't
+imposed, which only makes the bound looser.
+
+'''
+
+import numpy as np
+import assignment
+
+FORBIDDEN_COST = 1e12           # assigning a student to themselves
+
+def student_indexes(ctx, students=None):
+    if students is None:
+        return np.arange(len(ctx))
+    return np.array([ ctx.index_of(stud) for stud in students ], dtype=np.int64)
+
+def penalty_array(ctx, students=None):
+    '''The n x n penalties of the students (by default, all the
+    context's) as an array, zero where there's none.'''
+    indexes = student_indexes(ctx, students)
+    penalty = np.zeros((len(indexes), len(indexes)), dtype=np.int64)
+    if ctx.penalty:
+        position = { i: k for k,i in enumerate(indexes.tolist()) }
+        for (i, j), amount in ctx.penalty.items():
+            if i in position and j in position:
+                penalty[position[i], position[j]] = amount
+    return penalty
+
+def score_array(ctx, students=None):
+    '''The n x n scores of the students (by default, all the context's)
+    as an array, with penalties and with zeros on the diagonal.'''
+    indexes = student_indexes(ctx, students)
+    profile_of = np.asarray(ctx.profile_of, dtype=np.int64)[indexes]
+    unique = np.asarray(ctx.unique, dtype=np.int64)
+    scores = unique[np.ix_(profile_of, profile_of)]
+    if ctx.penalty:
+        scores -= penalty_array(ctx, students)
+    np.fill_diagonal(scores, 0)
+    return scores
+
+def sum_bound(scores):
+    '''Upper bound on the sum of the pair scores of any matching that
+    leaves at most one student out, from the fractional matching.'''
+    n = len(scores)
+    if n < 2:
+        return 0
+    if n % 2 == 1:
+        # the dummy student, who pairs with the one left out
+        scores = np.pad(scores, ((0, 1), (0, 1)))
+    cost = -scores.astype(float)
+    np.fill_diagonal(cost, FORBIDDEN_COST)
+    rows, cols = assignment.hungarian(cost)
+    # the scores are integers, so the sum is at most the floor
+    return int(scores[rows, cols].sum()) // 2
+
+def pair_trio_bound(scores):
+    '''Upper bound on the score of any trio, from the pair scores alone.
+    A trio's score is at most that of each pair in it, penalties
+    included, so at most the lowest of the three. This is the best such
+    lowest, over all trios.'''
+    n = len(scores)
+    scores = np.where(np.eye(n, dtype=bool), np.iinfo(np.int64).min, scores)
+    row_best = scores.max(axis=1)
+    best = np.iinfo(np.int64).min
+    # students with better partners first, so the rest can be skipped
+    for i in np.argsort(-row_best):
+        if row_best[i] <= best:
+            break
+        # only pairs better than the best trio so far can make a better one
+        near = np.flatnonzero(scores[i] > best)
+        if len(near) < 2:
+            continue
+        with_i = scores[i, near]
+        trios = np.minimum(scores[np.ix_(near, near)], np.minimum.outer(with_i, with_i))
+        best = max(best, int(trios.max()))
+    return int(best)
+
+def best_trio_score(ctx, students=None, scores=None):
+    '''The best score of any trio of the students (by default, all the
+    context's), penalties included, as ctx.trio_score computes it; or
+    None if their days don't fit in the 32 bits of band's kernels, as on
+    some slot grids. scores is their score_array, if it's at hand.
+
+    A trio is no better than any pair in it, so the students with the
+    best partners go first, and once the best trio so far is as good as
+    a pair, trios with that pair in them are skipped.'''
+    import band
+    import match
+    if students is None:
+        students = ctx.students
+    weeks = [ match.student_week(stud) for stud in students ]
+    if any(day >> 32 for week in weeks for day in week):
+        return None
+    avail = np.array(weeks, dtype=np.uint32).reshape(-1, 7)
+    if scores is None:
+        scores = score_array(ctx, students)
+    penalty = penalty_array(ctx, students)
+    n = len(students)
+    scores = np.where(np.eye(n, dtype=bool), np.iinfo(np.int64).min, scores)
+    row_best = scores.max(axis=1)
+    best = np.iinfo(np.int64).min
+    for i in np.argsort(-row_best):
+        if row_best[i] <= best:
+            break
+        near = np.flatnonzero(scores[i] > best)
+        # rows are the pairs (i, near), columns the third member
+        trios = band.block_scores(avail[i] & avail[near], avail).astype(np.int64)
+        trios -= penalty[i, near][:, None] + penalty[near] + penalty[i][None, :]
+        trios[:, i] = np.iinfo(np.int64).min
+        trios[np.arange(len(near)), near] = np.iinfo(np.int64).min
+        best = max(best, int(trios.max()))
+    return int(best)
+
+def lowest_bound(scores, total_bound, trio_bound=None):
+    '''Upper bound on the lowest pair (or trio) score. With an odd
+    number of students, trio_bound is the best_trio_score, or None to
+    use the best lowest pair of any trio instead.'''
+    n = len(scores)
+    if n < 2:
+        return 0
+    best = np.where(np.eye(n, dtype=bool), np.iinfo(np.int64).min, scores).max(axis=1)
+    lowest = min(int(best.min()), total_bound // (n // 2))
+    if n % 2 == 1 and n >= 3:
+        if trio_bound is None:
+            trio_bound = pair_trio_bound(scores)
+        lowest = min(lowest, trio_bound)
+    return lowest
+
+def upper_bound(ctx, students=None):
+    '''Upper bound on the score of any matching of the students (by
+    default, all the context's).'''
+    scores = score_array(ctx, students)
+    total = sum_bound(scores)
+    trio = best_trio_score(ctx, students, scores) if len(scores) % 2 == 1 else None
+    return total + lowest_bound(scores, total, trio)
+
+def gap(score, bound):
+    '''How far below the bound a score is, as a fraction of the bound.'''
+    if bound <= 0:
+        return 0.0
+    return max(0.0, (bound - score) / bound)
+
+def certify(matching):
+    '''Dictionary with the matching's score, the upper bound for its
+    context, and the gap, for adding to Matching.to_dict.'''
+    score = matching.calculate_score()
+    bound = upper_bound(matching.ctx, matching.student_list)
+    return {'score': score,
+            'upper_bound': bound,
+            'gap': gap(score, bound)}
+
+def test_bounds(sizes=(3, 5, 7, 9, 11), trials=5):
+    '''Compares the bounds with the best matching, from
+    matching_exhaustive, mostly for odd numbers of students, where the
+    lowest score can be the trio's.'''
+    import itertools
+    import match
+    for n in sizes:
+        for trial in range(trials):
+            emails, packed = match.make_test_schedules(n)
+            studs = [ {'course': 'bounds_test', 'student_email': email, 'student_name': email,
+                       **dict(zip(match.day_keys, week))}
+                      for email, week in zip(emails, packed) ]
+            best = match.matching_exhaustive(studs)
+            score = best.calculate_score()
+            scores = score_array(best.ctx)
+            total = sum_bound(scores)
+            trio = best_trio_score(best.ctx) if n % 2 == 1 else None
+            lowest = lowest_bound(scores, total, trio)
+            assert best.lowest_score <= lowest, (n, best.lowest_score, lowest)
+            assert score <= upper_bound(best.ctx) == total + lowest, (n, score, total + lowest)
+            if n % 2 == 1:
+                trios = [ best.ctx.trio_score(*trio) for trio in itertools.combinations(studs, 3) ]
+                assert trio == max(trios), (n, trio, max(trios))
+                assert trio <= pair_trio_bound(scores), (n, trio)
+    print('bounds hold for', sizes)
@@ -0,0 +1,76 @@
+'''Per-course versions and a cache of things derived from a course's
+schedules, like the JSON of all of them, or the matrix of pairwise
+scores.
+
+Each course has a version number, which is bumped whenever one of its
+schedules is saved. A cached value remembers the version it was
+computed from, and is recomputed when the version moves on. Saves made
+by some other process (say, insert_students.py or a second server)
+don't bump our version, so cached values also expire after MAX_AGE
+seconds.
+
+Usage:
+
+    value = course_cache.get(course, 'schedules', lambda: compute(course))
+    ...
+    course_cache.bump(course)     # after saving a schedule
+    course_cache.carry(course, 'index', lambda index: patched(index))
+
+'''
+
+import threading
+import time
+
+MAX_AGE = 60                    # seconds
+
+_lock = threading.Lock()
+_versions = {}                  # course => int
+_cache = {}                     # (course, name) => (version, time, value)
+
+def version(course):
+    with _lock:
+        return _versions.get(course, 0)
+
+def bump(course):
+    '''Invalidates everything cached for this course.'''
+    with _lock:
+        _versions[course] = _versions.get(course, 0) + 1
+
+def get(course, name, compute):
+    '''Returns the cached value called name for this course, calling
+    compute() to make a new one if there isn't a fresh one. Two threads
+    may occasionally both compute the same value; that's harmless.'''
+    now = time.monotonic()
+    with _lock:
+        current = _versions.get(course, 0)
+        entry = _cache.get((course, name))
+    if entry is not None:
+        entry_version, entry_time, value = entry
+        if entry_version == current and now - entry_time < MAX_AGE:
+            return value
+    value = compute()
+    with _lock:
+        # don't cache it if there was a save while we were computing
+        if _versions.get(course, 0) == current:
+            _cache[(course, name)] = (current, now, value)
+    return value
+
+def carry(course, name, update):
+    '''Call just after bump. If the value called name was cached just
+    before the bump, caches update(value) for the new version, keeping
+    the old value's age. That's for values that can be patched more
+    cheaply than they can be recomputed.'''
+    with _lock:
+        current = _versions.get(course, 0)
+        entry = _cache.get((course, name))
+    if entry is None or entry[0] != current - 1:
+        return
+    value = update(entry[2])
+    with _lock:
+        if _versions.get(course, 0) == current:
+            _cache[(course, name)] = (current, entry[1], value)
+
+def clear():
+    with _lock:
+        _versions.clear()
+        _cache.clear()
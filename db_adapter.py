@@ -0,0 +1,56 @@
+'''Lazy access to the database library.
+
+The compute code in match.py (scoring, matrices, matchers) doesn't
+need a database at all, but it used to import cs304dbi and call
+dbi.conf('scottdb') when it was imported. That made every worker
+process, benchmark and offline experiment pay for reading the MySQL
+configuration, and require the library to be installed.
+
+Instead, modules do
+
+    from db_adapter import dbi
+
+and use dbi exactly as before (dbi.connect(), dbi.cursor(conn) and so
+on). The real library is only imported, and configured for DATABASE,
+the first time one of those is called.
+
+If the environment variable WHEN_TO_PAIR_DB is set to sqlite:PATH, the
+SQLite stand-in in sqlite_dbi.py is used instead, with the database in
+PATH (or in memory, if PATH is empty). That's for testing and offline
+work without MySQL.
+
+'''
+
+import os
+
+DATABASE = 'scottdb'
+ENV_VAR = 'WHEN_TO_PAIR_DB'
+
+class LazyDBI:
+    def __init__(self):
+        self._module = None
+
+    def use(self, module):
+        '''Use this module (with the cs304dbi API) from now on.'''
+        self._module = module
+
+    def loaded(self):
+        return self._module is not None
+
+    def _load(self):
+        if self._module is None:
+            url = os.environ.get(ENV_VAR, '')
+            if url.startswith('sqlite:'):
+                import sqlite_dbi
+                sqlite_dbi.set_path(url[len('sqlite:'):] or None)
+                module = sqlite_dbi
+            else:
+                import cs304dbi as module
+            module.conf(DATABASE)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+dbi = LazyDBI()
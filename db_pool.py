@@ -0,0 +1,134 @@
+'''A small, bounded pool of database connections.
+
+Opening a MySQL connection costs a network handshake and a login, and
+the server only allows so many at once. So, instead of calling
+dbi.connect() in every request, the app checks a connection out of the
+pool at the start of a request and returns it at the end. At most
+`size` connections exist at once; if they are all in use, a request
+waits up to `timeout` seconds for one to come back.
+
+The pool doesn't care what kind of connection it holds. It's given a
+function of no arguments that makes a new one, so it works equally
+well with dbi.connect or with sqlite3 for testing:
+
+    pool = ConnectionPool(lambda: sqlite3.connect(':memory:', check_same_thread=False))
+
+'''
+
+import queue
+import threading
+import time
+
+class PoolTimeout(Exception):
+    '''Raised when no connection became free within the timeout.'''
+    pass
+
+def is_healthy(conn):
+    '''True if the connection still works. pymysql connections have a
+    ping method; for others (like sqlite3), we try a trivial query.'''
+    try:
+        if hasattr(conn, 'ping'):
+            conn.ping(reconnect=False)
+        else:
+            curs = conn.cursor()
+            curs.execute('select 1')
+            curs.fetchall()
+        return True
+    except Exception:
+        return False
+
+class ConnectionPool:
+    def __init__(self, connect, size=10, timeout=5.0, check=is_healthy):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._check = check
+        # LIFO, so the most recently used (warmest) connection is reused
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = {'created': 0,
+                       'checkouts': 0,
+                       'in_use': 0,
+                       'max_in_use': 0,
+                       'timeouts': 0,
+                       'unhealthy': 0,
+                       'total_wait': 0.0,
+                       'max_wait': 0.0}
+
+    def checkout(self):
+        '''Returns a healthy connection, waiting if all are in use.'''
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f'no connection free after {self.timeout} seconds')
+        wait = time.monotonic() - start
+        try:
+            conn = self._reuse_or_connect()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            stats = self._stats
+            stats['checkouts'] += 1
+            stats['in_use'] += 1
+            stats['max_in_use'] = max(stats['max_in_use'], stats['in_use'])
+            stats['total_wait'] += wait
+            stats['max_wait'] = max(stats['max_wait'], wait)
+        return conn
+
+    def _reuse_or_connect(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if self._check is None or self._check(conn):
+                return conn
+            with self._lock:
+                self._stats['unhealthy'] += 1
+            close_quietly(conn)
+        conn = self._connect()
+        with self._lock:
+            self._stats['created'] += 1
+        return conn
+
+    def checkin(self, conn):
+        '''Returns a connection to the pool. Any uncommitted work is
+        rolled back, so the next user starts with a clean slate.'''
+        try:
+            conn.rollback()
+            self._idle.put(conn)
+        except Exception:
+            # broken connection; drop it, and a new one gets made later
+            close_quietly(conn)
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+    def close_all(self):
+        '''Closes the idle connections. Ones in use are closed when they
+        are checked in and found broken, or when the process exits.'''
+        while True:
+            try:
+                close_quietly(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def stats(self):
+        '''Returns a dictionary of counts and timings, suitable for JSON.'''
+        with self._lock:
+            stats = dict(self._stats)
+        stats['size'] = self.size
+        stats['idle'] = self._idle.qsize()
+        checkouts = stats['checkouts']
+        stats['mean_wait'] = stats['total_wait'] / checkouts if checkouts else 0.0
+        return stats
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
@@ -1,6 +1,7 @@
 import sys
 import csv
-import cs304dbi as dbi
+from db_adapter import dbi
+from batching import chunked, placeholders, DEFAULT_BATCH_SIZE
 
 def insert_students(conn, course, csv_file):
     '''CSV file is assumed to have two columns: student_name and
@@ -15,10 +16,86 @@ def insert_students(conn, course, csv_file):
                          [course, email, name])
     conn.commit()
 
+def read_roster_rows(fin):
+    '''Generator of (name, email) pairs from an open CSV file, skipping
+    the header line. Malformed rows (wrong number of columns or a
+    missing email) are yielded as None so that the caller can count
+    them.'''
+    reader = csv.reader(fin)
+    next(reader, None)
+    for row in reader:
+        if len(row) != 2:
+            yield None
+            continue
+        name, email = row[0].strip(), row[1].strip()
+        if email == '':
+            yield None
+            continue
+        yield (name, email)
+
+def bulk_insert_students(conn, course, csv_file, batch_size=DEFAULT_BATCH_SIZE):
+    '''Like insert_students, but streams the CSV file in chunks of
+    batch_size rows, and upserts each chunk with a single
+    executemany. New students get empty schedules; students already
+    in the course keep their schedules, but their names are updated if
+    the CSV has a different one. Students whose row is unchanged are
+    skipped, as are malformed rows and repeats within the file.
+
+    Everything happens in one transaction, so re-running the import
+    is safe, and a failure part way through leaves the table as it
+    was. Returns a dictionary of counts: inserted, updated and
+    skipped.'''
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    seen = set()
+    curs = dbi.cursor(conn)
+    try:
+        with open(csv_file, 'r', newline='') as fin:
+            for chunk in chunked(read_roster_rows(fin), batch_size):
+                rows = []
+                for row in chunk:
+                    if row is None or row[1] in seen:
+                        counts['skipped'] += 1
+                        continue
+                    seen.add(row[1])
+                    rows.append(row)
+                if len(rows) == 0:
+                    continue
+                emails = [ email for name,email in rows ]
+                curs.execute(f'''select student_email, student_name from when_to_pair
+                                 where course = %s and student_email in {placeholders(len(emails))}''',
+                             [course] + emails)
+                existing = dict(curs.fetchall())
+                vals = []
+                for name,email in rows:
+                    if email not in existing:
+                        counts['inserted'] += 1
+                    elif existing[email] != name:
+                        counts['updated'] += 1
+                    else:
+                        counts['skipped'] += 1
+                        continue
+                    vals.append([course, email, name])
+                if len(vals) > 0:
+                    curs.executemany('''insert into when_to_pair
+                                        values(%s, %s, %s, 0, 0, 0, 0, 0, 0, 0)
+                                        on duplicate key update
+                                        student_name = values(student_name)''',
+                                     vals)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return counts
+
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print('''Usage: script course csv_file''')
+    args = [ arg for arg in sys.argv[1:] if arg != '--bulk' ]
+    if len(args) < 2:
+        print('''Usage: script [--bulk] course csv_file''')
         sys.exit()
     dbi.conf('scottdb')
     conn = dbi.connect()
-    insert_students(conn, sys.argv[1], sys.argv[2])
+    if '--bulk' in sys.argv:
+        counts = bulk_insert_students(conn, args[0], args[1])
+        print('inserted {inserted}, updated {updated}, skipped {skipped}'.format(**counts))
+    else:
+        insert_students(conn, args[0], args[1])
@@ -0,0 +1,184 @@
+'''Running matching algorithms in the background, for the web app.
+
+Some of the algorithms in match.py take seconds or minutes, which is
+far too long to tie up a Flask worker. So, a request to match a course
+becomes a job: it's handed to a pool of worker processes, and the
+client gets a job id back right away and polls for the result.
+
+Worker processes (rather than threads) are used because the matchers
+are pure Python and CPU-bound, so threads would just take turns
+holding the GIL. Each job gets its own match.MatchingContext, so jobs
+could equally well share a process.
+
+Finished matchings are worth keeping, since the same course is often
+matched again without any schedule changing. So each result is stored
+under a key made from the course, the algorithm, and hashes of its
+parameters and of the schedules. See result_key and the when_to_pair_results
+table in table_setup.sql.
+
+'''
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import match
+import bounds
+
+MAX_EXHAUSTIVE = 16             # students; see match.match_count_table
+JOB_TTL = 3600                  # seconds to remember a finished job
+
+def run_greedy(ctx, budget):
+    return match.matching_greedy(ctx=ctx)
+
+def run_two_greedy(ctx, budget):
+    return match.matching_two_greedy(ctx=ctx)
+
+def run_exhaustive(ctx, budget):
+    if len(ctx) > MAX_EXHAUSTIVE:
+        raise ValueError(f'exhaustive is limited to {MAX_EXHAUSTIVE} students')
+    return match.matching_exhaustive(ctx=ctx)
+
+def climb(ctx):
+    '''A random matching, improved to a local optimum. Quietly, unlike
+    match.matching_hill_climbing_random_start, which prints each step,
+    since a worker's output ends up mixed into batch_match's table.'''
+    m = match.Matching(ctx.students, ctx)
+    m.random_pairing()
+    # each step is better than the last; the last is the local optimum
+    for m in match.local_search_steps(m):
+        pass
+    return m
+
+def run_hill_climbing(ctx, budget):
+    '''budget is the number of random restarts; keeps the best.'''
+    best = None
+    for i in range(max(1, budget)):
+        m = climb(ctx)
+        if best is None or m.calculate_score() > best.calculate_score():
+            best = m
+    return best
+
+# name => function of (context, budget) returning a Matching
+ALGORITHMS = {'greedy': run_greedy,
+              'two_greedy': run_two_greedy,
+              'exhaustive': run_exhaustive,
+              'hill_climbing': run_hill_climbing}
+
+def schedule_hash(students):
+    '''A hash of everyone's schedule, independent of the order of the
+    list, so we can tell whether anything changed since a result was
+    computed.'''
+    rows = sorted( [ stud['student_email'] ] +
+                   [ stud[f'{day.lower()}_i'] for day in match.days_of_the_week ]
+                   for stud in students )
+    return hashlib.sha1(json.dumps(rows).encode('utf-8')).hexdigest()
+
+def params_json(params):
+    '''params is a dictionary, and is canonicalized as JSON.'''
+    return json.dumps(params, sort_keys=True)
+
+def result_key(course, algorithm, params, students):
+    '''The JSON of the params is hashed, like the schedules, since with
+    a lot of constraints it's too long to be part of a primary key. The
+    JSON itself is stored alongside; see params_json.'''
+    return (course, algorithm,
+            hashlib.sha1(params_json(params).encode('utf-8')).hexdigest(),
+            schedule_hash(students))
+
+def run_matching(students, algorithm, budget, constraints=None):
+    '''Runs in a worker process. students is a list of student
+    dictionaries, as from match.read_students, and constraints is None
+    or a dictionary for match.Constraints.from_dict. Returns the
+    matching as a dictionary, so it pickles and converts to JSON
+    easily, with the upper bound and gap from bounds.certify.'''
+    start = time.perf_counter()
+    if constraints:
+        constraints = match.Constraints.from_dict(constraints)
+    ctx = match.MatchingContext(students, constraints=constraints or None)
+    m = ALGORITHMS[algorithm](ctx, budget)
+    result = m.to_dict()
+    # how far from the best possible it might be
+    result.update(bounds.certify(m))
+    result['algorithm'] = algorithm
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+class JobManager:
+    '''Keeps track of submitted jobs. on_done(key, params, result) is
+    called (in a background thread) when a job succeeds, to store the
+    result.'''
+
+    def __init__(self, max_workers=None, on_done=None):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count())
+        self.on_done = on_done
+        self._lock = threading.Lock()
+        self._jobs = {}         # id => dictionary
+        self._by_key = {}       # result key => id of unfinished job
+
+    def submit(self, key, students, algorithm, budget, constraints=None, params=None):
+        '''Returns the id of a job computing this key, reusing one that's
+        already queued or running. params is the dictionary the key was
+        made from.'''
+        with self._lock:
+            if key in self._by_key:
+                return self._by_key[key]
+            self._prune()
+            job_id = uuid.uuid4().hex
+            job = {'id': job_id,
+                   'course': key[0],
+                   'algorithm': algorithm,
+                   'params': params or {},
+                   'submitted': time.time(),
+                   'future': None}
+            self._jobs[job_id] = job
+            self._by_key[key] = job_id
+        future = self.executor.submit(run_matching, students, algorithm, budget, constraints)
+        job['future'] = future
+        future.add_done_callback(lambda f: self._finished(key, job_id, f))
+        return job_id
+
+    def _finished(self, key, job_id, future):
+        with self._lock:
+            self._by_key.pop(key, None)
+            job = self._jobs[job_id]
+            job['finished'] = time.time()
+        if self.on_done is not None and future.exception() is None:
+            self.on_done(key, job['params'], future.result())
+
+    def _prune(self):
+        '''Forgets jobs that finished long ago. Call with the lock held.'''
+        cutoff = time.time() - JOB_TTL
+        old = [ job_id for job_id, job in self._jobs.items()
+                if job.get('finished', cutoff) < cutoff ]
+        for job_id in old:
+            del self._jobs[job_id]
+
+    def status(self, job_id):
+        '''Returns a dictionary describing the job, for JSON, or None if
+        there's no such job.'''
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        future = job['future']
+        result = {key: val for key, val in job.items() if key != 'future'}
+        if future is None or not (future.running() or future.done()):
+            result['status'] = 'queued'
+        elif future.running():
+            result['status'] = 'running'
+        elif future.exception() is not None:
+            result['status'] = 'failed'
+            result['error'] = str(future.exception())
+        else:
+            result['status'] = 'done'
+            result['result'] = future.result()
+        result['elapsed'] = result.get('finished', time.time()) - job['submitted']
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -17,18 +17,42 @@ API:
 read_students(conn, course): read a list of students and their
     schedules from the database.
 
-compute_all_scores(student_list): pre-computes all the pairwise scores
+read_all_students(conn): the same, for every course at once.
 
-get_score(stud_a, stud_b):  args are student dictionaries
+MatchingContext(student_list): owns a roster, the map from each
+    student to their index, and the matrix of pairwise scores. Every
+    algorithm takes one, so several matchings (say, for different
+    courses in different threads) can run at once without interfering.
+    The matrix is a ProfileScores, which only scores the distinct
+    schedules, since many students have identical ones.
+
+Constraints(must_pair, must_not_pair, penalties): pairs to force, to
+    forbid, and to discourage (like last time's partners). A context
+    keeps them beside its score matrix, and every algorithm respects
+    them.
+
+compute_all_scores(student_list): pre-computes all the pairwise scores,
+    in a context that's also stored in module globals, for
+    compatibility with code that doesn't pass a context around.
+
+get_score(stud_a, stud_b, ctx=None):  args are student dictionaries
 
 
 compute_schedule_score(schedule): computes the score for a complete
     matching, which is the sum of the pairwise scores, plus the lowest one
     again, bumping up its importance
 
+With an odd number of students, one pair becomes a trio: whoever is left
+over joins the pair that makes the best trio (see best_merge), and the
+trio's score is the overlap of all three (see trio_week_score).
+
 ALGORITHMS:
 
-All take a list of students as an argument, defaulting to all_students
+All take a list of students and a MatchingContext as arguments. If the
+context is omitted, the one made by the last compute_all_scores is
+used, if it has the same students with the same schedules; otherwise a
+new one is made. If the
+students are omitted, they are the context's, or all_students.
 
 matching_greedy(): a conventional greedy algorithm, where we pair A with
    whatever overlaps best, then on to the next one (probably B).
@@ -47,8 +71,12 @@ dictionary
 '''
 
 import random
-import cs304dbi as dbi
-dbi.conf('scottdb')
+import sys
+import time
+# the database library is only loaded when first used; see db_adapter.py
+from db_adapter import dbi
+from batching import chunked, placeholders, DEFAULT_BATCH_SIZE
+import slot_codec
 
 days_of_the_week = 'Sun,Mon,Tue,Wed,Thu,Fri,Sat'.split(',')
 
@@ -57,13 +85,19 @@ all_slots = "900,930,1000,1030,1100,1130,1200,1230,1300,1330,1400,1430,1500,1530
 all_students = None
 
 def read_students(conn, course):
-    '''returns a dictionary of all students, each represented as a dictionary'''
+    '''returns a dictionary of all students, each represented as a
+    dictionary. A course with its own slot grid is read from the grid
+    table; see slot_grid.py.'''
+    import slot_grid
+    grid = slot_grid.course_grid(conn, course)
+    if grid is not None:
+        return { stud['student_email']: stud
+                 for stud in slot_grid.read_grid_students(conn, course, grid) }
     dic = {}
     curs = dbi.dict_cursor(conn)
-    # both the numeric and string value
+    # just the numeric value; slot_codec decodes it when we need slots
     nrows = curs.execute('''select course, student_email, student_name,
-                                   sun+0 as sun_i, mon+0 as mon_i, tue+0 as tue_i, wed+0 as wed_i, thu+0 as thu_i, fri+0 as fri_i, sat+0 as sat_i,
-                                   sun as sun_s, mon as mon_s, tue as tue_s, wed as wed_s, thu as thu_s, fri as fri_s, sat as sat_s
+                                   sun+0 as sun_i, mon+0 as mon_i, tue+0 as tue_i, wed+0 as wed_i, thu+0 as thu_i, fri+0 as fri_i, sat+0 as sat_i
                             from when_to_pair
                             where course = %s''',
                          [course])
@@ -71,26 +105,59 @@ def read_students(conn, course):
         dic[row['student_email']] = row
     return dic
 
+def list_courses(conn):
+    '''courses with at least one student, on the standard grid or their
+    own'''
+    curs = dbi.cursor(conn)
+    curs.execute('''select course from when_to_pair
+                    union
+                    select course from when_to_pair_grid''')
+    return [ row[0] for row in curs.fetchall() ]
+
+def read_all_students(conn, courses=None):
+    '''Returns a dictionary mapping each course (all of them, or just
+    those in the list courses) to a list of its students, as from
+    read_students, all in one query rather than one per course.'''
+    if courses is not None and len(courses) == 0:
+        return {}
+    curs = dbi.dict_cursor(conn)
+    where = ''
+    args = []
+    if courses is not None:
+        where = 'where course in ' + placeholders(len(courses))
+        args = list(courses)
+    curs.execute(f'''select course, student_email, student_name,
+                            sun+0 as sun_i, mon+0 as mon_i, tue+0 as tue_i, wed+0 as wed_i, thu+0 as thu_i, fri+0 as fri_i, sat+0 as sat_i
+                     from when_to_pair
+                     {where}
+                     order by course, student_email''',
+                 args)
+    result = {}
+    for row in curs.fetchall():
+        result.setdefault(row['course'], []).append(row)
+    # courses with their own grids are in another table
+    import slot_grid
+    for course in slot_grid.grid_courses(conn):
+        if courses is None or course in courses:
+            result[course] = slot_grid.read_grid_students(conn, course)
+    return result
+
 def decode_day_schedule(day_sched_int):
     '''returns list of slots of a day schedule, equivalent to the integer presentation of a day schedule'''
-    slots = []
-    for i,slot in enumerate(all_slots):
-        slot_val = 1 << i
-        if day_sched_int & slot_val:
-            slots.append(slot)
-    return slots
+    return slot_codec.decode(day_sched_int)
 
 def student_to_str(stud):
+    '''The student's name and their free times each day, as ranges.'''
     result = stud['student_name'] + ' on\n'
     for day in days_of_the_week:
-        dic_key = f'{day}_s'
-        if dic_key not in stud:
-            stud[dic_key] = decode_day_schedule(stud[f'{day}_i'])
-        slots = stud[dic_key]
-        result += f' {day}: {slots}\n'
+        ranges = slot_codec.ranges(stud[f'{day.lower()}_i'])
+        result += f' {day}: {", ".join(ranges)}\n'
     return result
-    
 
+def roster_to_str(student_list):
+    '''A printable roster: student_to_str for each student.'''
+    return ''.join(student_to_str(stud) for stud in student_list)
+    
 # ================================================================
 
 def day_score(sched_a, sched_b):
@@ -100,31 +167,15 @@ def day_score(sched_a, sched_b):
     counts for 3 (4-1), while two 1-hour overlaps counts for 2 (4-2)
     and four 30-minute overlaps counts for zero.
 
+    Rather than loop over the slots, we use bit tricks: a session of
+    overlapping slots starts at each 1 bit whose lower neighbor is a
+    0, so x & ~(x << 1) has exactly one bit per session.
+
     '''
     day_overlap = sched_a & sched_b
-    # print(f'{day_overlap=}')
     # bit_count is python 3.10, so we'll use this instead
-    bit_count = bin(day_overlap).count('1')
-    # loop instead to count both at once
-    overlap_count = 0
-    overlap_sum = 0
-    prev_overlap = False    # true if continuing the previous session
-    for i,slot in enumerate(all_slots):
-        slot_val = 1 << i
-        if (sched_a & slot_val and
-            sched_b & slot_val):
-            # an overlap!
-            # print(f'overlap for {i=}')
-            # print(f'{slot_val=}')
-            overlap_sum += 1
-            if not prev_overlap:
-                # start a new session
-                prev_overlap = True
-                overlap_count += 1
-        else:
-            # gap
-            prev_overlap = False
-    # print(f'{overlap_count=} and {overlap_sum=}')
+    overlap_sum = bin(day_overlap).count('1')
+    overlap_count = bin(day_overlap & ~(day_overlap << 1)).count('1')
     return overlap_sum - overlap_count
     
 def day_score_test():
@@ -157,20 +208,55 @@ def overlap_score(stud_a, stud_b):
         score += day_score(sched_a, sched_b)
     return score
 
+def week_score(week_a, week_b):
+    '''Like overlap_score, but the args are lists of 7 ints, Sunday
+    first, rather than student dictionaries.'''
+    score = 0
+    for day in range(7):
+        score += day_score(week_a[day], week_b[day])
+    return score
+
+def trio_week_score(week_a, week_b, week_c):
+    '''The score of three students together: the week_score of the
+    slots all three have free, which is the AND of the first two weeks
+    scored against the third.'''
+    return week_score([ a & b for a,b in zip(week_a, week_b) ], week_c)
+
+def total_free_time(week):
+    '''Number of available slots in a list of 7 day schedules.'''
+    return sum(bin(sched).count('1') for sched in week)
+
+def score_matrix(weeks, zero_diagonal=True):
+    '''Returns an n x n list of lists of the week_score of each pair of
+    schedules, computing each pair only once. The diagonal is zero,
+    unless zero_diagonal is false, in which case it's the score of each
+    schedule with itself.'''
+    n = len(weeks)
+    scores = [ [ 0 ] * n for i in range(n) ]
+    for i in range(n):
+        week_i = weeks[i]
+        row_i = scores[i]
+        if not zero_diagonal:
+            row_i[i] = week_score(week_i, week_i)
+        for j in range(i+1, n):
+            score = week_score(week_i, weeks[j])
+            row_i[j] = score
+            scores[j][i] = score
+    return scores
+
 # ================================================================
 # Triangle tables with each entry being the overlap_score for that
 # pair of students.
 
-def pair_overlap_table(student_list):
+def pair_overlap_table(student_list, out=None, fmt='tsv'):
+    '''Prints each student's index, email, free time and overlap with
+    themselves, least free time first, and then exports the triangle
+    table of their overlap scores to out (a filename or file; by
+    default, stdout) with overlap_export. Sorts student_list in place,
+    so the indexes match.'''
+    import overlap_export
     for s in student_list:
-        # adapted from time_sets.py
-        sum = 0
-        for day in days_of_the_week:
-            day = day.lower()+'_i' # the integer
-            # bit_count is python 3.10, so we'll use this instead
-            bit_count = bin(s[day]).count('1')
-            sum += bit_count
-        s['total_free_time'] = sum
+        s['total_free_time'] = total_free_time(student_week(s))
     # put the people with the least free time at the top
     student_list.sort(key=lambda s: s['total_free_time'])
     for i,s in enumerate(student_list):
@@ -179,27 +265,10 @@ def pair_overlap_table(student_list):
         sfree = s['total_free_time']
         sover = overlap_score(s, s)
         print(f'{i}\t{semail}\t{sfree}\t{sover}\t{sname}')
-    # triangle table
-    sl = student_list
-    n = len(student_list)
-    tt = [ [ overlap_score(sl[i], sl[j])
-             for i in range(n) ]
-           for j in range(n) ]
-    # header
-    print('X', end='\t')
-    for j in range(n):
-        print(f' {j:2} ', end='|')
-    print()
-    # data
-    for i in range(n):
-        print(i, end='\t')
-        for j in range(n):
-            val = tt[i][j]
-            print(f' {val:2} ', end='|')
-        print()
-
-    
-
+    overlap_export.export_overlaps(sys.stdout if out is None else out,
+                                   [ student_week(s) for s in student_list ],
+                                   [ str(i) for i in range(len(student_list)) ],
+                                   fmt)
 
 # ================================================================
 # Score storage
@@ -235,16 +304,9 @@ def get_score_tuple_dictionary(stud_a, stud_b):
 def compute_all_scores_2d_array(student_list):
     for i,s in enumerate(student_list):
         s['index'] = i
-    n = len(student_list)
-    scores = [ [ 0 ] * n for i in range(n) ]
-    for i,a in enumerate(student_list):
-        for j,b in enumerate(student_list):
-            if a is b:
-                continue
-            score = overlap_score(a,b)
-            scores[i][j] = score
-            scores[j][i] = score
-    return scores
+    # score only the distinct schedules, then copy those scores out
+    scores = ProfileScores.from_weeks([ student_week(s) for s in student_list ])
+    return scores.tolist()
 
 def get_score_2d_array(stud_a, stud_b):
     i = stud_a['index']
@@ -253,15 +315,345 @@ def get_score_2d_array(stud_a, stud_b):
 
 # Choose option 3
 
+# ================================================================
+# Matching contexts
+
+'''The 2D array used to live only in the all_scores global, and was
+indexed by an 'index' key stored into each student dictionary. That
+meant that get_score used whatever matrix was computed last, so two
+matchings running at once would corrupt each other. A MatchingContext
+owns all of that instead, and doesn't modify the students.'''
+
+day_keys = [ f'{day.lower()}_i' for day in days_of_the_week ]
+
+def student_week(stud):
+    '''The 7 day schedules of a student dictionary, as a list of ints.'''
+    return [ stud[key] for key in day_keys ]
+
+def unique_profiles(weeks):
+    '''Hash-conses a list of weekly schedules (lists of 7 ints). Returns
+    the list of distinct schedules, the index of each week's schedule in
+    that list, and how many weeks have each one.'''
+    profiles = []
+    profile_of = []
+    counts = []
+    seen = {}
+    for week in weeks:
+        key = tuple(week)
+        p = seen.get(key)
+        if p is None:
+            p = seen[key] = len(profiles)
+            profiles.append(key)
+            counts.append(0)
+        profile_of.append(p)
+        counts[p] += 1
+    return profiles, profile_of, counts
+
+class ProfileScores:
+    '''The n x n score matrix, stored as the u x u matrix of scores
+    between the u distinct schedules. Many students have identical
+    schedules (all zeros, or the same pattern from a shared section), so
+    u can be much less than n.
+
+    The unique matrix has each schedule's score with itself on its
+    diagonal, since two different students can share a schedule. It's
+    expanded lazily: scores[i][j] works as for a list of lists, and is
+    zero if i == j.'''
+
+    def __init__(self, profile_of, unique, counts=None):
+        self.profile_of = list(profile_of)
+        self.unique = unique
+        self.counts = counts
+
+    @classmethod
+    def from_weeks(cls, weeks):
+        profiles, profile_of, counts = unique_profiles(weeks)
+        return cls(profile_of, score_matrix(profiles, zero_diagonal=False), counts)
+
+    @classmethod
+    def from_roster(cls, roster):
+        '''Uses NumPy, via band.'''
+        import band
+        unique, profile_of, counts = roster.profiles()
+        return cls(profile_of.tolist(),
+                   band.score_matrix(unique, zero_diagonal=False).tolist(),
+                   counts.tolist())
+
+    def __len__(self):
+        return len(self.profile_of)
+
+    def get(self, i, j):
+        if i == j:
+            return 0
+        return self.unique[self.profile_of[i]][self.profile_of[j]]
+
+    def __getitem__(self, i):
+        return ProfileRow(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield ProfileRow(self, i)
+
+    def tolist(self):
+        '''The full n x n list of lists.'''
+        return [ list(row) for row in self ]
+
+class ProfileRow:
+    '''Row i of a ProfileScores'''
+    __slots__ = ('scores', 'i')
+
+    def __init__(self, scores, i):
+        self.scores = scores
+        self.i = i
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __getitem__(self, j):
+        return self.scores.get(self.i, j)
+
+    def __iter__(self):
+        unique_row = self.scores.unique[self.scores.profile_of[self.i]]
+        for j, p in enumerate(self.scores.profile_of):
+            yield 0 if j == self.i else unique_row[p]
+
+FORBIDDEN = 1_000_000           # penalty for a must-not pair
+HISTORY_PENALTY = 10            # default penalty for a repeat partner
+
+def check_penalty(pair, amount):
+    '''Penalties can't be negative: a bonus for a pair would let a trio
+    score more than the pair in it, which bounds.py relies on not
+    happening.'''
+    if amount < 0:
+        raise ValueError(f'penalty for {pair[0]} and {pair[1]} is negative: {amount}')
+
+class Constraints:
+    '''Pairs that must be together, pairs that must not, and penalties
+    for pairs that shouldn't be (like people who were partners last
+    time). Pairs are of emails, in either order.'''
+
+    def __init__(self, must_pair=(), must_not_pair=(), penalties=None):
+        self.must_pair = [ tuple(pair) for pair in must_pair ]
+        self.must_not_pair = [ tuple(pair) for pair in must_not_pair ]
+        # (email_a, email_b) => amount
+        self.penalties = dict(penalties or {})
+        for pair, amount in self.penalties.items():
+            check_penalty(pair, amount)
+
+    @classmethod
+    def from_dict(cls, data):
+        '''From JSON like {"must_pair": [[a, b]], "must_not_pair": [[c, d]],
+        "penalties": [[e, f, 10]]}; all keys are optional.'''
+        return cls(data.get('must_pair', ()),
+                   data.get('must_not_pair', ()),
+                   { (a, b): amount for a, b, amount in data.get('penalties', ()) })
+
+    def to_dict(self):
+        return {'must_pair': [ list(pair) for pair in self.must_pair ],
+                'must_not_pair': [ list(pair) for pair in self.must_not_pair ],
+                'penalties': [ [a, b, amount] for (a, b), amount in self.penalties.items() ]}
+
+    def add_history(self, previous_pairs, penalty=HISTORY_PENALTY):
+        '''Penalizes pairing people again. With penalty=None, forbids it.'''
+        for a, b in previous_pairs:
+            if penalty is None:
+                self.must_not_pair.append((a, b))
+            else:
+                check_penalty((a, b), penalty)
+                self.penalties[(a, b)] = self.penalties.get((a, b), 0) + penalty
+
+def constraint_maps(constraints, index):
+    '''index maps emails to indexes. Returns penalty, which maps (i, j)
+    (both ways round) to the amount subtracted from that pair's score,
+    which is FORBIDDEN for a must-not pair, and partner, which maps each
+    student in a must pair to the other. Emails not in the index are
+    ignored.'''
+    penalty = {}
+    partner = {}
+    if constraints is None:
+        return penalty, partner
+    def both_ways(a, b, amount):
+        if a in index and b in index:
+            i, j = index[a], index[b]
+            penalty[(i, j)] = penalty.get((i, j), 0) + amount
+            penalty[(j, i)] = penalty.get((j, i), 0) + amount
+    for (a, b), amount in constraints.penalties.items():
+        both_ways(a, b, amount)
+    for a, b in constraints.must_not_pair:
+        both_ways(a, b, FORBIDDEN)
+    for a, b in constraints.must_pair:
+        if a in index and b in index:
+            i, j = index[a], index[b]
+            if partner.get(i, j) != j or partner.get(j, i) != i:
+                raise ValueError(f'{a} and {b} are in more than one must pair')
+            if penalty.get((i, j), 0) >= FORBIDDEN:
+                raise ValueError(f'{a} and {b} must, and must not, be paired')
+            partner[i] = j
+            partner[j] = i
+    return penalty, partner
+
+class MatchingContext:
+    def __init__(self, student_list, scores=None, constraints=None):
+        '''student_list is a list of student dictionaries, or a
+        band.Roster. If scores (an n x n list of lists, or a
+        ProfileScores) is omitted, it's computed as a ProfileScores,
+        with NumPy if it's a Roster. constraints is a Constraints.'''
+        # duck typing, so we don't import NumPy unless it's being used
+        self.roster = student_list if hasattr(student_list, 'score_matrix') else None
+        self.source = student_list
+        if scores is None and self.roster is not None:
+            scores = ProfileScores.from_roster(self.roster)
+        self.students = list(student_list)
+        self.index = { stud['student_email']: i
+                       for i,stud in enumerate(self.students) }
+        if scores is None:
+            scores = ProfileScores.from_weeks([ student_week(stud) for stud in self.students ])
+        self.scores = scores
+        # score_ij looks in unique, via profile_of, either way
+        if isinstance(scores, ProfileScores):
+            self.profile_of = scores.profile_of
+            self.unique = scores.unique
+        else:
+            self.profile_of = range(len(scores))
+            self.unique = scores
+        self.set_constraints(constraints)
+
+    def set_constraints(self, constraints):
+        '''The constraints are kept beside the score matrix, not in it, so
+        they can be changed without recomputing it; see constraint_maps.'''
+        self.constraints = constraints
+        self.trio_cache = {}
+        self.penalty, self.partner = constraint_maps(constraints, self.index)
+
+    def __len__(self):
+        return len(self.students)
+
+    def index_of(self, stud):
+        return self.index[stud['student_email']]
+
+    def covers(self, student_list):
+        '''True if every student in the list is in this context, with the
+        same schedule. Emails alone aren't enough: test students are A, B,
+        C in every cohort, and real students take more than one course.'''
+        if student_list is self.source:
+            return True
+        for stud in student_list:
+            i = self.index.get(stud['student_email'])
+            if i is None or student_week(self.students[i]) != student_week(stud):
+                return False
+        return True
+
+    def score(self, stud_a, stud_b):
+        '''args are student dictionaries'''
+        return self.score_ij(self.index[stud_a['student_email']],
+                             self.index[stud_b['student_email']])
+
+    def score_ij(self, i, j):
+        '''args are indexes into this context's students. Includes any
+        penalty for the pair.'''
+        if i == j:
+            return 0
+        score = self.unique[self.profile_of[i]][self.profile_of[j]]
+        if self.penalty:
+            score -= self.penalty.get((i, j), 0)
+        return score
+
+    def trio_score(self, stud_a, stud_b, stud_c):
+        '''The score of a trio (with an odd number of students, one pair
+        becomes a trio), including the penalties of each pair in it.
+        Cached, since exhaustive search asks about the same trios again
+        and again.'''
+        key = tuple(sorted(self.index[stud['student_email']] for stud in (stud_a, stud_b, stud_c)))
+        score = self.trio_cache.get(key)
+        if score is None:
+            i, j, k = key
+            score = self.trio_overlap(stud_a, stud_b, stud_c)
+            if self.penalty:
+                score -= (self.penalty.get((i, j), 0) + self.penalty.get((i, k), 0) +
+                          self.penalty.get((j, k), 0))
+            self.trio_cache[key] = score
+        return score
+
+    def overlap(self, stud_a, stud_b):
+        '''The score without any penalty'''
+        i = self.index[stud_a['student_email']]
+        j = self.index[stud_b['student_email']]
+        return 0 if i == j else self.unique[self.profile_of[i]][self.profile_of[j]]
+
+    def trio_overlap(self, stud_a, stud_b, stud_c):
+        '''The trio score without any penalty'''
+        return trio_week_score(student_week(stud_a), student_week(stud_b), student_week(stud_c))
+
+    def forbidden(self, stud_a, stud_b):
+        '''True if the pair must not be paired.'''
+        i = self.index[stud_a['student_email']]
+        j = self.index[stud_b['student_email']]
+        return self.penalty.get((i, j), 0) >= FORBIDDEN
+
+    def allowed(self, stud_a, stud_b):
+        '''False if the pair is forbidden, or if either of them must be
+        paired with someone else.'''
+        i = self.index[stud_a['student_email']]
+        j = self.index[stud_b['student_email']]
+        if self.partner.get(i, j) != j or self.partner.get(j, i) != i:
+            return False
+        return not self.forbidden(stud_a, stud_b)
+
+    def is_fixed(self, stud):
+        '''True if the student is in a must pair'''
+        return self.index[stud['student_email']] in self.partner
+
+    def split_fixed(self, student_list):
+        '''Returns the must pairs among student_list, as (stud_a, stud_b)
+        tuples, and a list of everyone else.'''
+        position = { stud['student_email']: stud for stud in student_list }
+        fixed = []
+        free = []
+        for stud in student_list:
+            i = self.index[stud['student_email']]
+            j = self.partner.get(i)
+            other = None if j is None else position.get(self.students[j]['student_email'])
+            if other is None:
+                free.append(stud)
+            elif i < j:
+                fixed.append((stud, other))
+        return fixed, free
+
+# The context made by the last call to compute_all_scores. It, along
+# with all_students and all_scores, is only for compatibility with
+# code that doesn't pass a context.
+
+default_ctx = None
+
 def compute_all_scores(student_list=None):
     if student_list is None:
         student_list = all_students # use the global in not specified
-    global all_scores
-    all_scores = compute_all_scores_2d_array(student_list)
+    global all_scores, default_ctx
+    default_ctx = MatchingContext(student_list)
+    all_scores = default_ctx.scores
     return all_scores
 
-def get_score(stud_a, stud_b):
-    return get_score_2d_array(stud_a, stud_b)
+def context_for(student_list=None, ctx=None):
+    '''Returns ctx if given, otherwise the default context if it covers
+    the students (the same ones, with the same schedules), otherwise a
+    new context for them.'''
+    if ctx is not None:
+        return ctx
+    if student_list is None:
+        student_list = all_students
+    if default_ctx is not None and default_ctx.covers(student_list):
+        return default_ctx
+    return MatchingContext(student_list)
+
+def require_default_ctx():
+    if default_ctx is None:
+        raise ValueError('no context: pass ctx, or call compute_all_scores first')
+    return default_ctx
+
+def get_score(stud_a, stud_b, ctx=None):
+    if ctx is None:
+        ctx = require_default_ctx()
+    return ctx.score(stud_a, stud_b)
 
 # ================================================================
 
@@ -278,38 +670,88 @@ def random_schedule():
 
 def set_random_schedule(stud):
     for day in days_of_the_week:
-        key = f'{day}_i'
+        key = f'{day.lower()}_i'
         stud[key] = random_schedule()
 
+def test_email(i):
+    '''Test students are A, B, C and so on, but a big cohort runs out
+    of letters, so after Z they are numbered.'''
+    if i < 26:
+        return chr(ord('A')+i)
+    return f'x{i}'
+
+def make_test_schedules(num_students):
+    '''Returns parallel lists of emails and packed schedules, where each
+    schedule is a list of 7 ints, one per day. This is the cheap way to
+    make a big synthetic cohort, since there are no dictionaries.'''
+    emails = [ test_email(i) for i in range(num_students) ]
+    packed = [ [ random_schedule() for day in days_of_the_week ]
+               for i in range(num_students) ]
+    return emails, packed
+
 def make_test_students(num_students, course='random'):
-    studs = [ make_test_student(course, chr(ord('A')+i))
-              for i in range(num_students) ]
+    emails, packed = make_test_schedules(num_students)
+    studs = [ {'course': course,
+               'student_email': email,
+               'student_name': email}
+              for email in emails ]
+    for stud, week in zip(studs, packed):
+        for day, sched in zip(days_of_the_week, week):
+            stud[f'{day.lower()}_i'] = sched
     global all_students
     all_students = studs
-    # store index in the universe
-    for i,stud in enumerate(studs):
-        stud['index'] = i
     # precompute overal scores
     compute_all_scores()
     return studs
 
-def save_all_students(conn=None):
+# ================================================================
+# Saving students. Each round trip to the database is expensive, so we
+# send batches of rows as multi-row upserts, and commit once at the end.
+
+def upsert_schedule_rows(curs, rows, batch_size=DEFAULT_BATCH_SIZE):
+    '''Each row is a list of the 10 columns of when_to_pair: course,
+    email, name and the 7 day schedules as ints. Sends them batch_size
+    rows at a time. Does not commit.'''
+    for chunk in chunked(rows, batch_size):
+        values = ','.join([ placeholders(10) ] * len(chunk))
+        params = [ val for row in chunk for val in row ]
+        curs.execute(f'''insert into when_to_pair values {values}
+                         on duplicate key update
+                         sun=values(sun), mon=values(mon), tue=values(tue), wed=values(wed),
+                         thu=values(thu), fri=values(fri), sat=values(sat)''',
+                     params)
+
+def save_packed_schedules(conn, course, emails, names, packed, batch_size=DEFAULT_BATCH_SIZE):
+    '''Saves students given as parallel sequences of emails, names and
+    packed schedules (7 ints each, like make_test_schedules returns),
+    without building a dictionary per student. All in one
+    transaction.'''
+    rows = ( [course, email, name] + [ int(sched) for sched in week ]
+             for email, name, week in zip(emails, names, packed) )
+    curs = dbi.cursor(conn)
+    try:
+        upsert_schedule_rows(curs, rows, batch_size)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def save_all_students(conn=None, students=None, batch_size=DEFAULT_BATCH_SIZE):
     if conn is None:
         dbi.conf('scottdb')
         conn = dbi.connect()
+    if students is None:
+        students = all_students
+    rows = ( [ stud['course'], stud['student_email'], stud['student_name'] ] +
+             [ stud[f'{day.lower()}_i'] for day in days_of_the_week ]
+             for stud in students )
     curs = dbi.cursor(conn)
-    for stud in all_students:
-        day_scheds = [ stud[f'{day}_i']
-                       for day in days_of_the_week ]
-        vals = [ stud['course'], stud['student_email'], stud['student_name'] ]
-        # twice
-        vals.extend(day_scheds)
-        vals.extend(day_scheds)
-        curs.execute('''insert into when_to_pair values(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                        on duplicate key update
-                        sun=%s, mon=%s, tue=%s, wed=%s, thu=%s, fri=%s, sat=%s''',
-                     vals)
-    conn.commit()
+    try:
+        upsert_schedule_rows(curs, rows, batch_size)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 # ================================================================
 # Schedule representation
@@ -343,12 +785,14 @@ def make_schedule(student_list=None):
             'unmatched': student_list[:], # use a copy, so we can remove from it
             'matched': [ [False] * n
                          for i in range(n) ],
+            'position': { stud['student_email']: i
+                          for i,stud in enumerate(student_list) },
             'score': 0}
 
 def match_two(schedule, stud_a, stud_b):
     '''Remove them both from unmatched, and add them to matched.'''
-    i = stud_a['index']
-    j = stud_b['index']
+    i = schedule['position'][stud_a['student_email']]
+    j = schedule['position'][stud_b['student_email']]
     schedule['matched'][i][j] = True
     schedule['matched'][j][i] = True
     schedule['unmatched'].remove(stud_a)
@@ -361,17 +805,17 @@ def match_two_ints(schedule, stud_i, stud_j):
     schedule['unmatched'].remove(schedule['students'][stud_i])
     schedule['unmatched'].remove(schedule['students'][stud_j])
 
-def compute_schedule_score(schedule):
+def compute_schedule_score(schedule, ctx=None):
     sched_score = 0
     lowest_overlap_score = 1_000_000_000
     students = schedule['students']
     n = len(students)
     matched = schedule['matched']
-    compute_all_scores(students) # precompute all pairs
+    ctx = context_for(students, ctx)
     for i in range(n):
         for j in range(i,n):
             if matched[i][j]:
-                score = get_score(students[i], students[j])
+                score = ctx.score(students[i], students[j])
                 # print(f'{score=}')
                 if score < lowest_overlap_score:
                     lowest_overlap_score = score
@@ -379,20 +823,20 @@ def compute_schedule_score(schedule):
     sched_score += lowest_overlap_score
     return sched_score
 
-def make_schedule_from_matching(student_list, matching):
+def make_schedule_from_matching(student_list, matching, ctx=None):
     '''A matching is a list of tuples'''
     sched = make_schedule(student_list)
     for pair in matching:
         match_two(sched, pair[0], pair[1])
-    sched['score'] = compute_schedule_score(sched)
+    sched['score'] = compute_schedule_score(sched, ctx)
     return sched
 
-def make_schedule_from_matching_ints(student_list, matching_ints):
+def make_schedule_from_matching_ints(student_list, matching_ints, ctx=None):
     '''A matching is a list of tuples'''
     sched = make_schedule(student_list)
     for i,j in matching_ints:
         match_two_ints(sched, i, j)
-    sched['score'] = compute_schedule_score(sched)
+    sched['score'] = compute_schedule_score(sched, ctx)
     return sched
 
 def array2d_to_tuple_list(array2d, universe=None):
@@ -406,9 +850,7 @@ def array2d_to_tuple_list(array2d, universe=None):
 
 def elt_generator(tuple_list):
     for tup in tuple_list:
-        yield tup[0]
-        if len(tup) == 2:
-            yield tup[1]
+        yield from tup
 
 def tuple_list_to_array2d(tuple_list):
     # find the universe, first. 
@@ -425,26 +867,86 @@ def tuple_list_to_array2d(tuple_list):
         array2d[j][i] = True
     
 
-def compute_schedule_score_from_tuple_list(tuple_list):
+def group_score(tup, ctx):
+    '''score of a pair or trio'''
+    if len(tup) == 3:
+        return ctx.trio_score(*tup)
+    return ctx.score(tup[0], tup[1])
+
+def group_overlap(tup, ctx):
+    '''score of a pair or trio without penalties, for display'''
+    if len(tup) == 3:
+        return ctx.trio_overlap(*tup)
+    return ctx.overlap(tup[0], tup[1])
+
+def compute_schedule_score_from_tuple_list(tuple_list, ctx=None):
+    '''Tuples are pairs or trios; a singleton (someone left over)
+    doesn't count.'''
+    if ctx is None:
+        ctx = require_default_ctx()
     sched_score = 0
-    lowest_overlap_score = 1_000_000_000
-    n = len(tuple_list)
+    lowest_overlap_score = None
     for tup in tuple_list:
-        score = get_score(tup[0], tup[1])
+        if len(tup) == 1:
+            continue
+        score = group_score(tup, ctx)
         # print(f'{score=}')
-        if score < lowest_overlap_score:
+        if lowest_overlap_score is None or score < lowest_overlap_score:
             lowest_overlap_score = score
         sched_score += score
-    sched_score += lowest_overlap_score
+    sched_score += lowest_overlap_score or 0
     return sched_score
+
+def best_merge(solo, pairs, ctx, other_scores=()):
+    '''solo is a student left over, pairs is a list of (stud_a, stud_b)
+    and other_scores are the scores of any other groups. Returns the
+    index in pairs of the pair that solo should join, to make the
+    matching's score (the sum, plus the lowest again) as high as
+    possible, and what that score would be. The index is None if there
+    are no pairs.'''
+    pair_scores = [ ctx.score(a, b) for a,b in pairs ]
+    total = sum(pair_scores) + sum(other_scores)
+    other_lowest = min(other_scores, default=None)
+    # without pair k, the lowest pair is the lowest of these two that isn't k
+    two_lowest = sorted(range(len(pairs)), key=pair_scores.__getitem__)[:2]
+    best_k = None
+    best_score = None
+    for k,(a,b) in enumerate(pairs):
+        trio = ctx.trio_score(solo, a, b)
+        lowest = trio
+        for m in two_lowest:
+            if m != k:
+                lowest = min(lowest, pair_scores[m])
+                break
+        if other_lowest is not None:
+            lowest = min(lowest, other_lowest)
+        score = total - pair_scores[k] + trio + lowest
+        if best_score is None or score > best_score:
+            best_k = k
+            best_score = score
+    return best_k, best_score
+
+def merge_singleton(tuple_list, ctx):
+    '''If the tuple list has a singleton, merges it into the best pair,
+    as for best_merge. Returns the new tuple list and its score.'''
+    solos = [ tup for tup in tuple_list if len(tup) == 1 ]
+    pairs = [ tup for tup in tuple_list if len(tup) == 2 ]
+    if len(solos) != 1 or len(pairs) == 0:
+        return tuple_list, compute_schedule_score_from_tuple_list(tuple_list, ctx)
+    others = [ tup for tup in tuple_list if len(tup) == 3 ]
+    k, score = best_merge(solos[0][0], pairs, ctx,
+                          [ ctx.trio_score(*tup) for tup in others ])
+    trio = (solos[0][0],) + pairs[k]
+    return pairs[:k] + pairs[k+1:] + others + [trio], score
     
 
-def schedule_to_str(schedule):
+def schedule_to_str(schedule, ctx=None):
     '''For printing a schedule.'''
     result = ''
     students = schedule['students']
     n = len(students)
     matched = schedule['matched']
+    ctx = context_for(students, ctx)
     for i in range(n):
         for j in range(i,n):
             if matched[i][j]:
@@ -452,44 +954,133 @@ def schedule_to_str(schedule):
                 stud_b = students[j]
                 name_a = stud_a['student_name']
                 name_b = stud_b['student_name']
-                score = get_score(stud_a, stud_b)
+                score = ctx.overlap(stud_a, stud_b)
                 result += f'''{score}\t{name_a} with {name_b}\n'''
-    if len(schedule['unmatched']) > 0:
-        stud_solo = schedule['unmatched']
+    for stud_solo in schedule['unmatched']:
         result += 'unmatched:  ' + stud_solo['student_name'] + '\n'
     result += f'''schedule score: {schedule['score']}'''
     return result
 
+# ================================================================
+# Meeting times
+
+'''The score says how well a pair overlaps, but the pair wants to know
+when to meet. Their common free time on a day is the AND of their day
+ints, and each run of 1 bits in that is a period they could meet.
+band.meeting_blocks finds the longest runs for all the pairs at once,
+with NumPy; see pair_meetings.'''
+
+MEETING_BLOCKS = 3              # how many meeting times to suggest
+
+def format_block(day, first, length, codec=None):
+    '''like Tue 14:00–16:00'''
+    if codec is None:
+        codec = slot_codec.codec
+    return days_of_the_week[day] + ' ' + codec.start_strs[first] + codec.end_strs[first + length - 1]
+
+def common_week(studs):
+    '''the slots all of the students have free, as 7 day ints'''
+    week = student_week(studs[0])
+    for stud in studs[1:]:
+        week = [ a & b for a,b in zip(week, student_week(stud)) ]
+    return week
+
+def pair_meetings(pairs, top=MEETING_BLOCKS):
+    '''For a list of (stud_a, stud_b) pairs, or trios, returns a list of
+    their top meeting times, each formatted like Tue 14:00–16:00. All the
+    pairs are done at once, with NumPy; see band.meeting_blocks.
+
+    Students on a course's own grid (see slot_grid.read_grid_students)
+    may have more than 32 slots a day, which is too many for band, so
+    their runs are found with the grid's codec, one pair at a time.'''
+    if len(pairs) == 0:
+        return []
+    if 'grid' in pairs[0][0]:
+        import slot_grid
+        codec = slot_grid.cached_grid(tuple(pairs[0][0]['grid'])).codec
+        return [ grid_meetings(codec, student_week(group[0]), common_week(group[1:]), top)
+                 for group in pairs ]
+    import band
+    days, firsts, lengths = band.meeting_blocks([ student_week(group[0]) for group in pairs ],
+                                                [ common_week(group[1:]) for group in pairs ],
+                                                top)
+    return [ [ format_block(day, first, length)
+               for day, first, length in zip(*row) if length > 0 ]
+             for row in zip(days.tolist(), firsts.tolist(), lengths.tolist()) ]
+
+def grid_meetings(codec, week_a, week_b, top=MEETING_BLOCKS):
+    '''The top longest common runs of two weeks, longest first, then
+    earliest, formatted with the codec, as pair_meetings does.'''
+    blocks = sorted((-length, day, first)
+                    for day in range(7)
+                    for first, length in codec.runs(week_a[day] & week_b[day]))
+    return [ format_block(day, first, -neg, codec) for neg, day, first in blocks[:top] ]
+
 # ================================================================
 # Matching objects
 
 class Matching:
-    def __init__(self, student_list):
+    def __init__(self, student_list, ctx=None):
         self.student_list = student_list
+        self.ctx = context_for(student_list, ctx)
+        # position in student_list, which need not be the index in ctx
+        self.position = { stud['student_email']: i
+                          for i,stud in enumerate(student_list) }
         n = len(student_list)
         self.unpaired = student_list[:]
         self.pairs_array = [ [False] * n
                              for i in range(n) ]
         self.pairs = []         # a list of pairs of indexes, i < j
-        self.lowest_pair = None
+        self.trios = []         # triples of indexes, i < j < k
+        self.lowest_pair = None # or trio
+        self.lowest_score = 0
+        self.lowest_overlap = 0 # the lowest's score without penalties
         self.score = 0
 
     def add_pair(self, stud_a, stud_b):
-        i = stud_a['index']
-        j = stud_b['index']
+        i = self.position[stud_a['student_email']]
+        j = self.position[stud_b['student_email']]
         self.pairs_array[i][j] = True
         self.pairs_array[j][i] = True
         self.unpaired.remove(stud_a)
         self.unpaired.remove(stud_b)
 
     def remove_pair(self, stud_a, stud_b):
-        i = stud_a['index']
-        j = stud_b['index']
+        i = self.position[stud_a['student_email']]
+        j = self.position[stud_b['student_email']]
         self.pairs_array[i][j] = False
         self.pairs_array[j][i] = False
         self.unpaired.append(stud_a)
         self.unpaired.append(stud_b)
 
+    def add_trio(self, stud_a, stud_b, stud_c):
+        self.trios.append(tuple(sorted(self.position[stud['student_email']]
+                                       for stud in (stud_a, stud_b, stud_c))))
+        for stud in (stud_a, stud_b, stud_c):
+            self.unpaired.remove(stud)
+
+    def remove_trio(self, stud_a, stud_b, stud_c):
+        self.trios.remove(tuple(sorted(self.position[stud['student_email']]
+                                       for stud in (stud_a, stud_b, stud_c))))
+        self.unpaired.extend([stud_a, stud_b, stud_c])
+
+    def merge_leftover(self):
+        '''With an odd number of students, one is left unpaired. This
+        merges them into the pair that makes the best trio (see
+        best_merge). Does nothing unless exactly one is unpaired.'''
+        if len(self.unpaired) != 1:
+            return
+        sl = self.student_list
+        pairs = [ (sl[i], sl[j]) for i,j in self.all_pairs() ]
+        solo = self.unpaired[0]
+        k, score = best_merge(solo, pairs, self.ctx,
+                              [ self.ctx.trio_score(*(sl[i] for i in trio)) for trio in self.trios ])
+        if k is None:
+            return
+        a, b = pairs[k]
+        self.remove_pair(a, b)
+        self.add_trio(solo, a, b)
+
     # should we return indexes or elements? The former is more
     # efficient but more cumbersome
     def all_pairs(self):
@@ -504,7 +1095,7 @@ class Matching:
         paired = self.pairs_array
         n = len(self.student_list)
         total_score = 0
-        lowest_score = 1_000_000_000
+        lowest_score = None
         lowest_pair = None
         pairs = []
         for i in range(n):
@@ -515,19 +1106,33 @@ class Matching:
                     name_a = stud_a['student_name']
                     name_b = stud_b['student_name']
                     pairs.append((i, j))
-                    score = get_score(stud_a, stud_b)
-                    if score < lowest_score:
+                    score = self.ctx.score(stud_a, stud_b)
+                    if lowest_score is None or score < lowest_score:
                         lowest_score = score
                         lowest_pair = (stud_a, stud_b)
                     total_score += score
+        for trio in self.trios:
+            group = tuple(students[i] for i in trio)
+            score = self.ctx.trio_score(*group)
+            if lowest_score is None or score < lowest_score:
+                lowest_score = score
+                lowest_pair = group
+            total_score += score
+        if lowest_score is None:
+            lowest_score = 0    # nobody is paired
         total_score += lowest_score
         self.score = total_score
         self.pairs = pairs
         self.lowest_pair = lowest_pair
         self.lowest_score = lowest_score
+        self.lowest_overlap = 0 if lowest_pair is None else group_overlap(lowest_pair, self.ctx)
         return total_score
 
     def random_pairing(self):
+        # must pairs first
+        fixed, free = self.ctx.split_fixed(self.unpaired)
+        for a,b in fixed:
+            self.add_pair(a,b)
         # steadily shrink the length of the unpaired list
         unpaired = self.unpaired
         while len(unpaired) > 1:
@@ -557,18 +1162,21 @@ class Matching:
             # print('after')
             # for p in self.all_pairs():
             #     print(p, sep=' ')
+        self.merge_leftover()
 
     def __str__(self):
         # have to precompute the score so that we know what the lowest
-        # is, so we can add an asterisk
+        # is, so we can add an asterisk. Scores shown are overlaps,
+        # without penalties, which only steer the matching.
         total = self.calculate_score()
         students = self.student_list
         lowest_pair = self.lowest_pair
         result = ''
-        for i,j in self.pairs:
+        meetings = pair_meetings([ (students[i], students[j]) for i,j in self.pairs ])
+        for (i,j), times in zip(self.pairs, meetings):
             stud_a = students[i]
             stud_b = students[j]
-            score = get_score(stud_a, stud_b)
+            score = self.ctx.overlap(stud_a, stud_b)
             name_a = stud_a['student_name']
             name_b = stud_b['student_name']
             ## add an asterisk to the lowest pair
@@ -576,12 +1184,47 @@ class Matching:
                 result += f'''{name_a} with {name_b} ({score}) **\n'''
             else:
                 result += f'''{name_a} with {name_b} ({score})\n'''
+            if times:
+                result += '    meet: ' + ', '.join(times) + '\n'
+        trios = [ tuple(students[i] for i in trio) for trio in self.trios ]
+        for group, times in zip(trios, pair_meetings(trios)):
+            stud_a, stud_b, stud_c = group
+            score = self.ctx.trio_overlap(*group)
+            mark = ' **' if group == lowest_pair else ''
+            result += f'''{stud_a['student_name']} with {stud_b['student_name']} and {stud_c['student_name']} ({score}){mark}\n'''
+            if times:
+                result += '    meet: ' + ', '.join(times) + '\n'
         for solo in self.unpaired:
             result += 'unmatched:  ' + solo['student_name'] + '\n'
         result += f'''score: {total}\n'''
-        result += f'''lowest: {self.lowest_score}\n'''
+        result += f'''lowest: {self.lowest_overlap}\n'''
         return result
 
+    def to_dict(self):
+        '''For JSON. Pairs are [email_a, email_b, score] lists, and
+        meetings[k] is a list of the best times for pairs[k] to meet,
+        like Tue 14:00–16:00. Trios, and trio_meetings, are the same
+        but with three emails. The pair, trio and lowest scores are
+        overlaps, without penalties; score is the objective, with
+        them.'''
+        total = self.calculate_score()
+        students = self.student_list
+        pairs = []
+        for i,j in self.pairs:
+            stud_a = students[i]
+            stud_b = students[j]
+            pairs.append([stud_a['student_email'], stud_b['student_email'],
+                          self.ctx.overlap(stud_a, stud_b)])
+        trios = [ tuple(students[i] for i in trio) for trio in self.trios ]
+        return {'pairs': pairs,
+                'meetings': pair_meetings([ (students[i], students[j]) for i,j in self.pairs ]),
+                'trios': [ [ stud['student_email'] for stud in group ] + [self.ctx.trio_overlap(*group)]
+                           for group in trios ],
+                'trio_meetings': pair_meetings(trios),
+                'unmatched': [ solo['student_email'] for solo in self.unpaired ],
+                'score': total,
+                'lowest_score': self.lowest_overlap}
+
 def test_random_pairing(trials=1000, elts='a b c d e f'.split()):
     '''This seems to work.'''
     counts = {}
@@ -620,24 +1263,122 @@ so make sure you account for that in the algorithm.
 
 # Option 1: Greedy
 
-def matching_greedy(students=None):
-    if students is None:
-        students = all_students
-    m = Matching(students)
+def default_students(student_list, ctx):
+    if student_list is not None:
+        return student_list
+    if ctx is not None:
+        return ctx.students
+    return all_students
+
+def matching_greedy(students=None, ctx=None):
+    students = default_students(students, ctx)
+    ctx = context_for(students, ctx)
+    m = Matching(students, ctx)
+    fixed, free = ctx.split_fixed(students)
+    for a,b in fixed:
+        m.add_pair(a,b)
     unmatched = m.unpaired # we are assuming that aliasing will work for us
     while len(unmatched) > 1:
         for stud in unmatched:
-            best_overlap_score = -1
+            # scores include penalties, so can be negative, and a
+            # forbidden pair is only chosen if there's nobody else
+            best_overlap_score = None
             best_overlap_other = None
             for other in unmatched:
-                this_score = get_score(stud, other)
-                if this_score > best_overlap_score:
+                if other is stud:
+                    continue
+                this_score = ctx.score(stud, other)
+                if best_overlap_score is None or this_score > best_overlap_score:
                     best_overlap_score = this_score
                     best_overlap_other = other
             m.add_pair(stud, best_overlap_other)
+    m.merge_leftover()
+    m = repair_forbidden(m)
     m.calculate_score()
     return m
 
+def has_forbidden(group, ctx):
+    return any(ctx.forbidden(group[i], group[j])
+               for i in range(len(group)) for j in range(i+1, len(group)))
+
+def repair_forbidden(m):
+    '''Greedy pairs up whoever is left at the end, which can be a
+    forbidden pair even when a valid matching exists. For each group
+    with a forbidden pair in it, this tries changing it along with one
+    or two other groups, choosing the change that leaves none of them
+    forbidden and scores best; see group_changes. Must pairs stay
+    together. If some group can't be fixed that way, it climbs from
+    there with local_search_steps, whose scores include the FORBIDDEN
+    penalty, and raises ValueError if that still leaves a forbidden
+    pair. Returns a new Matching, or m if there was nothing to fix.'''
+    ctx = m.ctx
+    sl = m.student_list
+    groups = ([ tuple(sl[i] for i in pair) for pair in m.all_pairs() ] +
+              [ tuple(sl[i] for i in trio) for trio in m.trios ])
+    bad = [ k for k,group in enumerate(groups) if has_forbidden(group, ctx) ]
+    if not bad:
+        return m
+    for k in bad:
+        if not has_forbidden(groups[k], ctx):
+            continue            # fixed by an earlier change
+        best = None
+        best_score = None
+        for change in group_changes(groups, k, ctx):
+            if any(has_forbidden(group, ctx) for group in change.values()):
+                continue
+            score = sum(group_score(group, ctx) - group_score(groups[h], ctx)
+                        for h, group in change.items())
+            if best_score is None or score > best_score:
+                best = change
+                best_score = score
+        if best is None:
+            return climb_out_of_forbidden(matching_from_tuples(sl, groups, ctx))
+        for h, group in best.items():
+            groups[h] = group
+    return matching_from_tuples(sl, groups, ctx)
+
+def group_changes(groups, k, ctx):
+    '''Generator of the ways to change group k, as dictionaries of the
+    indexes of the groups changed to their new members: someone in k
+    swaps with someone in another group; or, if k is a trio, moves into
+    a pair; or, if k is a pair, moves into another pair, and someone
+    from the trio takes their place. Students in must pairs don't
+    move, though others can join their pair.'''
+    trios = [ h for h,group in enumerate(groups) if len(group) == 3 ]
+    for x in groups[k]:
+        if ctx.is_fixed(x):
+            continue
+        without_x = tuple(stud for stud in groups[k] if stud is not x)
+        for h, other in enumerate(groups):
+            if h == k:
+                continue
+            for y in other:
+                if not ctx.is_fixed(y):
+                    yield {k: without_x + (y,),
+                           h: tuple(stud for stud in other if stud is not y) + (x,)}
+            if len(other) != 2:
+                continue
+            if len(groups[k]) == 3:
+                yield {k: without_x, h: other + (x,)}
+                continue
+            for t in trios:
+                if t == h or t == k:
+                    continue
+                for y in groups[t]:
+                    if not ctx.is_fixed(y):
+                        yield {k: without_x + (y,), h: other + (x,),
+                               t: tuple(stud for stud in groups[t] if stud is not y)}
+
+def climb_out_of_forbidden(m):
+    for m in local_search_steps(m):
+        pass
+    sl = m.student_list
+    groups = ([ tuple(sl[i] for i in pair) for pair in m.all_pairs() ] +
+              [ tuple(sl[i] for i in trio) for trio in m.trios ])
+    if any(has_forbidden(group, m.ctx) for group in groups):
+        raise ValueError('no matching satisfies the constraints')
+    return m
+
 greedy_schedule = None
 
 def matching_greedy_test(n):
@@ -660,10 +1401,13 @@ The solution to that E,F,G,H subproblem is not a single schedule, but
 a list of schedules. The caller can iterate over that list, adding
 more pairs to each.
 
-Note that we could have an odd number of students, so that means, with
-just 3 students, we have three matchings: [ (a,b) (c) ], [ (a,c), b ]
-and [ (b,c), a ]. But I think we can try removing each element as a
-singleton, and then deal only with pairs.
+Note that we could have an odd number of students, so one group is a
+trio. Rather than leaving each student out in turn and merging them
+into each pair (which generates every trio three times over, once for
+each of its members), the matchings are generated with the trio in
+them: the first student is either in the trio, with two others, or in
+a pair, with the trio still to come among the rest. So with 5
+students, there are 10 trios, each with one pair for the other two.
 
 We could use a dynamic programming approach, indexing an array with
 the set of unmatched students. The array needs to be of size 2^N where
@@ -732,72 +1476,61 @@ def match_count_table(n):
         print(f'{i} => {mc:,}')
 
 
-def matchlist(elts):
+def matchlist(elts, allowed=None):
     '''Return a list of all the matches drawn from elts, in canonical
-    order, where each match is represented as a list of tuples. A
-    singleton tuple, if any, will be the first tuple.'''
-    n = len(elts)
-    if n == 0:
-        return []
-    if n == 1:
-        return [[(elts[0],)]]
-    if n == 2:
-        return [[(elts[0],elts[1])]]
-    is_even = (n % 2) == 0
-    if is_even:
-        a = elts[0]
-        rest = elts[1:]
-        results = []
-        for b in rest:
-            first_tuple = (a,b)
-            others = copy_remove(rest, b)
-            for matches in matchlist(others):
-                matches.insert(0, first_tuple)
-                results.append( matches )
-        return results
-    if not is_even:
-        results = []
-        for a in elts:
-            first_tuple = (a,)
-            others = copy_remove(elts, a)
-            for matches in matchlist(others):
-                matches.insert(0, first_tuple)
-                results.append( matches )
-        return results
-
-
-def matchlist_generator(elts):
+    order, where each match is represented as a list of tuples. With an
+    odd number, one tuple is a trio (or, with just one elt, a
+    singleton). If allowed is given, it's a function of two elts, and
+    matches with a pair it rejects, in a pair or a trio, are pruned.'''
+    return list(matchlist_generator(elts, allowed))
+
+def matchlist_generator(elts, allowed=None, trio=None):
     '''Returns a generator that will yield all the matches drawn from
     elts, in canonical order, where each match is represented as a
-    list of tuples. A singleton tuple, if any, will be the first
-    tuple.
-
+    list of tuples, as for matchlist. trio says whether one of the
+    tuples is a trio; by default, if the number of elts is odd.
+
+    The first elt is either in the trio, with each two of the others,
+    or in a pair, with each of the others, and the trio still to come.
+    So each match is generated once: for odd n, that's C(n,3) trios
+    times (n-4)!! pairings of the rest, with no singletons to merge
+    afterwards, and no lists of sub-matches are built.
     '''
     n = len(elts)
+    if trio is None:
+        trio = n % 2 == 1
     if n == 0:
         yield []
+        return
     if n == 1:
-        yield [[(elts[0],)]]
-    if n == 2:
-        yield [[(elts[0],elts[1])]]
-    is_even = (n % 2) == 0
-    if is_even:
-        a = elts[0]
-        rest = elts[1:]
-        for b in rest:
-            first_tuple = (a,b)
-            others = copy_remove(rest, b)
-            for matches in matchlist(others):
-                matches.insert(0, first_tuple)
-                yield matches
-    if not is_even:
-        results = []
-        for a in elts:
-            first_tuple = (a,)
-            others = copy_remove(elts, a)
-            for matches in matchlist(others):
-                matches.insert(0, first_tuple)
-                yield matches
+        # nobody to make a trio with
+        yield [(elts[0],)]
+        return
+    ok = (lambda a, b: True) if allowed is None else allowed
+    a = elts[0]
+    rest = elts[1:]
+    if trio:
+        for i, b in enumerate(rest):
+            if not ok(a, b):
+                continue
+            for c in rest[i+1:]:
+                if not ok(a, c) or not ok(b, c):
+                    continue
+                others = copy_remove(copy_remove(rest, b), c)
+                for matches in matchlist_generator(others, allowed, False):
+                    matches.insert(0, (a,b,c))
+                    yield matches
+        if n < 5:
+            # no room for a pair and a trio
+            return
+    for b in rest:
+        if not ok(a, b):
+            continue
+        first_tuple = (a,b)
+        others = copy_remove(rest, b)
+        for matches in matchlist_generator(others, allowed, trio):
+            matches.insert(0, first_tuple)
+            yield matches
 
 def matchlist_print(elts):
     for match in matchlist_generator(elts):
@@ -820,22 +1553,51 @@ def encode_set(subset, universe):
             result = result | bit
     return result
 
-def matching_exhaustive(student_list=None):
-    if student_list is None:
-        student_list = all_students
+def constraint_pruning(ctx):
+    '''The allowed function for matchlist, or None if there are no
+    constraints to prune with.'''
+    if ctx.penalty or ctx.partner:
+        return ctx.allowed
+    return None
+
+def exhaustive_tuple_lists(fixed, free, ctx):
+    '''Generator of every matching, as a tuple list, with the must pairs
+    (fixed) in it. The trio is among the free students, from
+    matchlist_generator, or else it's a must pair and one free student,
+    with the rest of them in pairs.'''
+    allowed = constraint_pruning(ctx)
+    if len(free) != 1 or not fixed:
+        for match in matchlist_generator(free, allowed):
+            yield fixed + match
+    if len(free) % 2 == 0 or not fixed:
+        return
+    for i, solo in enumerate(free):
+        others = free[:i] + free[i+1:]
+        for k, host in enumerate(fixed):
+            if any(ctx.forbidden(solo, stud) for stud in host):
+                continue
+            rest = fixed[:k] + fixed[k+1:] + [host + (solo,)]
+            for match in matchlist_generator(others, allowed, False):
+                yield rest + match
+
+def matching_exhaustive(student_list=None, ctx=None):
+    student_list = default_students(student_list, ctx)
+    ctx = context_for(student_list, ctx)
+    # must pairs are fixed, and forbidden pairs are pruned
+    fixed, free = ctx.split_fixed(student_list)
     # a match is a list of tuples
     best_match = None
-    best_score = 0
-    for match in matchlist_generator(student_list):
-        score = compute_schedule_score_from_tuple_list(match)
-        if score > best_score:
+    best_score = None
+    for match in exhaustive_tuple_lists(fixed, free, ctx):
+        score = compute_schedule_score_from_tuple_list(match, ctx)
+        if best_score is None or score > best_score:
             best_match = match
             best_score = score
             # print(f'new best: {best_score}')
+    if best_match is None:
+        raise ValueError('no matching satisfies the constraints')
     # sched = make_schedule_from_matching(all_students, best_match)
-    m = Matching(student_list)
-    for a,b in best_match:
-        m.add_pair(a,b)
+    m = matching_from_tuples(student_list, best_match, ctx)
     m.calculate_score()
     return m
     
@@ -856,7 +1618,7 @@ optimal.
 I'll call this K-greedy, but I'll start with two-greedy
 '''
 
-def two_greedy_matchings_recursive(student_list=None):
+def two_greedy_matchings_recursive(student_list=None, ctx=None):
     '''Returns a generator of all matchings where the pairs are always
     among the two best possible matchings, given earlier
     choices. pairwise_score is a function taking two arguments and
@@ -868,20 +1630,30 @@ def two_greedy_matchings_recursive(student_list=None):
     eminently do-able.
 
     '''
-    if student_list is None:
+    if student_list is None and ctx is None:
         if all_students is None:
             make_test_students(20, 'twenty')
-        student_list = all_students
+    student_list = default_students(student_list, ctx)
+    ctx = context_for(student_list, ctx)
     pair_scores = []
     n = len(student_list)
-    if n == 2:
-        # result is always a list of tuples
-        yield [tuple(student_list)]
+    if n <= 2:
+        # result is always a list of tuples; with an odd number, the
+        # last one is left over, for the caller to merge into a trio
+        yield [tuple(student_list)] if n > 0 else []
+        return
     for i in range(n):
         for j in range(i+1,n):
             a = student_list[i]
             b = student_list[j]
-            pair_scores.append((a, b, overlap_score(a,b)))
+            # prune forbidden pairs, and ones splitting a must pair
+            if ctx.allowed(a, b):
+                pair_scores.append((a, b, ctx.score(a,b)))
+    if len(pair_scores) == 0 and n > 2:
+        # everything left is forbidden; a bad pair beats none
+        pair_scores = [ (a, b, ctx.score(a,b))
+                        for i,a in enumerate(student_list)
+                        for b in student_list[i+1:] ]
     pair_scores.sort(key=lambda stud: stud[2],
                      reverse=True)
     best = pair_scores[:2]      # could be K
@@ -892,58 +1664,62 @@ def two_greedy_matchings_recursive(student_list=None):
         copy = student_list[:]
         copy.remove(a)
         copy.remove(b)
-        for other in two_greedy_matchings_recursive(copy):
+        for other in two_greedy_matchings_recursive(copy, ctx):
             other.insert(0, (a,b))
-            other_names = [ (t[0]['student_name'],
-                             t[1]['student_name'])
+            other_names = [ tuple(stud['student_name'] for stud in t)
                             for t in other ]
             # print(f'''{indent} {other_names=}''')
             yield other
 
-def matching_two_greedy(student_list=None):
-    if student_list is None:
-        student_list = all_students
+def matching_two_greedy(student_list=None, ctx=None):
+    student_list = default_students(student_list, ctx)
+    ctx = context_for(student_list, ctx)
+    fixed, free = ctx.split_fixed(student_list)
     cnt = 0
     best_match = None
-    best_score = 0
-    for match in two_greedy_matchings_recursive(student_list):
-        score = compute_schedule_score_from_tuple_list(match)
+    best_score = None
+    for match in (two_greedy_matchings_recursive(free, ctx) if free else [[]]):
+        match, score = merge_singleton(fixed + match, ctx)
 
         cnt += 1
-        names = [ (t[0]['student_name'],
-                   t[1]['student_name'])
+        names = [ tuple(stud['student_name'] for stud in t)
                   for t in match ]
         # print(f'{cnt}: {score=} {names}')
 
-        if score > best_score:
+        if best_score is None or score > best_score:
             best_match = match
             best_score = score
             # print(f'new best: {best_score}')
+    if best_match is None:
+        raise ValueError('no matching satisfies the constraints')
     # sched = make_schedule_from_matching(all_students, best_match)
-    m = Matching(student_list)
-    for a,b in best_match:
-        m.add_pair(a,b)
+    m = matching_from_tuples(student_list, best_match, ctx)
+    m.calculate_score()
     return m
 
 
 # ================================================================
 # Improve
 
-def matching_improve(matching):
+def matching_improve(matching, verbose=True):
     '''Unlike the earlier algorithms, this takes an existing matching
     and tries to improve it by considering all pairs of pairs, and if
     they are [(a,b),(c,d),...others] considers [(a,c),(b,d),...others]
-    and [(a,d),(b,c) to see if either are any better.
+    and [(a,d),(b,c) to see if either are any better. If there's a
+    trio (a,b,e), it also tries swapping each of them with c or d.
 
     '''
     # we have to modify a copy or it's possible that adding/removing
     # pairs will mess up the iteration, though I think we never will
     # visit either of these again, so it might not matter.
     sl = matching.student_list
-    improved = Matching(sl)
+    ctx = matching.ctx
+    improved = Matching(sl, ctx)
     for i,j in matching.all_pairs():
         # ick. There has to be a more efficient way to do this
         improved.add_pair(sl[i], sl[j])
+    for trio in matching.trios:
+        improved.add_trio(*(sl[i] for i in trio))
     score_before = matching.calculate_score()
     for i,pi in enumerate(matching.all_pairs()):
         for j,pj in enumerate(matching.all_pairs()):
@@ -952,27 +1728,69 @@ def matching_improve(matching):
             # pi and pj contain indexes, so need to dereference
             a,b = sl[pi[0]], sl[pi[1]]
             c,d = sl[pj[0]], sl[pj[1]]
-            score1 = get_score(a,b)+get_score(c,d)
-            score2 = get_score(a,c)+get_score(b,d)
-            score3 = get_score(a,d)+get_score(b,c)
+            if ctx.partner and (ctx.is_fixed(a) or ctx.is_fixed(c)):
+                # must pairs stay together
+                continue
+            score1 = ctx.score(a,b)+ctx.score(c,d)
+            score2 = ctx.score(a,c)+ctx.score(b,d)
+            score3 = ctx.score(a,d)+ctx.score(b,c)
             if score1 >= score2 and score1 >= score3:
                 # no improvement possible
                 continue
             improved.remove_pair(a,b)
             improved.remove_pair(c,d)
             if score2 > score3:
-                improved.add_pair(a,c)
-                improved.add_pair(b,d)
-                print(f'swapping A,B and C,D for A,C and B,D')
+                new_pairs = [(a,c), (b,d)]
+                swap = 'swapping A,B and C,D for A,C and B,D'
             else:
-                improved.add_pair(a,d)
-                improved.add_pair(b,c)
-                print(f'swapping A,B and C,D for A,D and B,C')
-            # debug
+                new_pairs = [(a,d), (b,c)]
+                swap = 'swapping A,B and C,D for A,D and B,C'
+            for x,y in new_pairs:
+                improved.add_pair(x,y)
             score_after = improved.calculate_score()
-            print(f'score improved from {score_before} to {score_after}')
-            assert score_before < score_after
+            if score_after <= score_before:
+                # the sum went up, but the lowest pair got worse by more
+                # than that, so undo the swap
+                for x,y in new_pairs:
+                    improved.remove_pair(x,y)
+                improved.add_pair(a,b)
+                improved.add_pair(c,d)
+                continue
+            if verbose:
+                print(swap)
+                print(f'score improved from {score_before} to {score_after}')
             return improved, False
+    for trio in matching.trios:
+        group = [ sl[i] for i in trio ]
+        if ctx.partner and any(ctx.is_fixed(stud) for stud in group):
+            continue
+        for pj in matching.all_pairs():
+            c,d = sl[pj[0]], sl[pj[1]]
+            if ctx.partner and ctx.is_fixed(c):
+                continue
+            score1 = ctx.trio_score(*group) + ctx.score(c,d)
+            for x in group:
+                rest = [ stud for stud in group if stud is not x ]
+                for y,z in [(c,d), (d,c)]:
+                    # x trades places with y
+                    score2 = ctx.trio_score(rest[0], rest[1], y) + ctx.score(x,z)
+                    if score2 <= score1:
+                        continue
+                    improved.remove_trio(*group)
+                    improved.remove_pair(c,d)
+                    improved.add_trio(rest[0], rest[1], y)
+                    improved.add_pair(x,z)
+                    score_after = improved.calculate_score()
+                    if score_after <= score_before:
+                        improved.remove_pair(x,z)
+                        improved.remove_trio(rest[0], rest[1], y)
+                        improved.add_trio(*group)
+                        improved.add_pair(c,d)
+                        continue
+                    if verbose:
+                        print('swapping a member of the trio with a pair')
+                        print(f'score improved from {score_before} to {score_after}')
+                    return improved, False
     # return original and True if no improvement
     return matching, True
 
@@ -986,14 +1804,153 @@ def matching_local_optimum(matching):
     print(f'Overall, score improved from {score1} to {score2}')
     return matching
 
-def matching_hill_climbing_random_start(student_list=None):
-    if student_list is None:
-        student_list = all_students
-    matching1 = Matching(student_list)
+def matching_hill_climbing_random_start(student_list=None, ctx=None):
+    student_list = default_students(student_list, ctx)
+    matching1 = Matching(student_list, ctx)
     matching1.random_pairing()
     print(matching1)
     return matching_local_optimum(matching1)
 
+# ================================================================
+# Anytime matching
+
+'''The algorithms above run to completion and return one answer. For
+the web app, it's better to have a good answer right away and better
+ones as they're found. matching_anytime is a generator that yields an
+Improvement each time it finds a matching that beats the best so far.
+The caller can stop whenever it likes, or pass a deadline (a
+time.monotonic() value) and/or a cancel token (anything with an
+is_set() method, like a threading.Event), which are checked between
+candidates and between improvement steps.
+
+All the algorithms share this interface; they differ in where the
+candidate matchings come from:
+
+hill_climbing: greedy first, then its local optimum, then random
+    restarts, each climbed to a local optimum, until stopped.
+
+two_greedy: all the two-greedy matchings.
+
+exhaustive: all the matchings. Only sensible for small classes.
+
+'''
+
+class Improvement:
+    def __init__(self, matching, elapsed):
+        self.matching = matching
+        self.score = matching.calculate_score()
+        self.lowest_pair = matching.lowest_pair
+        self.lowest_score = matching.lowest_score
+        self.elapsed = elapsed
+
+    def to_dict(self):
+        result = self.matching.to_dict()
+        result['elapsed'] = self.elapsed
+        return result
+
+class Stopped(Exception):
+    '''Raised internally when the deadline passes or the caller cancels.'''
+    pass
+
+def check_stop(deadline, cancel):
+    if cancel is not None and cancel.is_set():
+        raise Stopped()
+    if deadline is not None and time.monotonic() >= deadline:
+        raise Stopped()
+
+def matching_from_tuples(student_list, tuple_list, ctx):
+    m = Matching(student_list, ctx)
+    for tup in tuple_list:
+        if len(tup) == 2:
+            m.add_pair(tup[0], tup[1])
+        elif len(tup) == 3:
+            m.add_trio(*tup)
+    return m
+
+def local_search_steps(matching, deadline=None, cancel=None):
+    '''Yields each better matching on the way to a local optimum.'''
+    done = False
+    while not done:
+        check_stop(deadline, cancel)
+        matching, done = matching_improve(matching, verbose=False)
+        if not done:
+            yield matching
+
+def hill_climbing_candidates(student_list, ctx, deadline=None, cancel=None):
+    greedy = matching_greedy(student_list, ctx)
+    yield greedy
+    yield from local_search_steps(greedy, deadline, cancel)
+    while True:
+        check_stop(deadline, cancel)
+        start = Matching(student_list, ctx)
+        start.random_pairing()
+        yield start
+        yield from local_search_steps(start, deadline, cancel)
+
+def two_greedy_candidates(student_list, ctx, deadline=None, cancel=None):
+    fixed, free = ctx.split_fixed(student_list)
+    for tuple_list in two_greedy_matchings_recursive(free, ctx):
+        check_stop(deadline, cancel)
+        tuple_list, score = merge_singleton(fixed + tuple_list, ctx)
+        yield matching_from_tuples(student_list, tuple_list, ctx)
+
+def exhaustive_candidates(student_list, ctx, deadline=None, cancel=None):
+    fixed, free = ctx.split_fixed(student_list)
+    for tuple_list in exhaustive_tuple_lists(fixed, free, ctx):
+        check_stop(deadline, cancel)
+        yield matching_from_tuples(student_list, tuple_list, ctx)
+
+anytime_algorithms = {'hill_climbing': hill_climbing_candidates,
+                      'two_greedy': two_greedy_candidates,
+                      'exhaustive': exhaustive_candidates}
+
+def matching_anytime(student_list=None, algorithm='hill_climbing',
+                     deadline=None, cancel=None, ctx=None):
+    '''Generator of Improvements, each better than the last. Stops
+    quietly at the deadline, on cancellation, or when the algorithm
+    runs out of candidates.'''
+    student_list = default_students(student_list, ctx)
+    ctx = context_for(student_list, ctx)
+    start = time.monotonic()
+    candidates = anytime_algorithms[algorithm](student_list, ctx, deadline, cancel)
+    best_score = None
+    try:
+        for m in candidates:
+            check_stop(deadline, cancel)
+            score = m.calculate_score()
+            if best_score is None or score > best_score:
+                best_score = score
+                yield Improvement(m, time.monotonic() - start)
+    except Stopped:
+        return
+    finally:
+        candidates.close()
+
+def test_roster_matchers(n=9):
+    '''Runs each matcher on a band.Roster and on the same students as
+    dictionaries. The deterministic ones must agree, and everyone must
+    be in a pair or trio.'''
+    import band
+    emails, packed = make_test_schedules(n)
+    roster = band.Roster(emails, emails, packed, 'roster_test')
+    studs = [ {'course': 'roster_test', 'student_email': email, 'student_name': email,
+               **dict(zip(day_keys, week))}
+              for email, week in zip(emails, packed) ]
+    algorithms = [matching_greedy, matching_two_greedy, matching_exhaustive,
+                  matching_hill_climbing_random_start]
+    for algorithm in algorithms:
+        m = algorithm(roster)
+        result = m.to_dict()
+        grouped = sum(len(pair) - 1 for pair in result['pairs']) + sum(len(trio) - 1 for trio in result['trios'])
+        assert grouped == n and result['unmatched'] == [], algorithm.__name__
+        if algorithm is not matching_hill_climbing_random_start:
+            assert m.calculate_score() == algorithm(studs).calculate_score(), algorithm.__name__
+    for algorithm in anytime_algorithms:
+        # hill climbing goes on until it's stopped
+        deadline = time.monotonic() + 1
+        assert list(matching_anytime(roster, algorithm, deadline)), algorithm
+    print('all matchers take a Roster')
+
 # ================================================================
 # 
 
@@ -1009,6 +1966,10 @@ def bakeoff(n=16):
     #
     m4 = matching_hill_climbing_random_start()
     print('hill climbing', m4, sep="\n")
+    # exhaustive is out of reach for most n, but the bound isn't
+    import bounds
+    cert = bounds.certify(m4)
+    print(f"upper bound: {cert['upper_bound']}, gap: {cert['gap']:.1%}")
 
 # ================================================================
 
@@ -1023,24 +1984,25 @@ def tt_cs304():
     class_dict = read_students(conn, 'cs304-f24')
     global cs304
     cs304 = list(class_dict.values())
-    for i,s in enumerate(cs304):
-        s['index'] = s
     pair_overlap_table(cs304)
+    ctx = MatchingContext(cs304)
     global cs304s1
     cs304s1 = make_schedule_from_matching_ints(
-        cs304, [(0,12), (1,10), (2,19), (3,9), (4,14), (5,16), (6,8), (7,11), (13,15), (17,18), (20,21), (22,23), (24,25), (26,27)])
+        cs304, [(0,12), (1,10), (2,19), (3,9), (4,14), (5,16), (6,8), (7,11), (13,15), (17,18), (20,21), (22,23), (24,25), (26,27)],
+        ctx)
     # print(schedule_to_str(cs304s1))
     global cs304s2
     cs304s2 = make_schedule_from_matching_ints(
-        cs304, [(0,26), (1,25), (2, 19), (3,27), (4,20), (5,24), (6,21), (7,16), (8,22), (9,23), (10,18), (11,12), (13,15), (14,17)])
-    print(schedule_to_str(cs304s2))
+        cs304, [(0,26), (1,25), (2, 19), (3,27), (4,20), (5,24), (6,21), (7,16), (8,22), (9,23), (10,18), (11,12), (13,15), (14,17)],
+        ctx)
+    print(schedule_to_str(cs304s2, ctx))
             
 
 def main():
     dbi.conf('scottdb')
     conn = dbi.connect()
     global all_students
-    all_students = read_students(conn, 'cs304-f24')
+    all_students = list(read_students(conn, 'cs304-f24').values())
     compute_all_scores(all_students)
 
 if __name__ == '__main__':
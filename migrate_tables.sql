@@ -0,0 +1,50 @@
+-- Adds the tables for stored matchings and slot grids to a database
+-- that already has when_to_pair, leaving that table and its schedules
+-- alone. table_setup.sql, by contrast, drops and recreates everything.
+--
+-- An older when_to_pair_results, keyed by the params JSON rather than
+-- its hash, isn't changed by this. It only holds results that can be
+-- computed again, so drop it first if you have one.
+
+use scottdb;
+
+-- finished matchings, so that the same request for the same schedules
+-- can be answered without running the algorithm again. See jobs.py
+
+create table if not exists when_to_pair_results(
+    course varchar(20),
+    algorithm varchar(20) comment 'like greedy or two_greedy',
+    params_hash char(40) comment 'sha1 of the params JSON',
+    schedule_hash char(40) comment 'sha1 of all the schedules in the course',
+    params text comment 'JSON of the algorithm parameters, with any constraints',
+    score int,
+    result mediumtext comment 'JSON of the matching',
+    created timestamp default current_timestamp,
+    primary key (course, algorithm, params_hash, schedule_hash)
+               );
+
+-- schedules on grids other than the standard 30 half-hours from 9am,
+-- which can have more slots than a SET allows. Each day is the packed
+-- int as bytes, least significant first, so 36 bytes is room for
+-- 288 slots: 5 minutes around the clock. See slot_grid.py
+
+create table if not exists when_to_pair_grids(
+    course varchar(20) primary key,
+    slot_minutes int comment 'like 15 or 30',
+    start_minute int comment 'minutes after midnight the first slot starts',
+    end_minute int comment 'minutes after midnight the last slot ends'
+               );
+
+create table if not exists when_to_pair_grid(
+    course varchar(20) comment 'like cs304-fa24',
+    student_email varchar(8) comment 'ww123',
+    student_name varchar(50) comment 'their preferred name',
+    sun varbinary(36),
+    mon varbinary(36),
+    tue varbinary(36),
+    wed varbinary(36),
+    thu varbinary(36),
+    fri varbinary(36),
+    sat varbinary(36),
+    primary key (course, student_email)
+               );
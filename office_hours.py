@@ -0,0 +1,122 @@
+'''Placing TA office hours where the most students can come.
+
+Given everyone's schedules, choose k sessions, each a block of length
+consecutive slots on some day, to maximize the number of different
+students who are free for the whole of at least one of them. Students
+can also be weighted, say by how much help they're likely to need, in
+which case it's the total weight that's maximized.
+
+That's the maximum coverage problem, which is NP-hard, but the
+candidates are few (7 days times at most 30 starting slots), so:
+
+1. For every candidate block, find who is free for all of it, as an
+   (n, candidates) boolean array, all at once with NumPy. Its weighted
+   column sums are how many each block would cover by itself.
+
+2. Greedy: repeatedly take the block that covers the most weight not
+   yet covered. That's within 1 - 1/e of the best, and usually closer.
+
+3. Refine. For k up to POOL_K, try every combination of the best
+   POOL_SIZE blocks (plus the greedy ones); otherwise, swap blocks in
+   and out of the greedy answer while that improves it. Neither is
+   guaranteed to be optimal: the pool is the blocks that cover the most
+   by themselves, and the best combination can include a block outside
+   it, one that covers few but mostly people the others miss.
+
+best_blocks works on an (n, 7) array of day ints; the app passes the
+one in its slot_index.SlotIndex.
+
+'''
+
+import itertools
+import numpy as np
+
+POOL_K = 3                      # largest k to refine over the whole pool
+POOL_SIZE = 24                  # candidates for that refinement
+
+def candidate_blocks(n_slots, length):
+    '''parallel arrays of the day, first slot and bit mask of every block
+    of length slots'''
+    starts = np.arange(n_slots - length + 1)
+    days = np.repeat(np.arange(7), len(starts))
+    firsts = np.tile(starts, 7)
+    masks = ((1 << length) - 1) << firsts
+    return days, firsts, masks.astype(np.uint32)
+
+def coverage_matrix(avail, days, masks):
+    '''(n, candidates) array: is student i free for all of block c?'''
+    return (avail[:, days] & masks) == masks
+
+def weighted_coverage(covered, weights, chosen):
+    if len(chosen) == 0:
+        return 0
+    return float(weights @ covered[:, list(chosen)].any(axis=1))
+
+def greedy(covered, weights, k):
+    '''indexes of the blocks chosen greedily, in the order chosen'''
+    remaining = weights.copy()
+    chosen = []
+    for _ in range(min(k, covered.shape[1])):
+        gains = remaining @ covered
+        best = int(np.argmax(gains))
+        if gains[best] <= 0:
+            break
+        chosen.append(best)
+        remaining[covered[:, best]] = 0
+    return chosen
+
+def refine_exhaustive(covered, weights, k, chosen):
+    '''the best k-combination of the top POOL_SIZE blocks and the greedy
+    ones'''
+    column_sums = weights @ covered
+    pool = set(np.argsort(-column_sums, kind='stable')[:POOL_SIZE].tolist()) | set(chosen)
+    best = list(chosen)
+    best_value = weighted_coverage(covered, weights, best)
+    for combo in itertools.combinations(sorted(pool), min(k, len(pool))):
+        value = weighted_coverage(covered, weights, combo)
+        if value > best_value:
+            best, best_value = list(combo), value
+    return best
+
+def refine_swaps(covered, weights, chosen):
+    '''swaps a chosen block for an unchosen one while that helps'''
+    chosen = list(chosen)
+    value = weighted_coverage(covered, weights, chosen)
+    improved = True
+    while improved:
+        improved = False
+        for pos in range(len(chosen)):
+            others = chosen[:pos] + chosen[pos+1:]
+            # weight covered by the other blocks doesn't count
+            remaining = weights.copy()
+            if others:
+                remaining[covered[:, others].any(axis=1)] = 0
+            gains = remaining @ covered
+            best = int(np.argmax(gains))
+            new_value = value - float(remaining @ covered[:, chosen[pos]]) + float(gains[best])
+            if new_value > value and best not in chosen:
+                chosen[pos] = best
+                value = new_value
+                improved = True
+    return chosen
+
+def best_blocks(avail, k, length, weights=None, n_slots=30):
+    '''Returns a list of (day, first_slot, students) for the k blocks of
+    length slots, where students is a boolean array of who can come to
+    that block. avail is an (n, 7) array of day ints; weights, if given,
+    is a length n array.'''
+    avail = np.asarray(avail, dtype=np.uint32).reshape(-1, 7)
+    if weights is None:
+        weights = np.ones(len(avail))
+    weights = np.asarray(weights, dtype=float)
+    days, firsts, masks = candidate_blocks(n_slots, length)
+    covered = coverage_matrix(avail, days, masks)
+    chosen = greedy(covered, weights, k)
+    if len(chosen) > 0:
+        if k <= POOL_K:
+            chosen = refine_exhaustive(covered, weights, k, chosen)
+        else:
+            chosen = refine_swaps(covered, weights, chosen)
+    # biggest first
+    chosen.sort(key=lambda c: -float(weights @ covered[:, c]))
+    return [ (int(days[c]), int(firsts[c]), covered[:, c]) for c in chosen ]
@@ -0,0 +1,118 @@
+'''Exporting the table of every pair's overlap, for a spreadsheet or for
+analysis elsewhere.
+
+The table is symmetric, so only the upper triangle (pairs i < j) is
+computed and written. It's computed block rows at a time by band's
+vectorized kernels, and each row is written as soon as it's done, so
+memory stays at one block of rows, however many students there are.
+
+Formats:
+
+csv, tsv: a header row of labels, then one row per student: their
+    label, blanks for j <= i, and then the overlaps with j > i.
+
+binary: MAGIC, then n and the length of the labels as two
+    little-endian uint32, the labels as JSON, and then the triangle as
+    little-endian int32, row by row. That's the condensed order of
+    scipy.spatial.distance.squareform; see read_binary.
+
+The kernel is 'score' (match's overlap score, via band.block_scores) or
+'count' (slots in common, via band.block_counts).
+
+'''
+
+import csv
+import io
+import json
+import struct
+import numpy as np
+import band
+
+MAGIC = b'OVLP'
+BUFFER_SIZE = 1 << 20           # bytes
+
+KERNELS = {'score': band.block_scores,
+           'count': band.block_counts}
+
+FORMATS = ('csv', 'tsv', 'binary')
+
+def free_time_order(avail):
+    '''indexes of the rows of avail, least free time first'''
+    return np.argsort(band.popcount(avail).sum(axis=1), kind='stable')
+
+def triangle_rows(avail, kernel='score', block=256):
+    '''Generator of (i, values), where values is the int32 array of the
+    kernel for i with each of i+1 ... n-1.'''
+    avail = np.asarray(avail, dtype=np.uint32).reshape(-1, 7)
+    kernel = KERNELS[kernel]
+    n = len(avail)
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        # columns from start on; the ones before are in earlier rows
+        scores = kernel(avail[start:stop], avail[start:])
+        for i in range(start, stop):
+            yield i, scores[i - start, i - start + 1:]
+
+def quoted(labels, delimiter):
+    '''labels quoted as the csv module would, as one string each'''
+    buf = io.StringIO()
+    csv.writer(buf, delimiter=delimiter, lineterminator='\n').writerows([ [label] for label in labels ])
+    return buf.getvalue().splitlines()
+
+def write_text(out, avail, labels, kernel='score', delimiter=',', block=256):
+    '''Writes the triangle as CSV (or TSV, with delimiter '\\t') to a
+    text file.'''
+    labels = quoted(labels, delimiter)
+    out.write(delimiter + delimiter.join(labels) + '\n')
+    for i, values in triangle_rows(avail, kernel, block):
+        # the label, blanks for j <= i, then the values
+        line = labels[i] + delimiter * (i + 1)
+        if len(values):
+            line += delimiter + delimiter.join(map(str, values.tolist()))
+        out.write(line + '\n')
+    return len(labels)
+
+def write_binary(out, avail, labels, kernel='score', block=256):
+    '''Writes the triangle in the binary format to a binary file.'''
+    header = json.dumps(list(labels)).encode('utf-8')
+    out.write(MAGIC)
+    out.write(struct.pack('<II', len(labels), len(header)))
+    out.write(header)
+    for i, values in triangle_rows(avail, kernel, block):
+        out.write(values.astype('<i4').tobytes())
+    return len(labels)
+
+def read_binary(fin):
+    '''Reads the binary format from a binary file. Returns the labels
+    and the condensed triangle, as an int32 array.'''
+    if fin.read(len(MAGIC)) != MAGIC:
+        raise ValueError('not an overlap table')
+    n, header_len = struct.unpack('<II', fin.read(8))
+    labels = json.loads(fin.read(header_len).decode('utf-8'))
+    triangle = np.frombuffer(fin.read(4 * (n * (n - 1) // 2)), dtype='<i4')
+    return labels, triangle
+
+def export_overlaps(out, avail, labels=None, fmt='csv', kernel='score',
+                    sort_by_free_time=False, block=256):
+    '''Writes the overlap table of the (n, 7) avail array to out, a
+    filename or an open file (text for csv and tsv, binary for binary).
+    labels default to the row numbers. If sort_by_free_time is true, the
+    students with the least free time come first. Returns n.'''
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown format {fmt}; try one of {",".join(FORMATS)}')
+    avail = np.asarray(avail, dtype=np.uint32).reshape(-1, 7)
+    labels = [ str(i) for i in range(len(avail)) ] if labels is None else list(labels)
+    if sort_by_free_time:
+        order = free_time_order(avail)
+        avail = avail[order]
+        labels = [ labels[i] for i in order.tolist() ]
+    if isinstance(out, str):
+        if fmt == 'binary':
+            fout = open(out, 'wb', buffering=BUFFER_SIZE)
+        else:
+            fout = open(out, 'w', buffering=BUFFER_SIZE, newline='')
+        with fout:
+            return export_overlaps(fout, avail, labels, fmt, kernel, False, block)
+    if fmt == 'binary':
+        return write_binary(out, avail, labels, kernel, block)
+    return write_text(out, avail, labels, kernel, ',' if fmt == 'csv' else '\t', block)
@@ -0,0 +1,551 @@
+'''Matching very large groups, like study buddies across all the courses
+in a department, using a sparse graph of good partners.
+
+For n students, the dense score matrix (match.compute_all_scores, or
+band.Roster.score_matrix) has n^2 cells: 400 million for 20,000
+students, which is too big as a list of lists and uncomfortably big as
+an array. Nobody is going to be paired with their 500th best partner
+anyway, so build_partner_graph streams the schedules block by block and
+keeps only each student's top k partners by overlap score. The result
+is a PartnerGraph, an undirected graph stored CSR-style (compressed
+sparse rows, as in scipy.sparse): the neighbors of i are
+indices[indptr[i]:indptr[i+1]], sorted, with scores in the same
+positions of weights. That's O(n*k) memory.
+
+The matchers here work on that graph and represent a matching by a
+mate array: mate[i] is i's partner, or -1.
+
+sparse_greedy(graph): takes edges best first, whenever both ends are
+    still free; leftovers are paired up arbitrarily.
+
+sparse_local_search(graph, mate): the swaps of match.matching_improve,
+    but only trying partners that are neighbors in the graph.
+
+sparse_exact(graph): the best matching on the graph's edges, found
+    separately in each connected component by dynamic programming over
+    subsets. That's only feasible for components of up to MAX_EXACT
+    students, and a top-k graph of a real cohort is usually one big
+    component, so bigger ones get sparse_greedy and
+    sparse_local_search instead, for at most FALLBACK_SECONDS, and the
+    result says it isn't exact.
+
+Constraints (match.Constraints) are applied to the graph with
+constrain_graph: forbidden pairs are dropped from it, must pairs are
+fixed before any matcher starts, and penalties are subtracted from the
+scores the matchers maximize (graph.objective), though not from the
+scores that are reported.
+
+These maximize the sum of the pair scores. SparseMatching reports the
+usual score (the sum plus the lowest pair again) and has the same
+to_dict as match.Matching. With an odd number of students, it merges
+the one left over into the pair that makes the best trio, as
+match.Matching does; see merge_leftover.
+
+'''
+
+import time
+import numpy as np
+from match import FORBIDDEN, constraint_maps, pair_meetings, grid_meetings
+
+DEFAULT_K = 20
+MAX_EXACT = 20
+FALLBACK_SECONDS = 10          # of local search, for components too big for sparse_exact
+
+class PartnerGraph:
+    def __init__(self, source, indptr, indices, weights, emails=None, names=None,
+                 penalty=None, partner=None):
+        '''source is a band.Roster or slot_grid.GridBitset, used to score
+        pairs that aren't in the graph. penalty maps (i, j), both ways
+        round, to the amount subtracted from their score (FORBIDDEN for
+        a must-not pair), and partner maps each student in a must pair
+        to the other; see constrain_graph.'''
+        self.source = source
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.emails = emails if emails is not None else getattr(source, 'emails', None)
+        self.names = names if names is not None else getattr(source, 'names', None)
+        self.penalty = penalty or {}
+        self.partner = partner or {}
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def edge_count(self):
+        return len(self.indices) // 2
+
+    def neighbors(self, i):
+        '''arrays of i's neighbors and their objectives, best first'''
+        lo, hi = self.indptr[i], self.indptr[i+1]
+        nbrs = self.indices[lo:hi]
+        values = self.weights[lo:hi]
+        if self.penalty:
+            values = values - np.array([ self.penalty.get((i, j), 0) for j in nbrs.tolist() ],
+                                       dtype=values.dtype)
+        order = np.argsort(-values, kind='stable')
+        return nbrs[order], values[order]
+
+    def sorted_neighbors(self):
+        '''Everyone's neighbors at once, as neighbors gives them: arrays
+        like indices and weights, but with each row ordered best first
+        by objective.'''
+        rows, cols, values = self.objective_edges(both_ways=True)
+        order = np.lexsort((-values, rows))
+        return cols[order], values[order]
+
+    def trio_score(self, i, j, k):
+        return self.source.trio_score(i, j, k)
+
+    def objective(self, i, j):
+        '''The score, less any penalty; what the matchers maximize.'''
+        return self.score(i, j) - self.penalty.get((i, j), 0)
+
+    def trio_objective(self, i, j, k):
+        return (self.trio_score(i, j, k) - self.penalty.get((i, j), 0) -
+                self.penalty.get((i, k), 0) - self.penalty.get((j, k), 0))
+
+    def forbidden(self, i, j):
+        return self.penalty.get((i, j), 0) >= FORBIDDEN
+
+    def objectives(self, i, others):
+        '''The objectives of i with each of others (an array) at once.'''
+        others = np.asarray(others, dtype=np.int64)
+        lo, hi = self.indptr[i], self.indptr[i+1]
+        row = self.indices[lo:hi]
+        result = np.zeros(len(others), dtype=np.int64)
+        found = np.zeros(len(others), dtype=bool)
+        if hi > lo:
+            pos = np.minimum(np.searchsorted(row, others), hi - lo - 1)
+            found = row[pos] == others
+            result[found] = self.weights[lo:hi][pos[found]]
+        missing = ~found & (others != i)
+        if missing.any():
+            result[missing] = self.source.pair_scores(i, others[missing])
+        if self.penalty:
+            result -= np.array([ self.penalty.get((i, j), 0) for j in others.tolist() ],
+                               dtype=np.int64)
+        return result
+
+    def score(self, i, j):
+        '''The overlap score of i and j, from the graph if it's an edge,
+        and otherwise computed from their schedules.'''
+        if i == j:
+            return 0
+        lo, hi = self.indptr[i], self.indptr[i+1]
+        pos = lo + np.searchsorted(self.indices[lo:hi], j)
+        if pos < hi and self.indices[pos] == j:
+            return int(self.weights[pos])
+        return self.source.pair_score(i, j)
+
+    def edges(self):
+        '''arrays i, j, score of each edge once, with i < j'''
+        rows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        upper = rows < self.indices
+        return rows[upper], self.indices[upper], self.weights[upper]
+
+    def objective_edges(self, both_ways=False):
+        '''edges, with objectives instead of scores; with both_ways,
+        each edge is there as (i, j) and as (j, i)'''
+        if both_ways:
+            rows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+            cols, weights = self.indices, self.weights
+        else:
+            rows, cols, weights = self.edges()
+        if self.penalty:
+            weights = weights - np.array([ self.penalty.get((i, j), 0)
+                                           for i, j in zip(rows.tolist(), cols.tolist()) ],
+                                         dtype=weights.dtype)
+        return rows, cols, weights
+
+def constrain_graph(graph, constraints):
+    '''Returns a copy of the graph with the constraints, a
+    match.Constraints, applied: the edges of forbidden pairs are
+    dropped, and must pairs and penalties are recorded for the
+    matchers. Emails not in the graph are ignored.'''
+    index = { email: i for i,email in enumerate(graph.emails) }
+    penalty, partner = constraint_maps(constraints, index)
+    keep = np.ones(len(graph.indices), dtype=bool)
+    for (i, j), amount in penalty.items():
+        if amount >= FORBIDDEN:
+            lo, hi = graph.indptr[i], graph.indptr[i+1]
+            pos = lo + np.searchsorted(graph.indices[lo:hi], j)
+            if pos < hi and graph.indices[pos] == j:
+                keep[pos] = False
+    rows = np.repeat(np.arange(len(graph)), np.diff(graph.indptr))
+    indptr = np.zeros(len(graph) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[keep], minlength=len(graph)), out=indptr[1:])
+    return PartnerGraph(graph.source, indptr, graph.indices[keep], graph.weights[keep],
+                        graph.emails, graph.names, penalty, partner)
+
+def build_partner_graph(source, k=DEFAULT_K, block=256, min_score=1):
+    '''source is a band.Roster or slot_grid.GridBitset (anything with
+    __len__, block_scores and pair_score). Keeps an edge between i and j
+    if j is one of i's k best partners or vice versa, and their score is
+    at least min_score. Only block rows of scores exist at once.'''
+    n = len(source)
+    k = min(k, n - 1)
+    rows, cols, weights = [], [], []
+    if k > 0:
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            scores = source.block_scores(start, stop)
+            local = np.arange(stop - start)
+            scores[local, start + local] = -1     # not your own partner
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            keep = best_scores >= min_score
+            rows.append(np.broadcast_to((start + local)[:, None], best.shape)[keep])
+            cols.append(best[keep])
+            weights.append(best_scores[keep])
+    if rows:
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        weights = np.concatenate(weights)
+    else:
+        rows = cols = weights = np.zeros(0, dtype=np.int64)
+    # make it symmetric, and sort by row and then column, without duplicates
+    all_rows = np.concatenate([rows, cols]).astype(np.int64)
+    all_cols = np.concatenate([cols, rows]).astype(np.int64)
+    all_weights = np.concatenate([weights, weights])
+    keys, first = np.unique(all_rows * n + all_cols, return_index=True)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // n, minlength=n), out=indptr[1:])
+    return PartnerGraph(source, indptr,
+                        (keys % n).astype(np.int32),
+                        all_weights[first].astype(np.int32))
+
+# ================================================================
+# Matchers
+
+def fixed_mates(graph):
+    '''A mate array with just the must pairs.'''
+    mate = np.full(len(graph), -1, dtype=np.int64)
+    for i, j in graph.partner.items():
+        mate[i] = j
+    return mate
+
+def sparse_greedy(graph, mate=None, students=None):
+    '''Returns a mate array. Given mate, it fills that in, and given
+    students (an array), only edges between them are taken.'''
+    if mate is None:
+        mate = fixed_mates(graph)
+    rows, cols, weights = graph.objective_edges()
+    if students is not None:
+        inside = np.zeros(len(graph), dtype=bool)
+        inside[students] = True
+        keep = inside[rows] & inside[cols]
+        rows, cols, weights = rows[keep], cols[keep], weights[keep]
+    for e in np.argsort(-weights, kind='stable'):
+        i, j = rows[e], cols[e]
+        if mate[i] < 0 and mate[j] < 0:
+            mate[i] = j
+            mate[j] = i
+    pair_leftovers(mate, graph)
+    return mate
+
+def pair_leftovers(mate, graph=None):
+    '''Pairs the unmatched students with each other, in order, skipping
+    forbidden pairs if the graph is given. With an odd number, one is
+    left (or more, if only forbidden pairs remain).'''
+    free = np.flatnonzero(mate < 0).tolist()
+    while len(free) > 1:
+        a = free.pop(0)
+        for k, b in enumerate(free):
+            if graph is None or not graph.forbidden(a, b):
+                mate[a] = b
+                mate[b] = a
+                del free[k]
+                break
+
+def sparse_local_search(graph, mate, max_rounds=100, students=None, deadline=None):
+    '''Improves the matching in place, and returns it. For each pair
+    (a,b) and each neighbor c of a, with partner d, tries (a,c),(b,d)
+    instead of (a,b),(c,d). If a is unmatched, tries taking c from d.
+    Repeats until a round makes no improvement, or max_rounds, or the
+    deadline (a time.monotonic time) passes. Must pairs stay put.
+    students limits the a's tried, by default to everyone.
+
+    The neighbors are sorted once, everyone's current pair objective is
+    remembered, and b's objectives with all the d's are computed at
+    once, since looking up or computing them one pair at a time was
+    most of the work.'''
+    fixed = graph.partner
+    if students is None:
+        students = range(len(graph))
+    students = [ a for a in students if a not in fixed ]
+    indptr = graph.indptr.tolist()
+    nbrs, values = graph.sorted_neighbors()
+    nbrs = nbrs.tolist()
+    values = values.tolist()
+    # mine[i] is the objective of i's pair, or None if i is alone
+    mine = [ None if j < 0 else graph.objective(i, j) for i, j in enumerate(mate.tolist()) ]
+    for _ in range(max_rounds):
+        improved = False
+        for a in students:
+            b = int(mate[a])
+            lo, hi = indptr[a], indptr[a+1]
+            # only neighbors better than a's partner can help
+            cs = nbrs[lo:hi]
+            stop = cs.index(b) if b in cs else hi - lo
+            if stop == 0:
+                continue
+            cs = cs[:stop]
+            ds = mate[cs].tolist()
+            if b >= 0:
+                bd = graph.objectives(b, [ max(d, 0) for d in ds ]).tolist()
+            for k, c in enumerate(cs):
+                if c in fixed:
+                    continue
+                ac = values[lo + k]
+                d = ds[k]
+                if b < 0:
+                    if d < 0 or ac > mine[c]:
+                        mate[a], mate[c] = c, a
+                        mine[a] = mine[c] = ac
+                        if d >= 0:
+                            mate[d] = -1
+                            mine[d] = None
+                        improved = True
+                        break
+                    continue
+                if d < 0:
+                    # c is alone; a leaves b for c if that's better
+                    if ac > mine[a]:
+                        mate[a], mate[c], mate[b] = c, a, -1
+                        mine[a] = mine[c] = ac
+                        mine[b] = None
+                        improved = True
+                        break
+                    continue
+                if ac + bd[k] > mine[a] + mine[c] and not graph.forbidden(b, d):
+                    mate[a], mate[c] = c, a
+                    mate[b], mate[d] = d, b
+                    mine[a] = mine[c] = ac
+                    mine[b] = mine[d] = bd[k]
+                    improved = True
+                    break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        if not improved or (deadline is not None and time.monotonic() >= deadline):
+            break
+    pair_leftovers(mate, graph)
+    return mate
+
+def components(graph):
+    '''list of arrays of the students in each connected component'''
+    n = len(graph)
+    label = np.full(n, -1, dtype=np.int64)
+    result = []
+    for root in range(n):
+        if label[root] >= 0:
+            continue
+        label[root] = len(result)
+        members = [root]
+        stack = [root]
+        while stack:
+            v = stack.pop()
+            for w in graph.indices[graph.indptr[v]:graph.indptr[v+1]].tolist():
+                if label[w] < 0:
+                    label[w] = len(result)
+                    members.append(w)
+                    stack.append(w)
+        result.append(np.array(sorted(members)))
+    return result
+
+def sparse_exact(graph, max_size=MAX_EXACT, fallback=True, seconds=FALLBACK_SECONDS):
+    '''The maximum-weight matching on the graph's edges, computed by
+    dynamic programming over the subsets of each connected component.
+    A component of more than max_size students gets greedy and local
+    search instead, the local search stopping after seconds (None for
+    no limit), or, if fallback is false, raises ValueError. Must
+    pairs are fixed, and students left over are paired up arbitrarily.
+    Returns the mate array and whether it's exact.'''
+    mate = fixed_mates(graph)
+    too_big = []
+    for members in components(graph):
+        members = [ v for v in members.tolist() if v not in graph.partner ]
+        if len(members) > max_size:
+            if not fallback:
+                raise ValueError(f'component of {len(members)} students is too big for sparse_exact')
+            too_big.extend(members)
+        elif len(members) > 1:
+            exact_component(graph, members, mate)
+    if too_big:
+        sparse_greedy(graph, mate, np.array(too_big))
+        deadline = None if seconds is None else time.monotonic() + seconds
+        sparse_local_search(graph, mate, students=too_big, deadline=deadline)
+    pair_leftovers(mate, graph)
+    return mate, not too_big
+
+def exact_component(graph, members, mate):
+    local = { v: i for i,v in enumerate(members) }
+    m = len(members)
+    adj = [ [ (local[w], int(s) - graph.penalty.get((v, w), 0))
+              for w, s in zip(graph.indices[graph.indptr[v]:graph.indptr[v+1]].tolist(),
+                              graph.weights[graph.indptr[v]:graph.indptr[v+1]].tolist())
+              if w in local ]
+            for v in members ]
+    # best[mask] is the best total for the students in mask, choice[mask]
+    # is the partner of its lowest member (-1 to leave them out)
+    full = (1 << m) - 1
+    best = [0] * (1 << m)
+    choice = [-1] * (1 << m)
+    for mask in range(1, full + 1):
+        i = (mask & -mask).bit_length() - 1
+        rest = mask & ~(1 << i)
+        best[mask] = best[rest]
+        choice[mask] = -1
+        for j, s in adj[i]:
+            if rest >> j & 1:
+                total = s + best[rest & ~(1 << j)]
+                if total > best[mask]:
+                    best[mask] = total
+                    choice[mask] = j
+    mask = full
+    while mask:
+        i = (mask & -mask).bit_length() - 1
+        j = choice[mask]
+        mask &= ~(1 << i)
+        if j >= 0:
+            mask &= ~(1 << j)
+            mate[members[i]] = members[j]
+            mate[members[j]] = members[i]
+
+def merge_leftover(graph, mate):
+    '''If exactly one student is unmatched, returns the trio (as a
+    sorted tuple) they make with the pair they should join: the one
+    that makes the sum of the scores plus the lowest score highest, as
+    in match.best_merge, with penalties. Otherwise returns None.'''
+    free = np.flatnonzero(mate < 0)
+    if len(free) != 1:
+        return None
+    solo = int(free[0])
+    pairs = [ (i, int(j)) for i, j in enumerate(mate) if i < j ]
+    if not pairs:
+        return None
+    pair_scores = [ graph.objective(i, j) for i, j in pairs ]
+    total = sum(pair_scores)
+    # without pair k, the lowest pair is the lowest of these two that isn't k
+    two_lowest = sorted(range(len(pairs)), key=pair_scores.__getitem__)[:2]
+    best = None
+    best_score = None
+    for k, (i, j) in enumerate(pairs):
+        if graph.forbidden(solo, i) or graph.forbidden(solo, j):
+            continue
+        trio = graph.trio_objective(solo, i, j)
+        lowest = trio
+        for m in two_lowest:
+            if m != k:
+                lowest = min(lowest, pair_scores[m])
+                break
+        score = total - pair_scores[k] + trio + lowest
+        if best_score is None or score > best_score:
+            best = tuple(sorted((solo, i, j)))
+            best_score = score
+    return best
+
+# ================================================================
+
+class SparseMatching:
+    '''A mate array with its graph, for reporting. If trio is omitted
+    and one student is unmatched, they're merged into a trio; see
+    merge_leftover. As with match.Matching, the score is the objective,
+    with penalties, but the pair, trio and lowest scores shown are
+    overlaps.'''
+    def __init__(self, graph, mate, trio=None):
+        self.graph = graph
+        self.mate = mate
+        self.trio = trio if trio is not None else merge_leftover(graph, mate)
+        self.lowest_pair = None
+        self.lowest_score = None
+        self.lowest_overlap = None
+        self.score = 0
+
+    def pairs(self):
+        in_trio = self.trio or ()
+        return [ (i, int(j)) for i, j in enumerate(self.mate)
+                 if i < j and i not in in_trio ]
+
+    def unmatched(self):
+        in_trio = self.trio or ()
+        return [ i for i in np.flatnonzero(self.mate < 0).tolist() if i not in in_trio ]
+
+    def calculate_score(self):
+        '''The sum of the pair (and trio) scores, plus the lowest one
+        again.'''
+        total = 0
+        lowest = None
+        groups = [ (pair, self.graph.objective(*pair)) for pair in self.pairs() ]
+        if self.trio is not None:
+            groups.append((self.trio, self.graph.trio_objective(*self.trio)))
+        for group, s in groups:
+            total += s
+            if lowest is None or s < lowest:
+                lowest = s
+                self.lowest_pair = group
+        self.lowest_score = lowest if lowest is not None else 0
+        self.lowest_overlap = 0 if lowest is None else self.overlap(self.lowest_pair)
+        self.score = total + self.lowest_score
+        return self.score
+
+    def overlap(self, group):
+        '''score of a pair or trio without penalties'''
+        if len(group) == 3:
+            return self.graph.trio_score(*group)
+        return self.graph.score(*group)
+
+    def meetings(self, groups):
+        '''The top times each of the groups (pairs or trios of indexes)
+        can meet, as match.pair_meetings formats them.'''
+        source = self.graph.source
+        if hasattr(source, 'grid'):
+            # a GridBitset, whose days may be too wide for band
+            codec = source.grid.codec
+            result = []
+            for group in groups:
+                others = source.week(group[1])
+                for k in group[2:]:
+                    others = [ a & b for a,b in zip(others, source.week(k)) ]
+                result.append(grid_meetings(codec, source.week(group[0]), others))
+            return result
+        return pair_meetings([ tuple(source[i] for i in group) for group in groups ])
+
+    def __str__(self):
+        total = self.calculate_score()
+        names = self.graph.names
+        result = ''
+        pairs = self.pairs()
+        for (i, j), times in zip(pairs, self.meetings(pairs)):
+            mark = ' **' if (i, j) == self.lowest_pair else ''
+            result += f'{names[i]} with {names[j]} ({self.graph.score(i, j)}){mark}\n'
+            if times:
+                result += '    meet: ' + ', '.join(times) + '\n'
+        if self.trio is not None:
+            i, j, k = self.trio
+            mark = ' **' if self.trio == self.lowest_pair else ''
+            result += (f'{names[i]} with {names[j]} and {names[k]} '
+                       f'({self.graph.trio_score(i, j, k)}){mark}\n')
+            times = self.meetings([self.trio])[0]
+            if times:
+                result += '    meet: ' + ', '.join(times) + '\n'
+        for i in self.unmatched():
+            result += 'unmatched:  ' + names[i] + '\n'
+        result += f'score: {total}\n'
+        result += f'lowest: {self.lowest_overlap}\n'
+        return result
+
+    def to_dict(self):
+        '''For JSON, like match.Matching.to_dict, meetings and all.'''
+        total = self.calculate_score()
+        emails = self.graph.emails
+        pairs = self.pairs()
+        trios = [self.trio] if self.trio is not None else []
+        return {'pairs': [ [emails[i], emails[j], self.graph.score(i, j)]
+                           for i, j in pairs ],
+                'meetings': self.meetings(pairs),
+                'trios': [ [ emails[i] for i in trio ] + [self.graph.trio_score(*trio)]
+                           for trio in trios ],
+                'trio_meetings': self.meetings(trios),
+                'unmatched': [ emails[i] for i in self.unmatched() ],
+                'score': total,
+                'lowest_score': self.lowest_overlap}
@@ -0,0 +1,105 @@
+'''Converting between a day's packed int and its time slots.
+
+A day schedule is an int with one bit per slot, bit 0 being the first
+slot (9:00). Decoding it bit by bit, in Python, for every student and
+every day, is slow enough to notice on a big roster. So a SlotCodec
+precomputes, for each byte of the int and each of the 256 values that
+byte can have, the tuple of slot labels it stands for. Decoding is then
+one table lookup per byte: four for a 30-slot day.
+
+It also produces compact ranges, like '10:00–13:30' (the end is when
+the last slot ends), by jumping from run to run of 1 bits rather than
+looking at every slot, and parses them back.
+
+The module-level functions use the standard 30 half-hour slots from
+9am to midnight.
+
+'''
+
+import re
+
+DASH = '–'                 # en dash, as in 10:00–13:30
+
+def label_minutes(label):
+    '''minutes after midnight for a slot label like 930 or 1400'''
+    val = int(label)
+    return (val // 100) * 60 + val % 100
+
+def format_minutes(minutes):
+    return f'{minutes // 60}:{minutes % 60:02d}'
+
+class SlotCodec:
+    def __init__(self, labels, slot_minutes=30):
+        self.labels = list(labels)
+        self.slot_minutes = slot_minutes
+        self.bit = { label: i for i,label in enumerate(self.labels) }
+        self.starts = [ label_minutes(label) for label in self.labels ]
+        self.start_bit = { minutes: i for i,minutes in enumerate(self.starts) }
+        # the start and end of each slot, already formatted for ranges
+        self.start_strs = [ format_minutes(minutes) + DASH for minutes in self.starts ]
+        self.end_strs = [ format_minutes(minutes + slot_minutes) for minutes in self.starts ]
+        nbytes = (len(self.labels) + 7) // 8
+        self.tables = [ [ tuple(self.labels[8*k + b]
+                                for b in range(8)
+                                if val & (1 << b) and 8*k + b < len(self.labels))
+                          for val in range(256) ]
+                        for k in range(nbytes) ]
+
+    def decode(self, day_int):
+        '''list of slot labels in the day'''
+        slots = []
+        for table in self.tables:
+            if day_int == 0:
+                break
+            slots.extend(table[day_int & 0xFF])
+            day_int >>= 8
+        return slots
+
+    def encode(self, labels):
+        '''the day int for a collection of slot labels'''
+        val = 0
+        for label in labels:
+            val |= 1 << self.bit[str(label)]
+        return val
+
+    def runs(self, day_int):
+        '''Yields (first_bit, length) for each run of 1 bits.'''
+        while day_int:
+            low = day_int & -day_int
+            first = low.bit_length() - 1
+            shifted = day_int >> first
+            # number of trailing 1 bits
+            length = (shifted ^ (shifted + 1)).bit_length() - 1
+            yield first, length
+            day_int &= ~(((1 << length) - 1) << first)
+
+    def ranges(self, day_int):
+        '''list of strings like 10:00–13:30, one per run of slots'''
+        start_strs = self.start_strs
+        end_strs = self.end_strs
+        return [ start_strs[first] + end_strs[first + length - 1]
+                 for first, length in self.runs(day_int) ]
+
+    def parse_ranges(self, ranges):
+        '''Inverse of ranges: the day int for a list of range strings, or
+        one string of them separated by commas.'''
+        if isinstance(ranges, str):
+            ranges = [ r for r in ranges.split(',') if r.strip() ]
+        val = 0
+        for r in ranges:
+            start, end = re.split('[-' + DASH + ']', r.strip())
+            start = label_minutes(start.replace(':', ''))
+            end = label_minutes(end.replace(':', ''))
+            first = self.start_bit[start]
+            length = (end - start) // self.slot_minutes
+            val |= ((1 << length) - 1) << first
+        return val
+
+all_slots = "900,930,1000,1030,1100,1130,1200,1230,1300,1330,1400,1430,1500,1530,1600,1630,1700,1730,1800,1830,1900,1930,2000,2030,2100,2130,2200,2230,2300,2330".split(',')
+
+codec = SlotCodec(all_slots)
+
+decode = codec.decode
+encode = codec.encode
+ranges = codec.ranges
+parse_ranges = codec.parse_ranges
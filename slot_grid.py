@@ -0,0 +1,348 @@
+'''Time slot grids other than 30 minutes from 9am to midnight.
+
+The original design, in time_sets.py and table_setup.sql, fixes the
+grid at 30 half-hour slots, so that a day fits in a 32-bit int and in a
+MySQL SET (which can have at most 64 members). Some courses want
+15-minute slots, or labs that start at 7am, and those days have more
+than 32 (or 64) slots. A SlotGrid describes the slots: their length
+and the times the day starts and ends.
+
+A day's schedule is still an int with one bit per slot, bit 0 being the
+first slot, but it may be wider than 32 bits; Python doesn't mind.
+For vectorized work, GridBitset stores n schedules as an (n, 7, W)
+NumPy array of uint64, where W is the number of 64-bit words a day
+needs, and its kernels (AND, popcount, counting runs) work across word
+boundaries. With the standard grid, W is 1 and the scores are the same
+as band.Roster's.
+
+In the database, grid schedules go in the when_to_pair_grid table (see
+table_setup.sql), one VARBINARY(DAY_BYTES) per day holding the int's
+bytes, least significant first, and each course's grid goes in
+when_to_pair_grids. That's room for MAX_SLOTS slots a day: 5-minute
+slots around the clock. A course with a grid is read from and saved to
+those tables by match.read_students and the app's /save/, and the app
+serves its slot labels from /course/<id>/grid, for drawing it. The
+app's other course pages read them too, except that /free and
+/office-hours, which use 32-bit SlotIndex days, turn away grids with
+more slots than that.
+
+'''
+
+import time
+from functools import lru_cache
+import numpy as np
+from slot_codec import SlotCodec, label_minutes, format_minutes
+
+DAY_BYTES = 36                  # width of the VARBINARY day columns
+MAX_SLOTS = 8 * DAY_BYTES       # 288, 5-minute slots for 24 hours
+GRID_CACHE_AGE = 60             # seconds to remember a course's grid
+
+class SlotGrid:
+    def __init__(self, slot_minutes=30, start='9:00', end='24:00'):
+        '''start and end are times, like '7:30', or minutes after
+        midnight; end is when the last slot ends.'''
+        self.slot_minutes = slot_minutes
+        self.start_minute = to_minutes(start)
+        self.end_minute = to_minutes(end)
+        span = self.end_minute - self.start_minute
+        if span <= 0 or span % slot_minutes != 0:
+            raise ValueError(f'{start} to {end} is not a whole number of {slot_minutes}-minute slots')
+        self.n_slots = span // slot_minutes
+        if self.n_slots > MAX_SLOTS:
+            raise ValueError(f'{self.n_slots} slots a day is more than the {MAX_SLOTS} '
+                             f'the database has room for')
+        self.words = (self.n_slots + 63) // 64
+        self.labels = [ minutes_label(self.start_minute + i * slot_minutes)
+                        for i in range(self.n_slots) ]
+        self.codec = SlotCodec(self.labels, slot_minutes)
+        self.full_day = (1 << self.n_slots) - 1
+
+    def __eq__(self, other):
+        return (isinstance(other, SlotGrid) and
+                self.spec() == other.spec())
+
+    def __hash__(self):
+        return hash(self.spec())
+
+    def __repr__(self):
+        return (f'SlotGrid({self.slot_minutes}, {format_minutes(self.start_minute)!r}, '
+                f'{format_minutes(self.end_minute)!r})')
+
+    def spec(self):
+        '''(slot_minutes, start_minute, end_minute), as stored in when_to_pair_grids'''
+        return (self.slot_minutes, self.start_minute, self.end_minute)
+
+    @classmethod
+    def from_spec(cls, slot_minutes, start_minute, end_minute):
+        return cls(slot_minutes, start_minute, end_minute)
+
+    def slot_start(self, i):
+        '''minutes after midnight that slot i starts'''
+        return self.start_minute + i * self.slot_minutes
+
+    def convert(self, day_int, target):
+        '''Converts a day schedule on this grid to the target grid. A
+        target slot is available if it lies entirely within available
+        time on this grid.'''
+        result = 0
+        for first, length in self.codec.runs(day_int):
+            free_start = self.slot_start(first)
+            free_end = self.slot_start(first + length)
+            for t in range(target.n_slots):
+                t_start = target.slot_start(t)
+                if free_start <= t_start and t_start + target.slot_minutes <= free_end:
+                    result |= 1 << t
+        return result
+
+    # storage
+
+    def day_bytes(self, day_int):
+        '''The day int as bytes, least significant first, for VARBINARY.'''
+        return int(day_int).to_bytes((self.n_slots + 7) // 8, 'little')
+
+    def day_from_bytes(self, data):
+        return int.from_bytes(data or b'', 'little')
+
+    # to and from the 64-bit words that GridBitset uses
+
+    def to_words(self, day_int):
+        return [ (day_int >> (64 * w)) & 0xFFFFFFFFFFFFFFFF for w in range(self.words) ]
+
+    def from_words(self, words):
+        val = 0
+        for w, word in enumerate(words):
+            val |= int(word) << (64 * w)
+        return val
+
+def to_minutes(time):
+    '''Strings are clock times, like '7:30' or '730'; ints are already
+    minutes after midnight.'''
+    if isinstance(time, int):
+        return time
+    return label_minutes(str(time).replace(':', ''))
+
+def minutes_label(minutes):
+    '''like the labels in all_slots: 900, 915, 1330'''
+    return str((minutes // 60) * 100 + minutes % 60)
+
+STANDARD = SlotGrid()
+
+@lru_cache(maxsize=None)
+def cached_grid(spec):
+    '''The SlotGrid for a spec tuple, made once.'''
+    return SlotGrid.from_spec(*spec)
+
+# ================================================================
+# Multi-word kernels
+
+_byte_popcount = np.array([ bin(i).count('1') for i in range(256) ], dtype=np.uint8)
+
+def popcount64(arr):
+    '''Number of 1 bits in each element of a uint64 array.'''
+    arr = np.ascontiguousarray(arr, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(arr)
+    return _byte_popcount[arr.view(np.uint8)].reshape(arr.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+def run_starts64(arr):
+    '''Keeps the first bit of each run of 1 bits, where the last axis is
+    the words of one day, least significant first, so a run may cross
+    from one word into the next.'''
+    arr = np.asarray(arr, dtype=np.uint64)
+    carry = np.zeros_like(arr)
+    carry[..., 1:] = arr[..., :-1] >> np.uint64(63)
+    return arr & ~((arr << np.uint64(1)) | carry)
+
+class GridBitset:
+    '''n weekly schedules on a SlotGrid, as an (n, 7, W) uint64 array.'''
+
+    def __init__(self, grid, words):
+        self.grid = grid
+        self.words = np.asarray(words, dtype=np.uint64).reshape(-1, 7, grid.words)
+
+    @classmethod
+    def from_day_ints(cls, grid, weeks):
+        '''weeks is a sequence of lists of 7 day ints.'''
+        return cls(grid, [ [ grid.to_words(day) for day in week ] for week in weeks ])
+
+    def __len__(self):
+        return len(self.words)
+
+    def day_int(self, i, day):
+        return self.grid.from_words(self.words[i, day])
+
+    def week(self, i):
+        return [ self.day_int(i, day) for day in range(7) ]
+
+    def free_time(self):
+        '''array of the number of available slots for each person'''
+        return popcount64(self.words).sum(axis=(1, 2), dtype=np.int32)
+
+    def run_counts(self):
+        '''(n, 7) array of the number of separate free periods each day'''
+        return popcount64(run_starts64(self.words)).sum(axis=2, dtype=np.int32)
+
+    def overlap_counts(self, block=128):
+        '''n x n array of the number of common slots for each pair'''
+        n = len(self)
+        counts = np.zeros((n, n), dtype=np.int32)
+        for start in range(0, n, block):
+            both = self.words[start:start+block, None] & self.words[None]
+            counts[start:start+block] = popcount64(both).sum(axis=(2, 3), dtype=np.int32)
+        return counts
+
+    def block_scores(self, start, stop):
+        '''Rows start to stop of the score matrix, including the
+        (nonzero) scores of those people with themselves.'''
+        both = self.words[start:stop, None] & self.words[None]
+        return (popcount64(both).sum(axis=(2, 3), dtype=np.int32) -
+                popcount64(run_starts64(both)).sum(axis=(2, 3), dtype=np.int32))
+
+    def pair_score(self, i, j):
+        both = self.words[i] & self.words[j]
+        return int(popcount64(both).sum()) - int(popcount64(run_starts64(both)).sum())
+
+    def pair_scores(self, i, others):
+        '''array of the scores of i with each of others (an index array)'''
+        both = self.words[i][None] & self.words[others]
+        return (popcount64(both).sum(axis=(1, 2), dtype=np.int32) -
+                popcount64(run_starts64(both)).sum(axis=(1, 2), dtype=np.int32))
+
+    def trio_score(self, i, j, k):
+        all3 = self.words[i] & self.words[j] & self.words[k]
+        return int(popcount64(all3).sum()) - int(popcount64(run_starts64(all3)).sum())
+
+    def score_matrix(self, block=128):
+        '''n x n array of overlap scores, as in match.day_score: common
+        slots minus the number of common sessions, summed over the week.
+        The diagonal is zero.'''
+        n = len(self)
+        scores = np.zeros((n, n), dtype=np.int32)
+        for start in range(0, n, block):
+            scores[start:start+block] = self.block_scores(start, start+block)
+        np.fill_diagonal(scores, 0)
+        return scores
+
+# ================================================================
+# Database storage
+
+# course => (time, grid or None), since every save asks
+_grid_cache = {}
+
+def save_grid(conn, course, grid):
+    from db_adapter import dbi
+    curs = dbi.cursor(conn)
+    curs.execute('''insert into when_to_pair_grids values(%s, %s, %s, %s)
+                    on duplicate key update
+                    slot_minutes = values(slot_minutes),
+                    start_minute = values(start_minute),
+                    end_minute = values(end_minute)''',
+                 [course] + list(grid.spec()))
+    conn.commit()
+    _grid_cache.pop(course, None)
+
+def course_grid(conn, course):
+    '''The course's grid, or None if it uses the standard when_to_pair
+    table. Remembered for GRID_CACHE_AGE seconds. conn can also be a
+    function returning a connection, like the app's get_conn, which is
+    only called if the grid isn't remembered, so that a save that's
+    going to be written behind needn't take a connection just to ask.'''
+    entry = _grid_cache.get(course)
+    if entry is not None and time.monotonic() - entry[0] < GRID_CACHE_AGE:
+        return entry[1]
+    if callable(conn):
+        conn = conn()
+    from db_adapter import dbi
+    curs = dbi.cursor(conn)
+    curs.execute('''select slot_minutes, start_minute, end_minute
+                    from when_to_pair_grids where course = %s''',
+                 [course])
+    row = curs.fetchone()
+    grid = None if row is None else SlotGrid.from_spec(*row)
+    _grid_cache[course] = (time.monotonic(), grid)
+    return grid
+
+def grid_courses(conn):
+    '''courses that have a grid'''
+    from db_adapter import dbi
+    curs = dbi.cursor(conn)
+    curs.execute('select course from when_to_pair_grids')
+    return [ row[0] for row in curs.fetchall() ]
+
+def read_grid(conn, course):
+    '''The course's grid, or the standard one if it hasn't got one.'''
+    grid = course_grid(conn, course)
+    return STANDARD if grid is None else grid
+
+def save_grid_schedules(conn, course, grid, emails, names, weeks, batch_size=500):
+    '''Upserts schedules (lists of 7 day ints on the grid), batch_size
+    rows per statement, in one transaction.'''
+    from db_adapter import dbi
+    from batching import chunked, placeholders
+    rows = ( [course, email, name] + [ grid.day_bytes(day) for day in week ]
+             for email, name, week in zip(emails, names, weeks) )
+    curs = dbi.cursor(conn)
+    try:
+        for chunk in chunked(rows, batch_size):
+            values = ','.join([ placeholders(10) ] * len(chunk))
+            params = [ val for row in chunk for val in row ]
+            curs.execute(f'''insert into when_to_pair_grid values {values}
+                             on duplicate key update
+                             sun=values(sun), mon=values(mon), tue=values(tue), wed=values(wed),
+                             thu=values(thu), fri=values(fri), sat=values(sat)''',
+                         params)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def update_grid_schedule(conn, course, grid, email, week):
+    '''Saves one student's schedule (7 day ints on the grid), like the
+    app's /save/ does for when_to_pair. Returns the number of rows
+    updated.'''
+    from db_adapter import dbi
+    curs = dbi.cursor(conn)
+    nrows = curs.execute('''update when_to_pair_grid
+                            set sun = %s, mon = %s, tue = %s, wed = %s, thu = %s, fri = %s, sat = %s
+                            where course = %s and student_email = %s''',
+                         [ grid.day_bytes(day) for day in week ] + [course, email])
+    conn.commit()
+    return nrows
+
+def read_grid_students(conn, course, grid=None):
+    '''The course's students as dictionaries, like match.read_students
+    makes, with day ints on the course's grid. They can be matched like
+    any others, since match's scores work on ints of any width. Each
+    also has the grid's spec under 'grid', for formatting times.'''
+    from db_adapter import dbi
+    if grid is None:
+        grid = read_grid(conn, course)
+    curs = dbi.cursor(conn)
+    curs.execute('''select student_email, student_name, sun, mon, tue, wed, thu, fri, sat
+                    from when_to_pair_grid where course = %s
+                    order by student_email''',
+                 [course])
+    students = []
+    for row in curs.fetchall():
+        stud = {'course': course, 'student_email': row[0], 'student_name': row[1],
+                'grid': grid.spec()}
+        for day, data in zip(('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'), row[2:]):
+            stud[f'{day}_i'] = grid.day_from_bytes(data)
+        students.append(stud)
+    return students
+
+def read_grid_schedules(conn, course):
+    '''Returns the course's grid, and parallel lists of emails, names and
+    a GridBitset of the schedules.'''
+    from db_adapter import dbi
+    grid = read_grid(conn, course)
+    curs = dbi.cursor(conn)
+    curs.execute('''select student_email, student_name, sun, mon, tue, wed, thu, fri, sat
+                    from when_to_pair_grid where course = %s''',
+                 [course])
+    rows = curs.fetchall()
+    weeks = [ [ grid.day_from_bytes(data) for data in row[2:] ] for row in rows ]
+    return (grid,
+            [ row[0] for row in rows ],
+            [ row[1] for row in rows ],
+            GridBitset.from_day_ints(grid, weeks))
@@ -0,0 +1,122 @@
+'''An inverted index of a course's schedules, for questions like "who is
+free Tuesday 2-4pm?"
+
+The when_to_pair table is organized by student: each row is one
+student's week. To find who's free at some time, we'd have to read
+every student and look at each one. A SlotIndex turns that around: for
+each day and slot, it has a bitmap (a Python int) with bit i set if
+student i is free then. Who is free at all of several slots is the AND
+of their bitmaps, and who is free at any of them is the OR, which takes
+microseconds even for a big course.
+
+The app keeps one per course in course_cache, and patches it when a
+schedule is saved, rather than rebuilding it. See SlotIndex.updated.
+
+'''
+
+import numpy as np
+import band
+import slot_codec
+
+class SlotIndex:
+    def __init__(self, emails, names, weeks, codec=slot_codec.codec):
+        '''weeks is a sequence of lists of 7 day ints, Sunday first.'''
+        self.codec = codec
+        self.emails = list(emails)
+        self.names = list(names)
+        self.position = { email: i for i,email in enumerate(self.emails) }
+        self.avail = np.array(weeks, dtype=np.uint32).reshape(len(self.emails), 7)
+        self.bitmaps = build_bitmaps(self.avail, len(codec.labels))
+
+    def __len__(self):
+        return len(self.emails)
+
+    def updated(self, email, week, name=None):
+        '''Returns a copy of the index with this student's schedule
+        replaced (or added, if they're new). The original isn't changed,
+        so other threads can go on using it.'''
+        new = SlotIndex.__new__(SlotIndex)
+        new.codec = self.codec
+        new.emails = self.emails
+        new.names = self.names
+        new.position = self.position
+        i = self.position.get(email)
+        if i is None:
+            i = len(self.emails)
+            new.emails = self.emails + [email]
+            new.names = self.names + [name or email]
+            new.position = dict(self.position)
+            new.position[email] = i
+            new.avail = np.vstack([self.avail, np.zeros((1, 7), dtype=np.uint32)])
+        else:
+            new.avail = self.avail.copy()
+        new.avail[i] = week
+        bit = 1 << i
+        new.bitmaps = []
+        for day, day_maps in enumerate(self.bitmaps):
+            sched = int(week[day])
+            new.bitmaps.append([ (bitmap | bit) if sched >> slot & 1 else (bitmap & ~bit)
+                                 for slot, bitmap in enumerate(day_maps) ])
+        return new
+
+    # queries. Each returns a bitmap of students; see members.
+
+    def free_all(self, day, slots):
+        '''students free at every one of the slots (bit numbers) on day
+        (0 is Sunday)'''
+        result = (1 << len(self)) - 1
+        for slot in slots:
+            result &= self.bitmaps[day][slot]
+        return result
+
+    def free_any(self, day, slots):
+        '''students free at at least one of the slots on day'''
+        result = 0
+        for slot in slots:
+            result |= self.bitmaps[day][slot]
+        return result
+
+    def free_range(self, day, start, end, mode='all'):
+        '''students free from start to end (times like 14:00 and 16:00)
+        on day; with mode='any', at any time in that range'''
+        slots = range_slots(self.codec, start, end)
+        if mode == 'any':
+            return self.free_any(day, slots)
+        return self.free_all(day, slots)
+
+    def overlapping(self, email, min_slots):
+        '''students (other than this one) who share at least min_slots
+        free slots with them over the week'''
+        i = self.position[email]
+        counts = band.popcount(self.avail & self.avail[i]).sum(axis=1, dtype=np.int32)
+        counts[i] = -1
+        result = 0
+        for j in np.flatnonzero(counts >= min_slots).tolist():
+            result |= 1 << j
+        return result
+
+    def members(self, bitmap):
+        '''list of the indexes of the students in the bitmap'''
+        result = []
+        while bitmap:
+            low = bitmap & -bitmap
+            result.append(low.bit_length() - 1)
+            bitmap ^= low
+        return result
+
+def build_bitmaps(avail, n_slots):
+    '''bitmaps[day][slot] has bit i set if avail[i, day] has that slot.
+    Done by transposing avail, one day at a time, with packbits.'''
+    slot_bits = np.arange(n_slots, dtype=np.uint32)
+    bitmaps = []
+    for day in range(7):
+        # (n_slots, n) array of booleans: is student i free at slot s?
+        free = ((avail[:, day][None, :] >> slot_bits[:, None]) & 1).astype(np.uint8)
+        packed = np.packbits(free, axis=1, bitorder='little')
+        bitmaps.append([ int.from_bytes(row.tobytes(), 'little') for row in packed ])
+    return bitmaps
+
+def range_slots(codec, start, end):
+    '''bit numbers of the slots from start to end, like 14:00 and 16:00'''
+    day_int = codec.parse_ranges([f'{start}-{end}'])
+    return [ first + k for first, length in codec.runs(day_int) for k in range(length) ]
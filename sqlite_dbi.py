@@ -0,0 +1,178 @@
+'''A stand-in for cs304dbi that uses SQLite, for tests, benchmarks and
+offline work without a MySQL server. It has the same functions
+(conf, connect, cursor, dict_cursor) and creates the tables of
+table_setup.sql.
+
+The day columns are plain integers here, rather than MySQL SETs, so
+the packed int is stored directly. The SQL the rest of the code uses
+is translated on the way through:
+
+* %s placeholders become ?
+* a scottdb. prefix on table names is dropped
+* ON DUPLICATE KEY UPDATE col = values(col) becomes
+  ON CONFLICT (primary key) DO UPDATE SET col = excluded.col
+
+and a SELECT returns its row count from execute(), as pymysql does.
+That's enough for the queries in this repo, not for SQL in general.
+
+By default the database is a shared in-memory one, which lasts as long
+as the process. Call set_path to use a file instead.
+
+'''
+
+import re
+import sqlite3
+
+SCHEMA = '''
+create table if not exists when_to_pair(
+    course varchar(20),
+    student_email varchar(8),
+    student_name varchar(50),
+    sun integer default 0,
+    mon integer default 0,
+    tue integer default 0,
+    wed integer default 0,
+    thu integer default 0,
+    fri integer default 0,
+    sat integer default 0,
+    primary key (course, student_email)
+    );
+create table if not exists when_to_pair_results(
+    course varchar(20),
+    algorithm varchar(20),
+    params_hash char(40),
+    schedule_hash char(40),
+    params text,
+    score int,
+    result mediumtext,
+    created timestamp default current_timestamp,
+    primary key (course, algorithm, params_hash, schedule_hash)
+    );
+create table if not exists when_to_pair_grids(
+    course varchar(20) primary key,
+    slot_minutes int,
+    start_minute int,
+    end_minute int
+    );
+create table if not exists when_to_pair_grid(
+    course varchar(20),
+    student_email varchar(8),
+    student_name varchar(50),
+    sun blob,
+    mon blob,
+    tue blob,
+    wed blob,
+    thu blob,
+    fri blob,
+    sat blob,
+    primary key (course, student_email)
+    );
+'''
+
+# needed to turn ON DUPLICATE KEY into ON CONFLICT
+PRIMARY_KEYS = {'when_to_pair': 'course, student_email',
+                'when_to_pair_results': 'course, algorithm, params_hash, schedule_hash',
+                'when_to_pair_grids': 'course',
+                'when_to_pair_grid': 'course, student_email'}
+
+MEMORY = 'file:when_to_pair?mode=memory&cache=shared'
+
+_path = MEMORY
+_keeper = None                  # keeps the in-memory database alive
+
+def set_path(path):
+    '''Use the SQLite database in this file; None means in memory.'''
+    global _path
+    _path = MEMORY if path is None else path
+
+def conf(db=None):
+    '''Accepted for compatibility with cs304dbi; the database name is
+    ignored. Creates the tables if necessary.'''
+    global _keeper
+    conn = connect()
+    if _path == MEMORY and _keeper is None:
+        _keeper = conn
+    else:
+        conn.close()
+
+def connect():
+    raw = sqlite3.connect(_path, uri=_path.startswith('file:'),
+                          check_same_thread=False)
+    raw.executescript(SCHEMA)
+    return Connection(raw)
+
+def cursor(conn):
+    return conn.cursor()
+
+def dict_cursor(conn):
+    return conn.cursor(as_dict=True)
+
+_on_duplicate = re.compile(r'on\s+duplicate\s+key\s+update', re.IGNORECASE)
+_values_fn = re.compile(r'values\((\w+)\)', re.IGNORECASE)
+_into_table = re.compile(r'insert\s+into\s+(\w+)', re.IGNORECASE)
+
+def translate(sql):
+    '''Translates the MySQL this repo uses into SQLite.'''
+    sql = sql.replace('%s', '?').replace('scottdb.', '')
+    match = _on_duplicate.search(sql)
+    if match:
+        table = _into_table.search(sql).group(1)
+        head = sql[:match.start()]
+        tail = _values_fn.sub(r'excluded.\1', sql[match.end():])
+        sql = f'{head} on conflict ({PRIMARY_KEYS[table]}) do update set {tail}'
+    return sql
+
+class Connection:
+    def __init__(self, raw):
+        self.raw = raw
+
+    def cursor(self, as_dict=False):
+        return Cursor(self.raw, as_dict)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+class Cursor:
+    def __init__(self, raw, as_dict):
+        self.curs = raw.cursor()
+        self.as_dict = as_dict
+        self.rows = []
+        self.rowcount = -1
+
+    def execute(self, sql, params=()):
+        self.curs.execute(translate(sql), params)
+        if self.curs.description is None:
+            self.rows = []
+            self.rowcount = self.curs.rowcount
+        else:
+            rows = self.curs.fetchall()
+            if self.as_dict:
+                names = [ desc[0] for desc in self.curs.description ]
+                rows = [ dict(zip(names, row)) for row in rows ]
+            self.rows = rows
+            self.rowcount = len(rows)
+        return self.rowcount
+
+    def executemany(self, sql, seq_of_params):
+        self.curs.executemany(translate(sql), seq_of_params)
+        self.rows = []
+        self.rowcount = self.curs.rowcount
+        return self.rowcount
+
+    def fetchone(self):
+        if len(self.rows) == 0:
+            return None
+        return self.rows.pop(0)
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        self.curs.close()
@@ -1,5 +1,8 @@
 use scottdb;
 
+-- This starts over, dropping everyone's schedules. To add the newer
+-- tables to an existing database instead, use migrate_tables.sql
+
 drop table if exists when_to_pair;
 
 create table when_to_pair(
@@ -15,3 +18,50 @@ create table when_to_pair(
     sat set('900','930','1000','1030','1100','1130','1200','1230','1300','1330','1400','1430','1500','1530','1600','1630','1700','1730','1800','1830','1900','1930','2000','2030','2100','2130','2200','2230','2300','2330'),
     primary key (course, student_email)
                );
+
+-- finished matchings, so that the same request for the same schedules
+-- can be answered without running the algorithm again. See jobs.py
+
+drop table if exists when_to_pair_results;
+
+create table when_to_pair_results(
+    course varchar(20),
+    algorithm varchar(20) comment 'like greedy or two_greedy',
+    params_hash char(40) comment 'sha1 of the params JSON',
+    schedule_hash char(40) comment 'sha1 of all the schedules in the course',
+    params text comment 'JSON of the algorithm parameters, with any constraints',
+    score int,
+    result mediumtext comment 'JSON of the matching',
+    created timestamp default current_timestamp,
+    primary key (course, algorithm, params_hash, schedule_hash)
+               );
+
+-- schedules on grids other than the standard 30 half-hours from 9am,
+-- which can have more slots than a SET allows. Each day is the packed
+-- int as bytes, least significant first, so 36 bytes is room for
+-- 288 slots: 5 minutes around the clock. See slot_grid.py
+
+drop table if exists when_to_pair_grids;
+
+create table when_to_pair_grids(
+    course varchar(20) primary key,
+    slot_minutes int comment 'like 15 or 30',
+    start_minute int comment 'minutes after midnight the first slot starts',
+    end_minute int comment 'minutes after midnight the last slot ends'
+               );
+
+drop table if exists when_to_pair_grid;
+
+create table when_to_pair_grid(
+    course varchar(20) comment 'like cs304-fa24',
+    student_email varchar(8) comment 'ww123',
+    student_name varchar(50) comment 'their preferred name',
+    sun varbinary(36),
+    mon varbinary(36),
+    tue varbinary(36),
+    wed varbinary(36),
+    thu varbinary(36),
+    fri varbinary(36),
+    sat varbinary(36),
+    primary key (course, student_email)
+               );
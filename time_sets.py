@@ -4,7 +4,9 @@ slots of a day can be represented in a 32-bit integer. Very cool. So,
 we are going to use that internally and in the database.
 
 We'll allow for time slots for all 7 days of the week, so we'll have a
-list of 7 integers.
+list of 7 integers. Internally, a Time_Set packs those 7 into a single
+Python int, 30 bits per day, and TimeSetArray keeps thousands of them
+in a NumPy array, for department-sized analyses.
 
 The class below is an abstraction that allows us the ability to pass
 these things around and print them without getting into some of the
@@ -13,53 +15,103 @@ translations from ints to lists of timeslots and vice versa.
 '''
 
 import random
+import sys
+import numpy as np
+import band
+import overlap_export
+import slot_codec
 from day_number import *
 from typing import Union
 
 all_slots = "900,930,1000,1030,1100,1130,1200,1230,1300,1330,1400,1430,1500,1530,1600,1630,1700,1730,1800,1830,1900,1930,2000,2030,2100,2130,2200,2230,2300,2330".split(',')
 
+# Each day gets DAY_BITS bits of one Python int, Sunday in the lowest.
+DAY_BITS = len(all_slots)
+DAY_MASK = (1 << DAY_BITS) - 1
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+else:
+    # bit_count is python 3.10, so we'll use this instead
+    def popcount(val: int) -> int:
+        return bin(val).count('1')
+
 class Time_Set:
+    '''The whole week is packed into one int, so union, intersection,
+    difference and counting are each a single operation, not a loop
+    over days. The constructor still takes a list of 7 day ints.'''
+    __slots__ = ('_week',)
+
     def __init__(self, avail: list[int] = None):
-        self._avail = avail
+        self._week: int = 0
+        if avail is not None:
+            for day in range(7):
+                self.set_avail_day(day, avail[day])
+
+    @classmethod
+    def from_week(cls, week: int):
+        '''Make one from a packed week int.'''
+        ts = cls()
+        ts._week = week
+        return ts
+
+    @property
+    def week(self) -> int:
+        '''the packed week int'''
+        return self._week
 
     def total_free_time(self):
         '''return the number of available half-hour slots'''
-        if self._avail is None:
-            return 0
-        sum = 0
-        for day in range(7):
-            # bit_count is python 3.10, so we'll use this instead
-            bit_count = bin(self._avail[day]).count('1')
-            sum += bit_count
-        return sum
+        return popcount(self._week)
+
+    popcount = total_free_time
 
     def set_avail_day(self, day: int, slots: int):
         '''set the availability for a particular day'''
-        if self._avail is None:
-            self._avail = [ 0 for i in range(7) ]
-        self._avail[day] = slots
+        shift = day * DAY_BITS
+        self._week = (self._week & ~(DAY_MASK << shift)) | ((slots & DAY_MASK) << shift)
 
     def avail_int(self, day: int):
         '''returns the availability as an integer'''
-        if self._avail is None:
-            return 0
-        return self._avail[day]
+        return (self._week >> (day * DAY_BITS)) & DAY_MASK
+
+    def avail_ints(self):
+        '''returns the availability as a list of 7 integers'''
+        return [ self.avail_int(day) for day in range(7) ]
 
     def avail(self, day: int):
         '''return a list of slots available on a particular day'''
-        if self._avail is None:
-            return []
-        slots: list = []
-        day_sched: int = self._avail[day]
-        for i,slot in enumerate(all_slots):
-            slot_val: int = 1 << i
-            if day_sched & slot_val:
-                slots.append(slot)
-        return slots
+        return slot_codec.decode(self.avail_int(day))
+
+    def ranges(self, day: int):
+        '''return a list of time ranges, like 10:00–13:30, on a particular day'''
+        return slot_codec.ranges(self.avail_int(day))
 
     def random_availability(self):
         limit = 1 << len(all_slots)
-        self._avail = [ random.randint(0, limit) for i in range(7) ]
+        for day in range(7):
+            self.set_avail_day(day, random.randint(0, limit-1))
+
+    # set algebra. These return new Time_Sets
+
+    def union(self, other: 'Time_Set'):
+        return Time_Set.from_week(self._week | other._week)
+
+    def intersection(self, other: 'Time_Set'):
+        return Time_Set.from_week(self._week & other._week)
+
+    def difference(self, other: 'Time_Set'):
+        return Time_Set.from_week(self._week & ~other._week)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def __eq__(self, other):
+        return isinstance(other, Time_Set) and self._week == other._week
+
+    def __hash__(self):
+        return hash(self._week)
 
     def __repr__(self):
         val: str = ''
@@ -67,47 +119,104 @@ class Time_Set:
             val += number_to_day[day] + '\t' + ','.join(self.avail(day)) + '\n'
         return val
 
+def intersect_all(time_sets):
+    '''The slots that every one of the time sets has.'''
+    week = None
+    for ts in time_sets:
+        week = ts.week if week is None else week & ts.week
+    return Time_Set.from_week(week or 0)
+
 def time_overlap(ts1, ts2):
-    ts3 = Time_Set()
-    for day in range(7):
-        intersect = ts1.avail_int(day) & ts2.avail_int(day)
-        ts3.set_avail_day(day, intersect)
-    return ts3
+    return ts1 & ts2
+
+def overlap_count(ts1, ts2):
+    '''Size of the overlap, without making a Time_Set for it.'''
+    return popcount(ts1.week & ts2.week)
+
+# ================================================================
+# Many time sets at once
 
-def distance_table(n:int=10):
+class TimeSetArray:
+    '''n time sets, stored as an (n, 7) NumPy array of uint32, one day
+    per column, so that set operations run over all of them at once.
+    The operations take another TimeSetArray of the same length, or a
+    single Time_Set, which is applied to every row.'''
+    __slots__ = ('days',)
+
+    def __init__(self, days):
+        self.days = np.asarray(days, dtype=np.uint32).reshape(-1, 7)
+
+    @classmethod
+    def from_time_sets(cls, time_sets):
+        return cls([ ts.avail_ints() for ts in time_sets ])
+
+    @classmethod
+    def random(cls, n: int):
+        return cls(np.random.randint(0, 1 << DAY_BITS, size=(n, 7), dtype=np.uint32))
+
+    def __len__(self):
+        return len(self.days)
+
+    def __getitem__(self, i):
+        if isinstance(i, (slice, np.ndarray, list)):
+            return TimeSetArray(self.days[i])
+        return Time_Set([ int(day) for day in self.days[i] ])
+
+    def _other(self, other):
+        if isinstance(other, Time_Set):
+            return np.array(other.avail_ints(), dtype=np.uint32)
+        return other.days
+
+    def union(self, other):
+        return TimeSetArray(self.days | self._other(other))
+
+    def intersection(self, other):
+        return TimeSetArray(self.days & self._other(other))
+
+    def difference(self, other):
+        return TimeSetArray(self.days & ~self._other(other))
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def total_free_time(self):
+        '''array of the number of slots in each time set'''
+        return band.popcount(self.days).sum(axis=1, dtype=np.int32)
+
+    popcount = total_free_time
+
+    def intersect_all(self):
+        '''the Time_Set of slots common to all of them'''
+        if len(self) == 0:
+            return Time_Set()
+        return Time_Set([ int(day) for day in np.bitwise_and.reduce(self.days, axis=0) ])
+
+    def union_all(self):
+        return Time_Set([ int(day) for day in np.bitwise_or.reduce(self.days, axis=0) ])
+
+    def overlap_counts(self, block: int = 256):
+        '''n x n array of the size of each pairwise overlap'''
+        n = len(self)
+        counts = np.zeros((n, n), dtype=np.int32)
+        for start in range(0, n, block):
+            rows = self.days[start:start+block]
+            counts[start:start+block] = band.block_counts(rows, self.days)
+        return counts
+
+def distance_table(n:int=10, out=None, fmt='tsv'):
     '''Generate N random schedules and sort them by total free time,
-    and also produce a triangle table of their overlaps.'''
-    ts_list = [ Time_Set() for i in range(n) ]
-    for ts in ts_list:
-        ts.random_availability()
-    ts_list.sort(key=lambda ts: ts.total_free_time())
-    for ts in ts_list:
+    and also produce a triangle table of their overlaps (the number of
+    slots in common), written to out (a filename or file; by default,
+    stdout) by overlap_export.'''
+    tsa = TimeSetArray.random(n)
+    tsa = tsa[np.argsort(tsa.total_free_time(), kind='stable')]
+    for i in range(n):
+        ts = tsa[i]
         print(ts)
         print(ts.total_free_time())
-    # triangle table
-    tt = [ [ time_overlap(ts_list[i], ts_list[j])
-             for i in range(n) ]
-           for j in range(n) ]
-    # header
-    print('X', end='\t')
-    for j in range(n):
-        print(j, end='\t')
-    print()
-    # data
-    for i in range(n):
-        print(i, end='\t')
-        for j in range(n):
-            print(tt[i][j].total_free_time(), end='\t')
-        print()
-    
-'''
-
-            if j <= i:
-                print(' ', end='\t')
-            else:
-                ts = time_overlap(ts_list[i], ts_list[j])
-                print(ts.total_free_time(), end='\t')
-'''
+    overlap_export.export_overlaps(sys.stdout if out is None else out,
+                                   tsa.days, fmt=fmt, kernel='count')
 
 
 if __name__ == '__main__':
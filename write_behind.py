@@ -0,0 +1,107 @@
+'''Write-behind buffering for schedule saves.
+
+Right before a deadline, students click Save over and over, and each
+click used to be its own UPDATE and COMMIT. With write-behind, a save
+just records the latest schedule for that (course, email) in memory
+and returns. A background thread flushes the buffer every `interval`
+seconds, or sooner if more than `max_pending` schedules are waiting,
+writing all of them in one transaction. Ten clicks by the same student
+between flushes cost one UPDATE, not ten.
+
+The price is that a save is not in the database the moment the
+response goes back, and a save for a student who isn't in the course
+can't be reported as an error. Call close() at shutdown so nothing is
+lost; the app registers it with atexit.
+
+'''
+
+import sys
+import threading
+from batching import chunked, DEFAULT_BATCH_SIZE
+
+class WriteBehindBuffer:
+    def __init__(self, pool, interval=0.5, max_pending=200,
+                 batch_size=DEFAULT_BATCH_SIZE, on_flush=None):
+        '''pool is a db_pool.ConnectionPool. on_flush, if given, is
+        called with the list of (course, email) keys after each
+        successful flush.'''
+        self.pool = pool
+        self.interval = interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self._pending = {}      # (course, email) => list of 7 day values
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self.stats = {'saves': 0, 'flushes': 0, 'rows_written': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='write-behind')
+        self._thread.start()
+
+    def put(self, course, email, days):
+        '''Records the latest schedule for this student, replacing any
+        earlier one that hasn't been written yet.'''
+        with self._lock:
+            self._pending[(course, email)] = list(days)
+            self.stats['saves'] += 1
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        '''Writes everything pending in one transaction. Returns the
+        number of schedules written. If the write fails, the schedules
+        go back in the buffer, unless a newer save has replaced them in
+        the meantime.'''
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if len(batch) == 0:
+            return 0
+        rows = [ days + [course, email]
+                 for (course, email), days in batch.items() ]
+        conn = self.pool.checkout()
+        try:
+            curs = conn.cursor()
+            for chunk in chunked(rows, self.batch_size):
+                curs.executemany('''update when_to_pair
+                                    set Sun = %s, Mon = %s, Tue = %s, Wed = %s, Thu = %s, Fri = %s, Sat = %s
+                                    where course = %s and student_email = %s''',
+                                 chunk)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            with self._lock:
+                for key, days in batch.items():
+                    self._pending.setdefault(key, days)
+                self.stats['errors'] += 1
+            raise
+        finally:
+            self.pool.checkin(conn)
+        with self._lock:
+            self.stats['flushes'] += 1
+            self.stats['rows_written'] += len(rows)
+        if self.on_flush is not None:
+            self.on_flush(list(batch.keys()))
+        return len(rows)
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as err:
+                # keep going; the rows are still pending and we'll retry
+                print('write-behind flush failed:', err, file=sys.stderr)
+
+    def close(self):
+        '''Stops the background thread and writes whatever is left.'''
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()